@@ -0,0 +1,216 @@
+import re
+import collections
+
+# One escape sequence: CSI (group 1 holds the parameters, group 2 the final
+# byte, "m" for SGR), OSC (window titles, hyperlinks) up to BEL or ST, any
+# other ESC sequence, or a stray ESC on its own
+ESCAPE_RE = re.compile(r"\x1b(?:\[([0-?]*)[ -/]*([@-~])|\][^\x07\x1b]*(?:\x07|\x1b\\)|[ -/]*[0-~]|)")
+
+# An escape sequence at the very end of a chunk that may continue in the next one
+PARTIAL_ESCAPE_RE = re.compile(r"\x1b(?:\[[0-?]*[ -/]*|[ -/]*)\Z")
+
+# Most characters held back for an unfinished escape sequence; a longer one is dropped
+MAX_PENDING = 4096
+
+# Parameter prefixes of private CSI sequences, which are never SGR
+PRIVATE_PREFIXES = ("<", "=", ">", "?")
+
+# The 16 basic colors (normal, then bright), as in the GNOME (Tango) terminal palette
+PALETTE = [
+    "#2e3436", "#cc0000", "#4e9a06", "#c4a000", "#3465a4", "#75507b", "#06989a", "#d3d7cf",
+    "#555753", "#ef2929", "#8ae234", "#fce94f", "#729fcf", "#ad7fa8", "#34e2e2", "#eeeeec",
+]
+
+# Text attributes set by SGR sequences; colors are "#rrggbb" strings or None for the default
+Style = collections.namedtuple("Style", [
+    "foreground", "background", "bold", "dim", "italic", "underline", "inverse", "strikethrough",
+])
+
+DEFAULT_STYLE = Style(None, None, False, False, False, False, False, False)
+
+# Most (style, parameters) pairs remembered by apply_sgr
+SGR_CACHE_SIZE = 4096
+
+_sgr_cache = {}
+
+def color_256(index):
+    """The "#rrggbb" color of an entry of the xterm 256-color palette"""
+    if index < 16:
+        return PALETTE[index]
+    if index < 232:
+        # 6x6x6 color cube
+        index -= 16
+        levels = [0 if value == 0 else 55 + value * 40 for value in (index // 36, index // 6 % 6, index % 6)]
+        return "#{:02x}{:02x}{:02x}".format(*levels)
+    # Gray ramp
+    level = 8 + (index - 232) * 10
+    return f"#{level:02x}{level:02x}{level:02x}"
+
+def _extended_color(codes, position):
+    """Parse the color after a 38 or 48 code; returns (color or None, codes used)"""
+    if position + 1 < len(codes) and codes[position + 1] == 5:
+        if position + 2 < len(codes):
+            return color_256(min(max(codes[position + 2], 0), 255)), 2
+        return None, 1
+    if position + 1 < len(codes) and codes[position + 1] == 2:
+        if position + 4 < len(codes):
+            red, green, blue = (min(max(value, 0), 255) for value in codes[position + 2:position + 5])
+            return f"#{red:02x}{green:02x}{blue:02x}", 4
+        return None, len(codes) - position - 1
+    return None, 0
+
+def apply_sgr(style, parameters):
+    """Return the style after an SGR sequence with the given parameter string"""
+    key = (style, parameters)
+    cached = _sgr_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    # Sub-parameters (e.g. "4:3" for a curly underline) count as their main code
+    codes = []
+    for parameter in parameters.split(";"):
+        try:
+            codes.append(int(parameter.split(":", 1)[0] or 0))
+        except ValueError:
+            codes.append(0)
+    
+    attributes = style._asdict()
+    position = 0
+    while position < len(codes):
+        code = codes[position]
+        if code == 0:
+            attributes = DEFAULT_STYLE._asdict()
+        elif code == 1:
+            attributes["bold"] = True
+        elif code == 2:
+            attributes["dim"] = True
+        elif code == 3:
+            attributes["italic"] = True
+        elif code in (4, 21):
+            attributes["underline"] = True
+        elif code == 7:
+            attributes["inverse"] = True
+        elif code == 9:
+            attributes["strikethrough"] = True
+        elif code == 22:
+            attributes["bold"] = attributes["dim"] = False
+        elif code == 23:
+            attributes["italic"] = False
+        elif code == 24:
+            attributes["underline"] = False
+        elif code == 27:
+            attributes["inverse"] = False
+        elif code == 29:
+            attributes["strikethrough"] = False
+        elif 30 <= code <= 37:
+            attributes["foreground"] = PALETTE[code - 30]
+        elif 40 <= code <= 47:
+            attributes["background"] = PALETTE[code - 40]
+        elif 90 <= code <= 97:
+            attributes["foreground"] = PALETTE[code - 90 + 8]
+        elif 100 <= code <= 107:
+            attributes["background"] = PALETTE[code - 100 + 8]
+        elif code == 39:
+            attributes["foreground"] = None
+        elif code == 49:
+            attributes["background"] = None
+        elif code in (38, 48):
+            color, used = _extended_color(codes, position)
+            if color is not None:
+                attributes["foreground" if code == 38 else "background"] = color
+            position += used
+        position += 1
+    
+    result = Style(**attributes)
+    if len(_sgr_cache) >= SGR_CACHE_SIZE:
+        _sgr_cache.clear()
+    _sgr_cache[key] = result
+    return result
+
+def strip_ansi(text):
+    """Remove all escape sequences from text (e.g. before it is sent to the model)"""
+    if "\x1b" not in text:
+        return text
+    return ESCAPE_RE.sub("", text)
+
+class AnsiParser:
+    """
+    Incremental parser for terminal output with ANSI escape sequences.
+    
+    feed() takes the output chunk by chunk, as it streams in, and returns the
+    text without escape sequences plus the styled runs in it. The current
+    style and an escape sequence cut off at the end of a chunk carry over to
+    the next chunk. Only SGR (colors and text attributes) is interpreted;
+    cursor movement, erasing, titles and the like are dropped.
+    """
+    
+    def __init__(self):
+        self.style = DEFAULT_STYLE
+        self._pending = ""
+    
+    def reset(self):
+        """Forget the current style and any unfinished escape sequence"""
+        self.style = DEFAULT_STYLE
+        self._pending = ""
+    
+    def feed(self, text):
+        """
+        Parse the next chunk; returns (plain text, runs).
+        
+        runs is a list of (start, end, style) with character offsets into the
+        plain text, for the parts that don't have the default style. Adjacent
+        parts with the same style form a single run.
+        """
+        if self._pending:
+            text = self._pending + text
+            self._pending = ""
+        
+        # Fast path for the common chunk without escapes
+        if "\x1b" not in text:
+            if not text or self.style == DEFAULT_STYLE:
+                return text, []
+            return text, [(0, len(text), self.style)]
+        
+        # split() gives the text between the escapes, with the CSI parameters
+        # and final byte of each escape (None for other sequences) in between
+        pieces = ESCAPE_RE.split(self._hold_partial(text))
+        style = self.style
+        runs = []
+        length = len(pieces[0])
+        if length and style != DEFAULT_STYLE:
+            runs.append((0, length, style))
+        for index in range(1, len(pieces), 3):
+            # Only SGR changes the style; private sequences (e.g. "\x1b[>4m") don't
+            if pieces[index + 1] == "m" and not pieces[index].startswith(PRIVATE_PREFIXES):
+                style = apply_sgr(style, pieces[index])
+            
+            part_length = len(pieces[index + 2])
+            if not part_length:
+                continue
+            end = length + part_length
+            if style != DEFAULT_STYLE:
+                if runs and runs[-1][1] == length and runs[-1][2] == style:
+                    runs[-1] = (runs[-1][0], end, style)
+                else:
+                    runs.append((length, end, style))
+            length = end
+        
+        self.style = style
+        return "".join(pieces[0::3]), runs
+    
+    def _hold_partial(self, text):
+        """Keep back an escape sequence that isn't finished at the end of text"""
+        window = max(0, len(text) - MAX_PENDING)
+        start = text.rfind("\x1b", window)
+        if start < 0:
+            return text
+        
+        # An OSC runs until its terminator, which may still be coming
+        osc = text.rfind("\x1b]", window)
+        if osc >= 0 and "\x07" not in text[osc:] and "\x1b\\" not in text[osc:]:
+            start = osc
+        elif not PARTIAL_ESCAPE_RE.match(text, start):
+            return text
+        
+        self._pending = text[start:]
+        return text[:start]
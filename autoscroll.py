@@ -0,0 +1,70 @@
+import gi
+
+gi.require_version('Gtk', '4.0')
+from gi.repository import GLib
+
+class AutoScroller:
+    """
+    Keeps a ScrolledWindow pinned to the bottom while its content grows.
+    
+    Scroll requests are coalesced into at most one adjustment per frame. When the
+    user scrolls away from the bottom, following pauses until they scroll back.
+    """
+    
+    # Distance from the bottom (in pixels) that still counts as being at the bottom
+    BOTTOM_THRESHOLD = 24
+    
+    def __init__(self, scrolled_window):
+        self.scrolled = scrolled_window
+        self.vadj = scrolled_window.get_vadjustment()
+        
+        # Whether we keep the view at the bottom as the content grows
+        self.following = True
+        
+        # Pending tick callback and the last value we set ourselves
+        self._tick_id = None
+        self._scrolled_value = None
+        
+        self.vadj.connect("value-changed", self._on_value_changed)
+        self.vadj.connect("notify::upper", self._on_size_changed)
+        self.vadj.connect("notify::page-size", self._on_size_changed)
+    
+    def is_at_bottom(self):
+        """Check if the view is scrolled to (or very near) the bottom"""
+        bottom = self.vadj.get_upper() - self.vadj.get_page_size()
+        return self.vadj.get_value() >= bottom - self.BOTTOM_THRESHOLD
+    
+    def request(self):
+        """Scroll to the bottom on the next frame, if we are following"""
+        if not self.following or self._tick_id is not None:
+            return
+        self._tick_id = self.scrolled.add_tick_callback(self._on_tick)
+    
+    def scroll_to_bottom(self):
+        """Resume following and scroll to the bottom on the next frame"""
+        self.following = True
+        self.request()
+    
+    def _on_tick(self, widget, frame_clock):
+        """Apply the pending scroll, once per frame"""
+        self._tick_id = None
+        if self.following:
+            bottom = self.vadj.get_upper() - self.vadj.get_page_size()
+            if self.vadj.get_value() != bottom:
+                self._scrolled_value = bottom
+                self.vadj.set_value(bottom)
+        return GLib.SOURCE_REMOVE
+    
+    def _on_value_changed(self, vadj):
+        """Detect the user scrolling away from (or back to) the bottom"""
+        value = vadj.get_value()
+        if self._scrolled_value is not None and abs(value - self._scrolled_value) < 1:
+            # This is our own scroll
+            self._scrolled_value = None
+            return
+        self._scrolled_value = None
+        self.following = self.is_at_bottom()
+    
+    def _on_size_changed(self, vadj, pspec):
+        """Follow the content as it grows"""
+        self.request()
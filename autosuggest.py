@@ -0,0 +1,85 @@
+import os
+import gi
+
+gi.require_version('Gtk', '4.0')
+from gi.repository import Gtk
+
+class AutoSuggestion:
+    """
+    Fish-style inline suggestion from the history for a Gtk.Entry.
+    
+    On every change of the entry, the history's prefix index is asked for
+    the best command starting with the text (see PrefixIndex). The rest of
+    that command is shown dimmed right after the text, in a label laid over
+    the entry, while the cursor is at the end and the whole command fits.
+    accept() puts the suggested command in the entry.
+    """
+    
+    def __init__(self, entry, overlay, history):
+        self.entry = entry
+        self.overlay = overlay
+        self.history = history
+        self.suggestion = None
+        
+        self.label = Gtk.Label()
+        self.label.set_halign(Gtk.Align.START)
+        self.label.set_valign(Gtk.Align.CENTER)
+        self.label.add_css_class("autosuggestion")
+        self.label.set_can_target(False)
+        self.label.set_visible(False)
+        overlay.add_overlay(self.label)
+        
+        # The text widget inside the entry, which lays out and scrolls the text
+        self._text = entry.get_first_child()
+        while self._text is not None and not isinstance(self._text, Gtk.Text):
+            self._text = self._text.get_next_sibling()
+        
+        entry.connect("changed", self._on_changed)
+        entry.connect("notify::cursor-position", self._on_cursor_moved)
+    
+    def _on_changed(self, entry):
+        self.refresh()
+    
+    def _on_cursor_moved(self, entry, param):
+        self._update_label()
+    
+    def refresh(self):
+        """Look up the suggestion for the current text"""
+        text = self.entry.get_text()
+        self.suggestion = self.history.suggest(text, os.getcwd()) if text else None
+        self._update_label()
+    
+    def _update_label(self):
+        """Show the rest of the suggestion after the text, if it can be shown"""
+        text = self.entry.get_text()
+        if (self.suggestion is None or self._text is None or not self.suggestion.startswith(text)
+                or self.entry.get_position() != len(text)):
+            self.label.set_visible(False)
+            return
+        
+        # Measured with the font of the text, where the label goes
+        rest = self.suggestion[len(text):]
+        text_width = self._text.create_pango_layout(text).get_pixel_size()[0]
+        rest_width = self._text.create_pango_layout(rest).get_pixel_size()[0]
+        found, x, _ = self._text.translate_coordinates(self.overlay, 0, 0)
+        
+        # A text scrolled sideways (or a suggestion running past the end) can't be lined up
+        if not found or text_width + rest_width > self._text.get_width():
+            self.label.set_visible(False)
+            return
+        self.label.set_text(rest)
+        self.label.set_margin_start(int(x) + text_width)
+        self.label.set_visible(True)
+    
+    def clear(self):
+        """Drop the suggestion until the text changes again"""
+        self.suggestion = None
+        self.label.set_visible(False)
+    
+    def accept(self):
+        """Complete the entry with the shown suggestion; returns False if none is shown"""
+        if not self.label.get_visible():
+            return False
+        self.entry.set_text(self.suggestion)
+        self.entry.set_position(-1)
+        return True
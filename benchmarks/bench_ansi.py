@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Throughput of the incremental ANSI parser on multi-megabyte colored logs"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+# Run from the repository root or from the benchmarks directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ansi import AnsiParser, strip_ansi
+
+# Lines like the ones colored output is made of
+SAMPLE_LINES = {
+    # pytest: a colored status word per line
+    "pytest": lambda n: f"tests/test_module_{n % 97}.py::test_case_{n} \x1b[32mPASSED\x1b[0m"
+                        f"{' ' * (n % 20)}\x1b[32m[{n % 100:3d}%]\x1b[0m",
+    # ls --color: many short colored names
+    "ls": lambda n: "  ".join(f"\x1b[01;{34 if i % 3 else 32}mname_{n}_{i}\x1b[0m" for i in range(6)),
+    # Log lines with 256-color and truecolor levels
+    "log": lambda n: f"\x1b[38;5;{n % 256}m2024-01-01 12:00:{n % 60:02d}\x1b[0m "
+                     f"\x1b[1;38;2;200;{n % 256};0mWARN\x1b[0m request {n} took {n % 1000} ms",
+    # No escapes at all, the fast path
+    "plain": lambda n: f"tests/test_module_{n % 97}.py::test_case_{n} PASSED [{n % 100:3d}%]",
+}
+
+def make_log(name, size):
+    """Build about size characters of log lines"""
+    lines = []
+    length = 0
+    n = 0
+    while length < size:
+        line = SAMPLE_LINES[name](n) + "\n"
+        lines.append(line)
+        length += len(line)
+        n += 1
+    return "".join(lines)
+
+def chunked(text, chunk_size):
+    """Split text into reads of random size around chunk_size, like a pipe delivers them"""
+    rng = random.Random(0)
+    chunks = []
+    position = 0
+    while position < len(text):
+        size = rng.randint(chunk_size // 2, chunk_size)
+        chunks.append(text[position:position + size])
+        position += size
+    return chunks
+
+def bench_parser(chunks):
+    """Feed the chunks through a parser; returns (seconds, plain characters, runs)"""
+    parser = AnsiParser()
+    characters = 0
+    run_count = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        text, runs = parser.feed(chunk)
+        characters += len(text)
+        run_count += len(runs)
+    return time.perf_counter() - start, characters, run_count
+
+def bench_strip(text):
+    """Strip the whole text at once, as for a tool result; returns seconds"""
+    start = time.perf_counter()
+    strip_ansi(text)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=16, help="log size in MiB (default: 16)")
+    parser.add_argument("--chunk", type=int, default=64 * 1024, help="largest read in characters (default: 65536)")
+    args = parser.parse_args()
+    
+    size = args.size * 1024 * 1024
+    for name in SAMPLE_LINES:
+        text = make_log(name, size)
+        chunks = chunked(text, args.chunk)
+        seconds, characters, run_count = bench_parser(chunks)
+        strip_seconds = bench_strip(text)
+        mib = len(text) / (1024 * 1024)
+        print(f"{name:6} parse {mib / seconds:7.1f} MiB/s ({run_count} runs, "
+              f"{characters / len(text):.0%} text)  strip {mib / strip_seconds:7.1f} MiB/s")
+
+if __name__ == "__main__":
+    main()
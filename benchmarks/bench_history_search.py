@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Latency of reverse search (Ctrl-R) and inline suggestions over a large command history"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+# Run from the repository root or from the benchmarks directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from history import CommandHistory
+
+# Building blocks of made-up but realistic commands
+PROGRAMS = ["git", "ls", "cd", "grep", "docker", "kubectl", "python", "make", "ssh", "systemctl", "cargo", "npm"]
+ARGUMENTS = ["status", "log --oneline", "-la", "checkout", "build", "run --rm", "get pods", "test", "install",
+             "restart nginx", "commit -m", "push origin", "diff HEAD~1", "logs -f", "describe node"]
+PATHS = ["src", "tests", "docs", "/etc/nginx", "~/projects", "build/release", "deploy.yaml", "main.py"]
+
+# Queries typed character by character, like a user would
+QUERIES = ["git", "dock run", "kubectl get", "nginx", "ssh", "gco", "restart", "zzzz", "main.py", "st"]
+
+def make_commands(count):
+    """count distinct commands"""
+    rng = random.Random(0)
+    commands = set()
+    while len(commands) < count:
+        commands.add(f"{rng.choice(PROGRAMS)} {rng.choice(ARGUMENTS)} {rng.choice(PATHS)} {rng.randrange(100000)}")
+    return list(commands)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=200000, help="commands in the history (default: 200000)")
+    args = parser.parse_args()
+    
+    commands = make_commands(args.count)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "history.jsonl")
+        history = CommandHistory(path, legacy_path=None)
+        history.load()
+        history.sync()
+        start = time.perf_counter()
+        for command in commands:
+            history.add(command, cwd=directory)
+        print(f"added {len(history)} commands in {time.perf_counter() - start:.2f} s")
+        history.sync()
+        print(f"indexed them after {time.perf_counter() - start:.2f} s")
+        history.close()
+        
+        # Start up again from the journal; it is read and indexed in the background
+        start = time.perf_counter()
+        history = CommandHistory(path, legacy_path=None)
+        history.load()
+        print(f"load() returned after {(time.perf_counter() - start) * 1000:.1f} ms")
+        history.sync()
+        print(f"loaded the journal in {time.perf_counter() - start:.2f} s")
+        while not history.search_index.ready or not history.prefix_index.ready:
+            time.sleep(0.05)
+        print(f"indexes ready after {time.perf_counter() - start:.2f} s")
+        
+        for query in QUERIES:
+            # Every prefix, as the query is typed
+            timings = []
+            for length in range(1, len(query) + 1):
+                start = time.perf_counter()
+                results = history.search(query[:length])
+                timings.append(time.perf_counter() - start)
+            print(f"{query!r:15} {len(results):3} results  per keystroke: "
+                  f"median {sorted(timings)[len(timings) // 2] * 1000:.3f} ms, max {max(timings) * 1000:.3f} ms")
+        
+        # Inline suggestions for commands typed from the start
+        for command in commands[:5]:
+            timings = []
+            for length in range(1, len(command) + 1):
+                start = time.perf_counter()
+                history.suggest(command[:length], cwd=directory)
+                timings.append(time.perf_counter() - start)
+            print(f"suggest {command[:20]!r:24} per keystroke: "
+                  f"median {sorted(timings)[len(timings) // 2] * 1e6:.1f} us, max {max(timings) * 1e6:.1f} us")
+        history.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Throughput of the streaming command reader on commands with huge output"""
+
+import os
+import sys
+import time
+import argparse
+
+# Run from the repository root or from the benchmarks directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from command_runner import run_streaming
+from output_buffer import OutputBuffer
+
+def bench(command, keep_output):
+    """Run the command through the reader and return (seconds, characters, chunks)"""
+    buffer = OutputBuffer()
+    stats = {"chars": 0, "chunks": 0}
+    
+    def on_output(text):
+        stats["chars"] += len(text)
+        stats["chunks"] += 1
+        if keep_output:
+            buffer.append(text)
+    
+    start = time.perf_counter()
+    run_streaming(command, on_output)
+    return time.perf_counter() - start, stats["chars"], stats["chunks"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1024, help="output size in MiB (default: 1024)")
+    parser.add_argument("--keep", action="store_true", help="also keep the output in an OutputBuffer")
+    args = parser.parse_args()
+    
+    size = args.size * 1024 * 1024
+    commands = [
+        # Long lines, no multi-byte characters
+        ("ascii", f"head -c {size} /dev/zero | tr '\\0' 'a'"),
+        # Short lines, like most real output
+        ("lines", f"yes 'the quick brown fox jumps over the lazy dog' | head -c {size}"),
+        # Multi-byte UTF-8 split across reads
+        ("utf-8", f"yes 'ünïcödé ✓ 日本語' | head -c {size}"),
+    ]
+    
+    for name, command in commands:
+        seconds, chars, chunks = bench(command, args.keep)
+        print(f"{name:6} {size / seconds / (1024 * 1024):8.1f} MiB/s  {chars} chars in {chunks} chunks, {seconds:.2f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import os
+import glob
+import time
+import copy
+import shlex
+import threading
+import collections
+
+# Commands (first word) that only read state, for the command cache. du is
+# left out: it reads a whole tree, whose changes the cache can't see
+READ_ONLY_COMMANDS = {
+    "uname", "cat", "ls", "df", "pwd", "whoami", "id", "hostname", "head", "tail",
+    "wc", "stat", "file", "which", "lsb_release", "printenv", "nproc", "arch", "lscpu",
+    "grep", "cut", "tr",
+}
+
+# Read-only git subcommands whose output only depends on the index and the
+# refs, whatever their arguments; status and diff compare the work tree, and
+# an edited file doesn't change anything the cache checks
+READ_ONLY_GIT_COMMANDS = {"log", "show", "rev-parse", "ls-files"}
+
+# Options that make a command read a whole directory tree: short option
+# letters and long options
+RECURSIVE_OPTIONS = {
+    "grep": ("rR", {"--recursive", "--dereference-recursive", "--directories=recurse"}),
+    "ls": ("R", {"--recursive"}),
+}
+
+# git ls-files options that compare the index with the work tree
+GIT_WORK_TREE_LISTINGS = {"-m", "-o", "-d", "-k", "--modified", "--others", "--deleted", "--killed"}
+
+# Characters that make a word a glob pattern
+GLOB_CHARS = set("*?[")
+
+# git subcommands that only read state with these arguments (and none);
+# with others they create, rename or delete branches and remotes
+READ_ONLY_GIT_LISTINGS = {
+    "branch": {"-a", "-r", "--all", "--remotes", "--list", "-v", "-vv"},
+    "remote": {"-v", "--verbose"},
+}
+
+# Characters that make a command line more than a pipeline of plain commands
+# (redirections, command lists, substitutions), which are never cached
+UNSAFE_SHELL_CHARS = set(";&<>`$(){}\n")
+
+# Environment variables that can change the output of a cached command
+CACHE_ENV_VARS = ("PATH", "HOME", "USER", "LANG", "LC_ALL", "TZ", "GIT_DIR", "GIT_WORK_TREE")
+
+def _is_read_only_words(words):
+    """Check if one simple command (split into words) only reads state"""
+    name, args = words[0], words[1:]
+    if name == "git":
+        if not args:
+            return False
+        # --output writes the diff or log to a file
+        if any(arg.startswith("--output") for arg in args):
+            return False
+        if args[0] == "ls-files":
+            return not any(arg in GIT_WORK_TREE_LISTINGS or _has_short_option(arg, "modk") for arg in args[1:])
+        if args[0] in READ_ONLY_GIT_LISTINGS:
+            return set(args[1:]) <= READ_ONLY_GIT_LISTINGS[args[0]]
+        return args[0] in READ_ONLY_GIT_COMMANDS
+    if name == "sort":
+        # -o writes the sorted lines to a file, also inside a group of short options
+        return not any(arg.startswith("--o") or (arg.startswith("-") and not arg.startswith("--") and "o" in arg)
+                       for arg in args)
+    if name in RECURSIVE_OPTIONS:
+        letters, long_options = RECURSIVE_OPTIONS[name]
+        if any(arg in long_options or _has_short_option(arg, letters) for arg in args):
+            return False
+        # grep -d recurse
+        if name == "grep" and any(arg == "-d" and value == "recurse" for arg, value in zip(args, args[1:])):
+            return False
+    if name == "uniq":
+        # A second file operand is the output file
+        return len([arg for arg in args if arg == "-" or not arg.startswith("-")]) <= 1
+    return name in READ_ONLY_COMMANDS
+
+def _has_short_option(arg, letters):
+    """Check if a word is a group of short options with one of the given letters"""
+    return arg.startswith("-") and not arg.startswith("--") and any(letter in arg[1:] for letter in letters)
+
+def _git_paths(git_dir):
+    """The files of a git directory whose change means git log/show/ls-files output changed"""
+    paths = {os.path.join(git_dir, name) for name in ("index", "HEAD", "packed-refs")}
+    
+    # A commit renames the branch ref into place, which also changes its directory
+    try:
+        with open(os.path.join(git_dir, "HEAD")) as f:
+            head = f.read().strip()
+    except OSError:
+        return paths
+    if head.startswith("ref: "):
+        ref = os.path.join(git_dir, head[len("ref: "):])
+        paths.update((ref, os.path.dirname(ref)))
+    return paths
+
+class CommandCache:
+    """
+    Opt-in cache of the results of read-only commands.
+    
+    Entries are keyed by the command text, the working directory and the
+    relevant environment. An entry is used until its TTL runs out or one of the
+    paths the command involves (its arguments, the working directory, the
+    entries of the directories ls lists, and for git the index and the refs)
+    has a different mtime than just before it ran. Commands that read a whole
+    tree or the git work tree (grep -r, ls -R, du, git status, git diff)
+    aren't cached, as an edit deep inside it changes none of those mtimes.
+    """
+    
+    def __init__(self, ttl=60, max_entries=128):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def is_read_only(command):
+        """Check if a command only reads state and may be cached"""
+        if not command.strip() or UNSAFE_SHELL_CHARS & set(command):
+            return False
+        for segment in command.split("|"):
+            try:
+                words = shlex.split(segment)
+            except ValueError:
+                return False
+            if not words or not _is_read_only_words(words):
+                return False
+        return True
+    
+    @staticmethod
+    def _key(command, cwd, environment):
+        """The cache key of a command run in a directory with an environment"""
+        return (command.strip(), cwd, tuple(environment.get(name) for name in CACHE_ENV_VARS))
+    
+    @staticmethod
+    def _involved_paths(command, cwd):
+        """The paths whose modification invalidates the cached result"""
+        paths = {cwd}
+        for segment in command.split("|"):
+            words = shlex.split(segment)
+            operands = []
+            for word in words[1:]:
+                if word.startswith("-"):
+                    continue
+                path = os.path.join(cwd, os.path.expanduser(word))
+                if GLOB_CHARS & set(word):
+                    # The shell expands the pattern; a file created later changes cwd (or its directory)
+                    operands.extend(glob.glob(path))
+                    paths.add(os.path.dirname(path))
+                elif os.path.exists(path):
+                    operands.append(path)
+            paths.update(operands)
+            
+            # ls -l shows sizes and times, which an edit changes without touching the directory
+            if words and words[0] == "ls":
+                for directory in operands or [cwd]:
+                    if os.path.isdir(directory):
+                        try:
+                            paths.update(os.path.join(directory, name) for name in os.listdir(directory))
+                        except OSError:
+                            pass
+            
+            # git output depends on the index and the checked out ref
+            if words and words[0] == "git":
+                directory = cwd
+                while True:
+                    git_dir = os.path.join(directory, ".git")
+                    if os.path.exists(git_dir):
+                        paths.update(_git_paths(git_dir))
+                        break
+                    parent = os.path.dirname(directory)
+                    if parent == directory:
+                        break
+                    directory = parent
+        return paths
+    
+    @staticmethod
+    def _snapshot(paths):
+        """Modification times of the given paths (None for missing ones)"""
+        snapshot = {}
+        for path in paths:
+            try:
+                snapshot[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                snapshot[path] = None
+        return snapshot
+    
+    def snapshot(self, command, cwd):
+        """
+        Modification times of the paths a command involves, to take before
+        running it and pass to put(); None for commands that aren't cached.
+        """
+        if not self.is_read_only(command):
+            return None
+        return self._snapshot(self._involved_paths(command, cwd))
+    
+    def get(self, command, cwd, environment=None):
+        """
+        Return a copy of the cached result (with its age set), or None.
+        
+        environment is the environment the command would run in (lmTerm's own
+        by default), e.g. the shell session's after an export.
+        """
+        if not self.is_read_only(command):
+            return None
+        key = self._key(command, cwd, os.environ if environment is None else environment)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            result, stored_at, snapshot = entry
+            age = time.monotonic() - stored_at
+            if age > self.ttl or self._snapshot(snapshot.keys()) != snapshot:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        
+        cached = copy.copy(result)
+        cached.cache_age = age
+        return cached
+    
+    def put(self, command, cwd, result, snapshot):
+        """
+        Store the result of a read-only command that ran normally, with the
+        snapshot taken before it ran: a change made while it ran then shows
+        up as a different mtime on the next get() instead of being missed.
+        
+        The entry is keyed on the environment the command started with, which
+        the result carries when it ran in the shell session.
+        """
+        if (snapshot is None or not self.is_read_only(command) or result.error is not None
+                or result.timed_out or result.signal):
+            return
+        environment = os.environ if result.environment is None else result.environment
+        key = self._key(command, cwd, environment)
+        with self._lock:
+            self._entries[key] = (result, time.monotonic(), snapshot)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        """Forget all cached results"""
+        with self._lock:
+            self._entries.clear()
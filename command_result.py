@@ -0,0 +1,196 @@
+import signal as signals
+
+from config import get_config
+from ansi import strip_ansi
+
+def format_size(size):
+    """Format a number of bytes for display"""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+class ResourceUsage:
+    """
+    What a command cost: CPU time, peak memory, block I/O and context switches.
+    
+    Values that couldn't be measured are None (e.g. peak memory for commands
+    in the shell session, where only /proc counters of the shell are available)
+    and are named as not measured in the summary, never shown as zero.
+    """
+    
+    def __init__(self, user_time=0.0, system_time=0.0, max_rss=None, read_bytes=None,
+                 write_bytes=None, voluntary_switches=None, involuntary_switches=None):
+        # CPU time in seconds
+        self.user_time = user_time
+        self.system_time = system_time
+        
+        # Peak resident set size of the largest process, in bytes
+        self.max_rss = max_rss
+        
+        # Bytes read from and written to storage
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+        
+        self.voluntary_switches = voluntary_switches
+        self.involuntary_switches = involuntary_switches
+    
+    @classmethod
+    def from_rusage(cls, rusage):
+        """Create from the rusage of os.wait4 (the process and its waited-for children)"""
+        return cls(
+            user_time=rusage.ru_utime,
+            system_time=rusage.ru_stime,
+            # Linux reports kilobytes and 512-byte blocks
+            max_rss=rusage.ru_maxrss * 1024,
+            read_bytes=rusage.ru_inblock * 512,
+            write_bytes=rusage.ru_oublock * 512,
+            voluntary_switches=rusage.ru_nvcsw,
+            involuntary_switches=rusage.ru_nivcsw,
+        )
+    
+    @property
+    def cpu_time(self):
+        """User + system CPU time in seconds"""
+        return self.user_time + self.system_time
+    
+    def summary(self):
+        """One compact line, naming what wasn't measured instead of showing zeros for it"""
+        parts = [f"CPU {self.cpu_time:.2f}s ({self.user_time:.2f} user, {self.system_time:.2f} sys)"]
+        missing = []
+        if self.max_rss is not None:
+            parts.append(f"max RSS {format_size(self.max_rss)}")
+        else:
+            missing.append("max RSS")
+        if self.read_bytes is not None and self.write_bytes is not None:
+            parts.append(f"disk {format_size(self.read_bytes)} read, {format_size(self.write_bytes)} written")
+        else:
+            missing.append("disk I/O")
+        if self.voluntary_switches is not None and self.involuntary_switches is not None:
+            parts.append(f"{self.voluntary_switches + self.involuntary_switches} context switches")
+        else:
+            missing.append("context switches")
+        if missing:
+            parts.append(f"{' and '.join(missing)} not measured")
+        return ", ".join(parts)
+
+class CommandResult:
+    """
+    The outcome of running one command.
+    
+    Holds the exit status, byte counts and timings of the run, plus the
+    captured output (any object with a getvalue() method, e.g. an OutputBuffer).
+    """
+    
+    def __init__(self, command, exit_code=None, signal=None, stdout_bytes=0, stderr_bytes=0,
+                 wall_time=0.0, cpu_time=0.0, output=None, timed_out=False, error=None,
+                 stopped=False, output_limited=False, usage=None):
+        self.command = command
+        
+        # Exit code of the process, or None if it was killed by a signal
+        self.exit_code = exit_code
+        
+        # Number of the signal that terminated the process, if any
+        self.signal = signal
+        
+        self.stdout_bytes = stdout_bytes
+        self.stderr_bytes = stderr_bytes
+        
+        # Elapsed time and CPU time (user + system) in seconds
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        
+        # Detailed ResourceUsage of the command's processes, when measured
+        self.usage = usage
+        
+        # Handle to the captured output
+        self.output = output
+        
+        # Why the command was stopped early: it ran too long, the user stopped it,
+        # or it printed more than the output limit
+        self.timed_out = timed_out
+        self.stopped = stopped
+        self.output_limited = output_limited
+        
+        # Message for commands that could not be run at all
+        self.error = error
+        
+        # Seconds since the command ran, for results served from the command cache
+        self.cache_age = None
+        
+        # Environment variables the command started with when it ran in the shell
+        # session (which may differ from lmTerm's own after an export), else None
+        self.environment = None
+    
+    @classmethod
+    def from_text(cls, command, text, exit_code=0):
+        """Create a result for a command handled without a process (e.g. cd)"""
+        from output_buffer import OutputBuffer
+        output = OutputBuffer(text)
+        return cls(command, exit_code=exit_code, stdout_bytes=len(text.encode("utf-8")), output=output)
+    
+    @property
+    def succeeded(self):
+        """Whether the command ran and exited with code 0"""
+        return self.error is None and self.exit_code == 0
+    
+    def get_output(self):
+        """Return the captured output text"""
+        return self.output.getvalue() if self.output is not None else ""
+    
+    def status_line(self):
+        """Describe how the command ended"""
+        if self.error is not None:
+            return f"Error executing command: {self.error}"
+        if self.timed_out:
+            return f"Command timed out after {self.wall_time:.1f} seconds{self._signal_note()}"
+        if self.output_limited:
+            return f"Command stopped because its output exceeded the limit{self._signal_note()}"
+        if self.stopped:
+            return f"Command stopped by the user{self._signal_note()}"
+        if self.signal is not None:
+            return f"Command terminated by signal {self._signal_name()}"
+        status = f"Command completed with exit code: {self.exit_code}"
+        if self.cache_age is not None:
+            status += f" (cached result from {self.cache_age:.0f} seconds ago)"
+        return status
+    
+    def _signal_name(self):
+        """Name of the signal that terminated the process"""
+        try:
+            return signals.Signals(self.signal).name
+        except ValueError:
+            return str(self.signal)
+    
+    def _signal_note(self):
+        """Which signal ended a stopped command, if it was killed by one"""
+        return f" ({self._signal_name()})" if self.signal is not None else ""
+    
+    def usage_line(self):
+        """One line with the wall time, resource usage and output size of the run"""
+        parts = [f"wall {self.wall_time:.2f}s"]
+        if self.usage is not None:
+            parts.append(self.usage.summary())
+        parts.append(f"output {format_size(self.stdout_bytes + self.stderr_bytes)}")
+        return ", ".join(parts)
+    
+    def to_tool_result(self):
+        """Return the text sent back to the AI as the tool result"""
+        # Colors and other escape sequences only cost the model tokens
+        output = strip_ansi(self.get_output())
+        if self.error is not None:
+            return self.status_line()
+        if not output and self.succeeded and self.cache_age is None:
+            text = f"Command executed successfully (exit code: {self.exit_code})"
+        elif not output:
+            text = self.status_line()
+        else:
+            text = f"{output}\n\n{self.status_line()}"
+        
+        # Optionally let the model see what the command cost
+        if self.usage is not None and get_config("tool_result_usage", False):
+            text += f"\nResources: {self.usage_line()}"
+        return text
+    
+    def __str__(self):
+        return self.to_tool_result()
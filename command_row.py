@@ -1,154 +1,332 @@
 import gi
 import traceback
 import os
+import json
+import zlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
-from gi.repository import Gtk, Adw, Pango, GLib
+from gi.repository import Gtk, Adw, Pango, GLib, GObject
 
-class CommandRow(Adw.ExpanderRow):
+from output_view import OutputView
+from autoscroll import AutoScroller
+from markdown_renderer import MarkdownLabel
+from config import get_config
+from output_buffer import CaptureBuffer
+from ansi import AnsiParser, strip_ansi
+from jobs import JOB_TOOLS, poll_job, is_background_command
+
+# States of the command shown in a row
+COMMAND_NONE = "none"
+COMMAND_DIRECT = "direct"
+COMMAND_SUGGESTED = "suggested"
+COMMAND_RUNNING = "running"
+COMMAND_FINISHED = "finished"
+
+# Tools the agent can call (see lmstudio_manager.AGENT_TOOLS)
+AGENT_TOOL_NAMES = {"terminal_execute"} | {tool["function"]["name"] for tool in JOB_TOOLS}
+
+# Terminal size (rows, columns) for rows whose output view hasn't been sized yet;
+# views update it, so new rows start with the size of the latest output view
+DEFAULT_TERMINAL_SIZE = [24, 80]
+
+# Dehydrated row content larger than this (in characters) is zlib-compressed
+COMPRESS_THRESHOLD = 16 * 1024
+
+class RowRecord:
+    """
+    Compact stand-in for the content of a dehydrated CommandRow.
+    
+    Holds the output, responses and chat history as a single serialized text
+    (compressed when large) instead of the live objects.
+    """
+    __slots__ = ("data", "compressed")
+    
+    def __init__(self, text):
+        self.compressed = len(text) > COMPRESS_THRESHOLD
+        self.data = zlib.compress(text.encode("utf-8")) if self.compressed else text
+    
+    def text(self):
+        """Return the serialized content"""
+        if self.compressed:
+            return zlib.decompress(self.data).decode("utf-8")
+        return self.data
+
+# Bounded pool running the commands of concurrent tool call batches
+TOOL_CALL_POOL = ThreadPoolExecutor(max_workers=get_config("tool_call_workers", 4), thread_name_prefix="tool-call")
+
+class ToolCallBatch:
+    """
+    The tool calls of one model response, run concurrently.
+    
+    Every call gets its own CommandRow (and output). Approved calls run on
+    TOOL_CALL_POOL as soon as they are approved; once every call has finished
+    or was canceled, all results go back to the model in a single request.
+    """
+    
+    def __init__(self, window):
+        self.window = window
+        
+        # Rows of the batch in the order of the tool calls, and the result by tool call ID
+        self.rows = []
+        self.results = {}
+        self.sent = False
+        
+        # (tool call ID, result) of the calls answered without a row, e.g. job polls
+        self.answered = []
+    
+    def add(self, row):
+        """Add the row of one tool call"""
+        self.rows.append(row)
+        row.tool_call_batch = self
+    
+    def run_all(self):
+        """Approve and run every call that is still waiting"""
+        for row in self.rows:
+            if row.command_state == COMMAND_SUGGESTED:
+                row.run_command()
+    
+    def submit(self, row):
+        """Run the command of one row on the pool"""
+        TOOL_CALL_POOL.submit(self._run, row)
+    
+    def _run(self, row):
+        """Run one command (on a pool thread)"""
+        from terminal import stream_command
+        try:
+            result = stream_command(row.command, parent_widget=self.window, command_row=row)
+        except Exception as e:
+            traceback.print_exc()
+            result = f"Error executing command: {str(e)}"
+        GLib.idle_add(self._on_call_finished, row, result)
+    
+    def _on_call_finished(self, row, result):
+        """Record the result of one call"""
+        row._set_command_state(COMMAND_FINISHED)
+        self.set_result(row, result)
+        return False
+    
+    def set_result(self, row, result):
+        """Record the result of one call and send the batch once it is complete"""
+        self.results[row._command_id] = result
+        if self.sent or len(self.results) < len(self.rows):
+            return
+        
+        self.sent = True
+        window = self.window
+        if window and hasattr(window, 'lm_manager'):
+            results = [(row._command_id, self.results[row._command_id]) for row in self.rows] + self.answered
+            print(f"DEBUG - Sending {len(results)} tool results in one request")
+            if not window.lm_manager.send_tool_results(results):
+                print("Failed to send tool results to AI")
+        else:
+            print("Could not access LM Studio manager from window")
+
+class AIResponse:
+    """One AI response bubble: the answer text, the thinking text and the streaming state"""
+    
+    def __init__(self, text="", thinking=None, streaming=False):
+        self.text = text
+        self.thinking = thinking
+        self.streaming = streaming
+
+class CommandRow(GObject.Object):
+    """
+    The model for one entry of the conversation.
+    
+    Holds the prompt, command, output and AI responses of the entry. All updates
+    (including streaming ones) go to the model, which emits signals so that the
+    CommandRowView currently bound to it, if any, can update its widgets.
+    
+    While a row is off screen or collapsed its content can be dehydrated into a
+    RowRecord; it is hydrated again as soon as anything reads or changes it.
+    """
+    __gsignals__ = {
+        # A part of the row changed: "title", "user", "command", "output", "responses" or "expanded"
+        "changed": (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        # New text was appended to the command output
+        "output-appended": (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        # The response at the given index changed or was added
+        "response-changed": (GObject.SignalFlags.RUN_FIRST, None, (int,)),
+    }
+    
     def __init__(self):
         super().__init__()
-        self.set_title("")
-        self.set_expanded(True)
         
-        # Main content box
-        self.content_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=8)
-        self.content_box.set_margin_top(8)
-        self.content_box.set_margin_bottom(8)
-        self.content_box.set_margin_start(16)
-        self.content_box.set_margin_end(16)
+        # The window this row belongs to, set when the row is added to the conversation
+        self.window = None
         
-        # Add a signal handler for when the content box is mapped to the screen
-        self.content_box.connect("map", self._on_content_mapped)
+        self.title = ""
+        self.expanded = True
+        self.user_prompt = None
         
-        # User prompt box (speech bubble style)
-        self.user_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
-        self.user_box.set_halign(Gtk.Align.START)
-        self.user_box.add_css_class("card")
-        self.user_box.add_css_class("user-bubble")
-        self.user_box.set_margin_end(48)
-        
-        self.user_label = Gtk.Label()
-        self.user_label.set_selectable(True)
-        self.user_label.set_wrap(True)
-        self.user_label.set_xalign(0)
-        self.user_label.set_margin_start(12)
-        self.user_label.set_margin_end(12)
-        self.user_label.set_margin_top(8)
-        self.user_label.set_margin_bottom(8)
-        self.user_box.append(self.user_label)
+        # Command text and its state
+        self._command_text = ""
+        self.command_state = COMMAND_NONE
         
-        # Command row and run button
-        self.command_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=8)
+        # Command output; only its head and tail are kept in memory
+        self._output = CaptureBuffer()
+        self.output_visible = False
         
-        self.command_label = Gtk.Label()
-        self.command_label.set_selectable(True)
-        self.command_label.set_wrap(True)
-        self.command_label.set_wrap_mode(Pango.WrapMode.CHAR)
-        self.command_label.set_xalign(0)
-        self.command_label.add_css_class("monospace")
-        self.command_label.add_css_class("command-text")
+        # Capture of the running command with the full output in a spill file, if any
+        self.output_spill = None
         
-        # Put command in a frame
-        command_frame = Gtk.Frame()
-        command_frame.set_child(self.command_label)
-        command_frame.add_css_class("command-frame")
-        command_frame.set_hexpand(True)
-        self.command_box.append(command_frame)
+        # Age (in seconds) of the cached result shown as output, or None after a real run
+        self.output_cached_age = None
         
-        # Output box with monospace text
-        self.output_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
-        self.output_box.add_css_class("terminal-output")
+        # Handle to stop the running command (a command_runner.ProcessHandle), while it runs
+        self.process_handle = None
         
-        self.output_label = Gtk.Label()
-        self.output_label.set_selectable(True)
-        self.output_label.set_wrap(True)
-        self.output_label.set_wrap_mode(Pango.WrapMode.CHAR)
-        self.output_label.set_xalign(0)
-        self.output_label.add_css_class("monospace")
+        # Resource usage of the last run, as one line
+        self.usage_text = None
         
-        self.output_scroll = Gtk.ScrolledWindow()
-        self.output_scroll.add_css_class("terminal-scrolled")
-        self.output_scroll.set_min_content_height(100)
-        self.output_scroll.set_max_content_height(400)
-        self.output_scroll.set_child(self.output_label)
-        self.output_box.append(self.output_scroll)
-        
-        # AI response box (speech bubble style)
-        self.ai_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
-        self.ai_box.set_halign(Gtk.Align.END)
-        self.ai_box.add_css_class("card")
-        self.ai_box.add_css_class("ai-bubble")
-        self.ai_box.set_margin_start(48)
+        # Tool calls of the current response handled one after the other, with their results
+        self._pending_tool_calls = []
+        self._tool_results = []
         
-        self.ai_response_label = None
-        self.ai_response_box = self.ai_box
+        # Batch of concurrently run tool calls this row belongs to, if any
+        self.tool_call_batch = None
         
-        # Add all elements to the content box
-        self.content_box.append(self.user_box)
-        self.content_box.append(self.command_box)
-        self.content_box.append(self.output_box)
-        self.content_box.append(self.ai_box)
+        # Whether to run the command in a pty (None follows the execution_mode setting)
+        self.use_pty = None
         
-        self.add_row(self.content_box)
+        # Size of the output view as a terminal (rows, columns), set by the view
+        self._terminal_size = None
         
-        # Initially hide some elements
-        self.user_box.set_visible(False)
-        self.command_box.set_visible(False)
-        self.output_box.set_visible(False)
-        self.ai_box.set_visible(False)
+        # AI responses in display order; the primary response always comes first
+        self._responses = []
+        self._primary_response = None
+        self._streaming_response = None
         
-        # Store command text
-        self._command_text = ""
+        # Streaming state
+        self._current_response_text = ""
+        self._streaming_content = ""
+        self._thinking_content = None
         
         # Initialize chat history
-        self.chat_history = {"messages": []}
-    
-    def _on_content_mapped(self, widget):
-        """Scroll to this row when it's mapped to the screen"""
-        # Find the ScrolledWindow parent
-        self._scroll_to_bottom()
-    
-    def _scroll_to_bottom(self):
-        """Helper method to scroll to the bottom of the conversation"""
-        # Find the ScrolledWindow parent
-        parent = self.get_parent()
-        while parent and not isinstance(parent, Gtk.ScrolledWindow):
-            parent = parent.get_parent()
-        
-        if parent and isinstance(parent, Gtk.ScrolledWindow):
-            # Get the adjustment and scroll to the bottom
-            vadj = parent.get_vadjustment()
-            if vadj:
-                GLib.idle_add(lambda: vadj.set_value(vadj.get_upper() - vadj.get_page_size()))
+        self._chat_history = {"messages": []}
+        
+        # Compact copy of the content while the row is dehydrated
+        self._record = None
+    
+    @property
+    def command(self):
+        """The command shown in this row"""
+        return self._command_text
+    
+    @property
+    def terminal_size(self):
+        """The size of the output as a terminal (rows, columns)"""
+        return self._terminal_size or tuple(DEFAULT_TERMINAL_SIZE)
+    
+    def set_terminal_size(self, size):
+        """Remember the size of the output view, used for commands run in a pty"""
+        self._terminal_size = size
+        DEFAULT_TERMINAL_SIZE[:] = size
+    
+    @property
+    def responses(self):
+        """The AI responses of this row"""
+        self.hydrate()
+        return self._responses
+    
+    @property
+    def chat_history(self):
+        """The chat history of this row"""
+        self.hydrate()
+        return self._chat_history
+    
+    def is_busy(self):
+        """Check if the row is still running a command or streaming a response"""
+        if self.command_state == COMMAND_RUNNING or getattr(self, '_streaming_response_active', False):
+            return True
+        return any(response.streaming for response in self._responses)
+    
+    def dehydrate(self):
+        """Replace the content of an idle row with a compact record"""
+        if self._record is not None or self.is_busy():
+            return
+        
+        # Assistant messages repeat the response text, so store them as a
+        # reference to the response instead of a second copy
+        response_index = {response.text: index for index, response in enumerate(self._responses)}
+        messages = []
+        for message in self._chat_history["messages"]:
+            index = response_index.get(message.get("content")) if message.get("role") == "assistant" else None
+            if index is not None and message.keys() == {"role", "content"}:
+                messages.append({"role": "assistant", "response": index})
+            else:
+                messages.append(message)
+        
+        payload = {
+            "output": self._output.dump(),
+            "responses": [[response.text, response.thinking] for response in self._responses],
+            "primary": self._primary_response is not None,
+            "messages": messages,
+        }
+        self._record = RowRecord(json.dumps(payload))
+        
+        # Release the live copies
+        self._output = None
+        self._responses = []
+        self._primary_response = None
+        self._streaming_response = None
+        self._current_response_text = ""
+        self._streaming_content = ""
+        self._chat_history = None
+    
+    def hydrate(self):
+        """Restore the content of a dehydrated row"""
+        record = self._record
+        if record is None:
+            return
+        self._record = None
+        payload = json.loads(record.text())
+        
+        self._output = CaptureBuffer.load(payload["output"])
+        
+        self._responses = [AIResponse(text, thinking) for text, thinking in payload["responses"]]
+        self._primary_response = self._responses[0] if payload["primary"] else None
+        
+        messages = []
+        for message in payload["messages"]:
+            if "response" in message:
+                message = {"role": "assistant", "content": self._responses[message["response"]].text}
+            messages.append(message)
+        self._chat_history = {"messages": messages}
+    
+    def get_root(self):
+        """Return the window this row belongs to"""
+        return self.window
+    
+    def _set_title(self, title):
+        """Set the title shown in the row header"""
+        self.title = title
+        self.emit("changed", "title")
+    
+    def set_expanded(self, expanded):
+        """Set whether the row is expanded"""
+        if self.expanded != expanded:
+            self.expanded = expanded
+            self.emit("changed", "expanded")
     
     def set_user_prompt(self, text):
         """Set the user prompt text"""
-        self.user_label.set_text(text)
-        self.user_box.set_visible(True)
-        self.set_title(f"{text[:40]}...")
+        self.user_prompt = text
+        self.emit("changed", "user")
+        self._set_title(f"{text[:40]}...")
         
         # Add to chat history
         self.chat_history["messages"].append({"role": "user", "content": text})
-        
-        # Scroll to bottom after setting user prompt
-        self._scroll_to_bottom()
     
     def set_command(self, command):
         """Set the command to execute"""
         self._command_text = command
-        self.command_label.set_text(command)
-        self.command_box.set_visible(True)
-        self.set_title(f"Command: {command}")
-        
-        # Debug print to check command box
-        print(f"DEBUG: Command box children: {[type(child) for child in self.command_box.observe_children()]}")
-        
-        # Remove any existing confirmation buttons first
-        for child in list(self.command_box.observe_children()):
-            if isinstance(child, Gtk.Box) and child != command_frame:
-                self.command_box.remove(child)
+        self.command_state = COMMAND_DIRECT
+        self.emit("changed", "command")
+        self._set_title(f"Command: {command}")
         
         # Don't add confirmation buttons for direct commands
         # The command will be executed immediately by the caller
@@ -156,38 +334,127 @@ class CommandRow(Adw.ExpanderRow):
     def set_suggested_command(self, command):
         """Set a command suggested by the AI"""
         self._command_text = command
-        self.command_label.set_text(command)
-        self.command_box.set_visible(True)
-        
-        # Remove any existing confirmation buttons first
-        for child in list(self.command_box.observe_children()):
-            if isinstance(child, Gtk.Box):
-                self.command_box.remove(child)
-        
-        # Create a box for the confirmation buttons
-        confirmation_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=4)
-        
-        # Add run button
-        run_button = Gtk.Button(label="Run")
-        run_button.add_css_class("suggested-action")  # Gives it a highlighted appearance
-        run_button.connect("clicked", self._on_run_command)
-        confirmation_box.append(run_button)
-        
-        # Add cancel button
-        cancel_button = Gtk.Button(label="Cancel")
-        cancel_button.connect("clicked", self._on_cancel_command)
-        confirmation_box.append(cancel_button)
-        
-        # Add the confirmation box to the command box
-        self.command_box.append(confirmation_box)
+        self.command_state = COMMAND_SUGGESTED
+        self.emit("changed", "command")
+    
+    def _set_command_state(self, state):
+        """Update the state of the command (shows or hides the confirmation buttons)"""
+        self.command_state = state
+        self.emit("changed", "command")
     
     def set_command_output(self, output):
         """Set the command output text"""
-        self.output_label.set_text(output)
-        self.output_box.set_visible(True)
+        self.hydrate()
+        
+        # If the new output only extends the current one, append just the new part
+        current_length = len(self._output)
+        if (current_length and not self._output.overflowed and len(output) >= current_length
+                and output.startswith(self.get_command_output())):
+            self.append_command_output(output[current_length:])
+            return
+        
+        self._output = CaptureBuffer()
+        self._output.append(output)
+        self.output_visible = True
+        self.emit("changed", "output")
+    
+    def append_command_output(self, chunk):
+        """Append a chunk of text to the command output"""
+        if not chunk:
+            return
+        self.hydrate()
+        self._output.append(chunk)
+        
+        if not self.output_visible:
+            self.output_visible = True
+            self.emit("changed", "output")
+        else:
+            self.emit("output-appended", chunk)
+    
+    def get_command_output(self):
+        """Return the command output (with the middle left out if it is very large)"""
+        self.hydrate()
+        return self._output.getvalue()
+    
+    def set_output_spill(self, capture):
+        """Set the capture of the running command, whose spill file holds the full output"""
+        self.output_spill = capture
+        return False
+    
+    def set_process_handle(self, handle):
+        """Set the handle of the running command, or None once it has finished"""
+        self.process_handle = handle
+        self.emit("changed", "command")
+        return False
+    
+    def stop_command(self):
+        """Stop the running command (SIGINT, then SIGTERM, then SIGKILL)"""
+        if self.process_handle is not None:
+            self.process_handle.stop()
+    
+    def set_usage(self, text):
+        """Show what the last run cost (None hides it)"""
+        self.usage_text = text
+        self.emit("changed", "usage")
+        return False
+    
+    def set_output_cached(self, age):
+        """Mark the output as a cached result of the given age, or as fresh (None)"""
+        if self.output_cached_age != age:
+            self.output_cached_age = age
+            self.emit("changed", "cache")
+        return False
+    
+    def show_cached_result(self, result):
+        """Show a result served from the command cache"""
+        self.set_output_spill(result.output if isinstance(result.output, CaptureBuffer) else None)
+        self.set_command_output(result.to_tool_result())
+        self.set_output_cached(result.cache_age)
+        self.set_usage(result.usage_line() if result.usage is not None else None)
+        return False
+    
+    def rerun_command(self):
+        """Run the command again, bypassing the command cache (updates the output only)"""
+        from terminal import stream_command
+        
+        if self.command_state == COMMAND_RUNNING or not self._command_text:
+            return
+        self._set_command_state(COMMAND_RUNNING)
+        
+        def run_in_thread():
+            try:
+                stream_command(self._command_text, parent_widget=self.window, command_row=self, use_cache=False)
+            except Exception as e:
+                GLib.idle_add(self._update_output, f"Error: {str(e)}")
+                traceback.print_exc()
+            finally:
+                GLib.idle_add(self._set_command_state, COMMAND_FINISHED)
         
-        # Scroll to bottom after setting output
-        self._scroll_to_bottom()
+        threading.Thread(target=run_in_thread).start()
+    
+    def _emit_response_changed(self, response):
+        """Notify the view that a response changed"""
+        self.emit("response-changed", self._responses.index(response))
+    
+    def _ensure_primary_response(self):
+        """Return the primary AI response, creating it if needed"""
+        self.hydrate()
+        if self._primary_response is None:
+            self._primary_response = AIResponse()
+            self._responses.insert(0, self._primary_response)
+            # Indices of the other responses shifted, so rebuild them
+            self.emit("changed", "responses")
+        return self._primary_response
+    
+    @staticmethod
+    def _split_thinking(text):
+        """Split a response into its thinking section and the answer after it"""
+        if "<think>" in text and "</think>" in text:
+            thinking_start = text.find("<think>")
+            thinking_end = text.find("</think>") + len("</think>")
+            thinking_content = text[thinking_start + len("<think>"):thinking_end - len("</think>")].strip()
+            return thinking_content, text[thinking_end:].strip()
+        return None, text
     
     def set_ai_response(self, response):
         """Set the AI response text"""
@@ -196,162 +463,39 @@ class CommandRow(Adw.ExpanderRow):
         # Process the response to extract the actual content
         processed_response = self._process_response(response)
         
-        # Clear any existing response
-        if self.ai_response_label:
-            self.ai_response_label.set_text("")
-        
-        # Create a new label if needed
-        if not self.ai_response_label:
-            # Use MarkdownLabel instead of regular Gtk.Label
-            from markdown_renderer import MarkdownLabel
-            self.ai_response_label = MarkdownLabel()
-            self.ai_response_label.set_margin_start(10)
-            self.ai_response_label.set_margin_end(10)
-            self.ai_response_label.set_margin_top(5)
-            self.ai_response_label.set_margin_bottom(5)
-            
-            # Add the label to the AI response box
-            self.ai_response_box.append(self.ai_response_label)
-        
-        # Set the response text using markdown
-        self.ai_response_label.set_markdown(processed_response)
+        primary = self._ensure_primary_response()
+        primary.text = processed_response
         
-        # Make sure the AI response box is visible
-        self.ai_response_box.set_visible(True)
-        
-        # Add thinking expander if we have thinking content
-        if hasattr(self, '_thinking_content') and self._thinking_content:
-            # Create a vertical box if needed to hold both the expander and the response
-            if not hasattr(self, 'ai_response_vbox'):
-                self.ai_response_vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=5)
-                
-                # If the label is already in the AI box, move it to the vbox
-                if self.ai_response_label.get_parent() == self.ai_response_box:
-                    self.ai_response_box.remove(self.ai_response_label)
-                    self.ai_response_vbox.append(self.ai_response_label)
-                
-                # Add the vbox to the AI box
-                self.ai_response_box.append(self.ai_response_vbox)
-            
-            # Add the thinking expander to the vbox
-            self._add_thinking_expander(self._thinking_content, self.ai_response_vbox)
-            
-            # Clear the thinking content
+        # Add thinking content if the response had any
+        if self._thinking_content:
+            primary.thinking = self._thinking_content
             self._thinking_content = None
+        
+        self._emit_response_changed(primary)
     
     def add_ai_response(self, response):
         """Add a new AI response bubble"""
         print(f"ADD_AI_RESPONSE called with: {response[:50]}...")
         
         # Check if this response contains thinking tags
-        has_thinking = "<think>" in response and "</think>" in response
-        thinking_content = None
-        
-        if has_thinking:
-            # Extract thinking content
-            thinking_start = response.find("<think>")
-            thinking_end = response.find("</think>") + len("</think>")
-            thinking_content = response[thinking_start + len("<think>"):thinking_end - len("</think>")].strip()
-            
-            # Extract the actual response (after the thinking part)
-            processed_response = response[thinking_end:].strip()
-        else:
+        thinking_content, processed_response = self._split_thinking(response)
+        if thinking_content is None:
             # Process the response normally
             processed_response = self._process_response(response)
         
-        print(f"Processed response: {processed_response[:50]}...")
-        
-        # Create a new AI response box
-        new_ai_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
-        new_ai_box.set_halign(Gtk.Align.END)
-        new_ai_box.add_css_class("card")
-        new_ai_box.add_css_class("ai-bubble")
-        new_ai_box.set_margin_start(48)
-        print("Created new AI box with classes: card, ai-bubble")
-        
-        # If we have thinking content, create a vertical box to hold both the thinking expander and the response
-        if thinking_content:
-            ai_content_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=5)
-            new_ai_box.append(ai_content_box)
-            
-            # Create the thinking expander
-            thinking_expander = Adw.ExpanderRow()
-            thinking_expander.set_title("AI's Thinking Process")
-            thinking_expander.set_expanded(False)
-            
-            # Create a MarkdownLabel for the thinking content
-            from markdown_renderer import MarkdownLabel
-            thinking_label = MarkdownLabel()
-            thinking_label.set_margin_start(10)
-            thinking_label.set_margin_end(10)
-            thinking_label.set_margin_top(5)
-            thinking_label.set_margin_bottom(5)
-            thinking_label.set_markdown(thinking_content)
-            
-            # Add the label to the expander
-            thinking_expander.add_row(thinking_label)
-            
-            # Add the expander to the content box
-            ai_content_box.append(thinking_expander)
-            
-            # Create a MarkdownLabel for the response
-            response_label = MarkdownLabel()
-            response_label.set_margin_start(10)
-            response_label.set_margin_end(10)
-            response_label.set_margin_top(5)
-            response_label.set_margin_bottom(5)
-            response_label.set_markdown(processed_response)
-            
-            # Add the response label to the content box
-            ai_content_box.append(response_label)
-            
-            # Set the new label as the current one
-            new_label = response_label
-        else:
-            # Create a new MarkdownLabel for the response (no thinking content)
-            from markdown_renderer import MarkdownLabel
-            new_label = MarkdownLabel()
-            new_label.set_margin_start(10)
-            new_label.set_margin_end(10)
-            new_label.set_margin_top(5)
-            new_label.set_margin_bottom(5)
-            new_label.set_markdown(processed_response)
-            
-            # Add the label to the new AI box
-            new_ai_box.append(new_label)
-        
-        print(f"Created new MarkdownLabel with text: {processed_response[:50]}...")
-        print("Added label to new AI box")
-        
-        # Add the new AI box to the content box
-        print(f"Adding new AI box to content box (content_box children count before: {len(list(self.content_box.observe_children()))})")
-        self.content_box.append(new_ai_box)
-        print(f"Content box children count after: {len(list(self.content_box.observe_children()))}")
-        
-        # Make sure the new AI box is visible
-        new_ai_box.set_visible(True)
-        print(f"New AI box visible: {new_ai_box.get_visible()}, realized: {new_ai_box.get_realized()}")
-        
-        # Check if the new box is actually in the widget hierarchy
-        print(f"New AI box parent: {new_ai_box.get_parent()}")
+        new_response = AIResponse(processed_response, thinking_content)
+        self.responses.append(new_response)
+        self._emit_response_changed(new_response)
         
         # Add to chat history
         self.chat_history["messages"].append({"role": "assistant", "content": processed_response})
-        print("Added response to chat history")
-        
-        # Scroll to bottom after adding response
-        self._scroll_to_bottom()
         
-        # Return the new AI box and label
-        return new_ai_box, new_label
+        return new_response
     
     def update_ai_response(self, response):
         """Update the AI response text (append or replace)"""
         print(f"Updating AI response: {response[:50]}...")
         
-        # Process the response to extract the actual content
-        processed_response = self._process_response(response)
-        
         # If this is a JSON string with tool calls, parse it and extract the relevant parts
         try:
             import json
@@ -375,16 +519,22 @@ class CommandRow(Adw.ExpanderRow):
             pass
         
         # Set the response text
-        self.set_ai_response(processed_response)
+        self.set_ai_response(response)
     
-    def _on_run_command(self, button):
-        """Handle running a suggested command"""
+    def run_command(self):
+        """Run the suggested command"""
         from terminal import confirm_command, PENDING_COMMANDS, stream_command
         
-        # Disable both buttons while running
-        parent = button.get_parent()
-        for child in parent.observe_children():
-            child.set_sensitive(False)
+        if self.command_state == COMMAND_RUNNING:
+            return
+        
+        # Disable the confirmation buttons while running
+        self._set_command_state(COMMAND_RUNNING)
+        
+        # Calls of a concurrent batch run on the shared pool
+        if self.tool_call_batch is not None:
+            self.tool_call_batch.submit(self)
+            return
         
         def run_in_thread():
             try:
@@ -392,78 +542,51 @@ class CommandRow(Adw.ExpanderRow):
                 if hasattr(self, '_command_id'):
                     command_id = self._command_id
                     print(f"DEBUG - Running command with ID: {command_id}")
-                    print(f"DEBUG - Available command IDs: {list(PENDING_COMMANDS.keys())}")
-                    print(f"DEBUG - Command ID in PENDING_COMMANDS: {command_id in PENDING_COMMANDS}")
                     
                     # Check if the command ID exists in PENDING_COMMANDS
                     if command_id not in PENDING_COMMANDS:
                         # The command ID doesn't exist, so we need to get it from the LM Studio manager
-                        window = self.get_root()
+                        window = self.window
                         if window and hasattr(window, 'lm_manager'):
                             lm_manager = window.lm_manager
                             if hasattr(lm_manager, 'pending_tool_calls') and command_id in lm_manager.pending_tool_calls:
                                 tool_info = lm_manager.pending_tool_calls[command_id]
                                 command = tool_info.get("command", "")
                                 
-                                # Import stream_command here to ensure it's available
-                                from terminal import stream_command
-                                
                                 # Stream the command execution
-                                result = stream_command(command, parent_widget=self, command_row=self)
-                                
-                                # Update the prompt if the command was a cd command
-                                if command.strip().startswith("cd "):
-                                    window = self.get_root()
-                                    if window and hasattr(window, 'update_prompt'):
-                                        GLib.idle_add(window.update_prompt)
+                                result = stream_command(command, parent_widget=self.window, command_row=self)
                                 
                                 # Process the next tool call if available
                                 GLib.idle_add(self._process_next_tool_call, result)
-                                
-                                # Remove the confirmation buttons after execution
-                                GLib.idle_add(self._remove_confirmation_buttons, parent)
                                 return
-                
-                    # If we get here, try to confirm the command using the standard flow
-                    result = confirm_command(command_id, parent_widget=self, stream=True, command_row=self)
                     
-                    # Update the prompt if the command was a cd command
-                    command = PENDING_COMMANDS.get(command_id, {}).get("command", "")
-                    if command and command.strip().startswith("cd "):
-                        window = self.get_root()
-                        if window and hasattr(window, 'update_prompt'):
-                            GLib.idle_add(window.update_prompt)
+                    # If we get here, try to confirm the command using the standard flow
+                    result = confirm_command(command_id, parent_widget=self.window, stream=True, command_row=self)
                     
                     # Process the next tool call if available
                     GLib.idle_add(self._process_next_tool_call, result)
                 else:
-                    # Import stream_command here to ensure it's available
-                    from terminal import stream_command
-                    result = stream_command(self._command_text, parent_widget=self, command_row=self)
-                    
-                    # Update the prompt if the command was a cd command
-                    if self._command_text.strip().startswith("cd "):
-                        window = self.get_root()
-                        if window and hasattr(window, 'update_prompt'):
-                            GLib.idle_add(window.update_prompt)
+                    result = stream_command(self._command_text, parent_widget=self.window, command_row=self)
                     
                     # Process the next tool call if available
                     GLib.idle_add(self._process_next_tool_call, result)
             except Exception as e:
                 GLib.idle_add(self._update_output, f"Error: {str(e)}")
-                import traceback
                 traceback.print_exc()
             finally:
                 # Remove the confirmation buttons after execution
-                GLib.idle_add(self._remove_confirmation_buttons, parent)
+                GLib.idle_add(self._set_command_state, COMMAND_FINISHED)
         
-        import threading
         threading.Thread(target=run_in_thread).start()
     
     def _process_next_tool_call(self, previous_result):
         """Process the next tool call in the queue"""
+        # Keep the result of the call that just finished, under its own ID
+        if getattr(self, 'pending_command_id', None):
+            self._tool_results.append((self.pending_command_id, previous_result))
+        
         # Check if we have pending tool calls
-        if hasattr(self, '_pending_tool_calls') and self._pending_tool_calls:
+        if self._pending_tool_calls:
             # Remove the current tool call
             self._pending_tool_calls.pop(0)
             
@@ -479,7 +602,7 @@ class CommandRow(Adw.ExpanderRow):
         # If we've processed all tool calls or there are none, send the result back to the AI
         if hasattr(self, 'pending_command_id'):
             # Get the LMStudioManager instance from the window
-            window = self.get_root()
+            window = self.window
             if window and hasattr(window, 'lm_manager'):
                 lm_manager = window.lm_manager
                 
@@ -491,12 +614,14 @@ class CommandRow(Adw.ExpanderRow):
                 if hasattr(self, '_streaming_response_active') and self._streaming_response_active:
                     print("DEBUG - Already streaming a response, not sending tool result again")
                     return
-                    
+                
                 # Mark that we're starting to stream a response
                 self._streaming_response_active = True
                 
-                # Send the tool result back to the AI
-                success = lm_manager.send_tool_result(tool_id, previous_result)
+                # Send the results of all the calls back to the AI in one request
+                results = self._tool_results or [(tool_id, previous_result)]
+                self._tool_results = []
+                success = lm_manager.send_tool_results(results)
                 if not success:
                     print("Failed to send tool result to AI")
                     # Reset streaming flag if failed
@@ -507,43 +632,37 @@ class CommandRow(Adw.ExpanderRow):
             # Clear the pending command ID
             self.pending_command_id = None
     
-    def _on_cancel_command(self, button):
-        """Handle canceling a suggested command"""
+    def cancel_command(self):
+        """Cancel the suggested command"""
         # Remove the confirmation buttons
-        parent = button.get_parent()
-        self._remove_confirmation_buttons(parent)
+        self._set_command_state(COMMAND_FINISHED)
+        
+        # Add a note that the command was canceled
+        self.set_command_output("Command execution canceled by user.")
+        
+        # A canceled call of a batch still needs its result for the batch to complete
+        if self.tool_call_batch is not None:
+            self.tool_call_batch.set_result(self, "Command was canceled by the user.")
+            return
         
         # Cancel the command if it has an ID
         if hasattr(self, '_command_id'):
             from terminal import cancel_command
             cancel_result = cancel_command(self._command_id)
             
-            # If we're in an AI agent conversation, we need to send the cancellation back to the AI
-            if hasattr(self, 'pending_command_id') and self.pending_command_id == self._command_id:
-                # Get the LMStudioManager instance from the window
-                window = self.get_root()
-                if window and hasattr(window, 'lm_manager'):
-                    lm_manager = window.lm_manager
-                    
-                    # Send the cancellation result back to the AI
-                    lm_manager.send_tool_result(self.pending_command_id, "Command was canceled by the user.")
-                
-                # Clear the pending command ID
-                self.pending_command_id = None
-        
-        # Add a note that the command was canceled
-        self.set_command_output("Command execution canceled by user.")
-    
-    def _remove_confirmation_buttons(self, button_box):
-        """Remove the confirmation buttons from the command box"""
-        if button_box and button_box in self.command_box:
-            self.command_box.remove(button_box)
+            # If we're in an AI agent conversation, the cancellation is the result of
+            # this call; move on to the next call (the results are sent together)
+            if getattr(self, 'pending_command_id', None) == self._command_id:
+                self._process_next_tool_call("Command was canceled by the user.")
     
     def _update_output(self, text):
         """Update the command output"""
         self.set_command_output(text)
-        
-        # No need to update prompt here anymore as it's handled in the window
+    
+    def process_tool_calls(self, tool_calls_json):
+        """Process tool calls sent by the LM Studio manager (safe to use with GLib.idle_add)"""
+        self._process_response(tool_calls_json)
+        return False
     
     def _process_response(self, response):
         """Process the response to extract the actual text content"""
@@ -551,20 +670,8 @@ class CommandRow(Adw.ExpanderRow):
         
         # Check if the response contains thinking tags
         if "<think>" in response and "</think>" in response:
-            # Extract thinking content
-            thinking_start = response.find("<think>")
-            thinking_end = response.find("</think>") + len("</think>")
-            thinking_content = response[thinking_start + len("<think>"):thinking_end - len("</think>")].strip()
-            
-            # Store the thinking content for later use
-            self._thinking_content = thinking_content
-            
-            # Extract the actual response (after the thinking part)
-            processed_response = response[thinking_end:].strip()
-            
-            # If we already have an AI response label, add the thinking expander
-            if self.ai_response_label and self.ai_response_label.get_parent():
-                self._add_thinking_expander(thinking_content)
+            # Store the thinking content for later use and keep the actual response
+            self._thinking_content, processed_response = self._split_thinking(response)
         
         # Check if the response is in the ChatMessageDataAssistant format
         elif isinstance(response, str) and "ChatMessageDataAssistant.from_dict" in response:
@@ -615,47 +722,132 @@ class CommandRow(Adw.ExpanderRow):
                 # Check if this is a tool call response
                 if 'tool_calls' in parsed:
                     # This is a tool call, extract all tool calls
-                    tool_calls = parsed['tool_calls']
-                    if tool_calls and len(tool_calls) > 0:
-                        # Store all tool calls for sequential processing
-                        self._pending_tool_calls = []
-                        
-                        # Track unique commands to avoid duplicates
-                        unique_commands = set()
-                        
-                        for tool_call in tool_calls:
-                            if tool_call['function']['name'] == 'terminal_execute':
-                                try:
-                                    arguments = json.loads(tool_call['function']['arguments'])
-                                    command = arguments.get('command', '')
-                                    if command:
-                                        # Only add this command if we haven't seen it before
-                                        if command not in unique_commands:
-                                            unique_commands.add(command)
-                                            self._pending_tool_calls.append({
-                                                "id": tool_call['id'],
-                                                "command": command
-                                            })
-                                        else:
-                                            print(f"Skipping duplicate command: {command}")
-                                except Exception as e:
-                                    print(f"Error parsing tool call arguments: {e}")
-                        
-                        # Process the first tool call
-                        if self._pending_tool_calls:
-                            first_call = self._pending_tool_calls[0]
-                            GLib.idle_add(self.set_suggested_command, first_call["command"])
-                            self._command_id = first_call["id"]
-                            self.pending_command_id = first_call["id"]
-                            
-                            # Return a message about the first command
-                            return f"I'll run the command: {first_call['command']}"
+                    message = self._handle_tool_calls(parsed['tool_calls'])
+                    if message:
+                        return message
         except Exception as e:
             print(f"Error processing JSON response: {e}")
             traceback.print_exc()
         
         return processed_response
     
+    def _handle_tool_calls(self, tool_calls):
+        """
+        Queue the tool calls of a response and start on them: calls that need no
+        confirmation are answered, and the commands either form a concurrent
+        batch or are suggested one by one, starting with the first. Returns a
+        message about the commands to run, or None. Widgets are only touched
+        from the main loop, so this can run on any thread.
+        """
+        if not tool_calls:
+            return None
+        
+        # Store all tool calls for sequential processing
+        self._pending_tool_calls = []
+        
+        # Track unique commands to avoid duplicates
+        unique_commands = set()
+        
+        for tool_call in tool_calls:
+            if tool_call['function']['name'] not in AGENT_TOOL_NAMES:
+                continue
+            try:
+                command, answer = self._parse_tool_call(tool_call)
+            except Exception as e:
+                print(f"Error parsing tool call arguments: {e}")
+                continue
+            if answer is not None:
+                # Answered right away, sent along with the command results
+                self._tool_results.append((tool_call['id'], answer))
+            elif command:
+                # Only add this command if we haven't seen it before
+                if command not in unique_commands:
+                    unique_commands.add(command)
+                    self._pending_tool_calls.append({
+                        "id": tool_call['id'],
+                        "command": command
+                    })
+                else:
+                    print(f"Skipping duplicate command: {command}")
+        
+        # Run a batch of calls concurrently if configured
+        if self._start_tool_call_batch(self._pending_tool_calls):
+            commands = ", ".join(call["command"] for call in self._pending_tool_calls)
+            self._pending_tool_calls = []
+            return f"I'll run these commands: {commands}"
+        
+        # Only calls that were answered right away, send them back now
+        if not self._pending_tool_calls:
+            if self._tool_results:
+                GLib.idle_add(self._send_answered_tool_calls)
+            return None
+        
+        # Process the first tool call
+        first_call = self._pending_tool_calls[0]
+        GLib.idle_add(self.set_suggested_command, first_call["command"])
+        self._command_id = first_call["id"]
+        self.pending_command_id = first_call["id"]
+        print(f"Set first command: {first_call['command']} with ID: {first_call['id']}")
+        return f"I'll run the command: {first_call['command']}"
+    
+    @staticmethod
+    def _parse_tool_call(tool_call):
+        """
+        Return (command, answer) for a tool call: the command to confirm and run,
+        or the answer of a tool that needs no confirmation (polling a job).
+        """
+        name = tool_call['function']['name']
+        arguments = json.loads(tool_call['function']['arguments'] or "{}")
+        if name == 'job_output':
+            return None, poll_job(arguments.get('job_id'))
+        
+        command = arguments.get('command', '').strip()
+        if name == 'job_start' and command and not is_background_command(command):
+            # Background jobs are commands with a trailing "&"
+            command += " &"
+        return command, None
+    
+    def _send_answered_tool_calls(self):
+        """Send the results of tool calls that were answered without running a command"""
+        window = self.window
+        if window and hasattr(window, 'lm_manager'):
+            results = self._tool_results
+            self._tool_results = []
+            print(f"DEBUG - Sending {len(results)} tool results answered right away")
+            if not window.lm_manager.send_tool_results(results):
+                print("Failed to send tool results to AI")
+        else:
+            print("Could not access LM Studio manager from window")
+        return False
+    
+    def _start_tool_call_batch(self, tool_calls):
+        """
+        Set up a concurrent batch for several tool calls, if tool_call_mode is
+        "concurrent". Returns False when the calls should run one by one.
+        """
+        if len(tool_calls) < 2 or get_config("tool_call_mode", "sequential") != "concurrent":
+            return False
+        GLib.idle_add(self._create_tool_call_batch, list(tool_calls))
+        return True
+    
+    def _create_tool_call_batch(self, tool_calls):
+        """Create the rows of a concurrent batch; this row takes the first call"""
+        batch = ToolCallBatch(self.window)
+        batch.answered = self._tool_results
+        self._tool_results = []
+        for index, call in enumerate(tool_calls):
+            if index == 0:
+                row = self
+            else:
+                row = CommandRow()
+                row._set_title(f"Command: {call['command']}")
+                if self.window:
+                    self.window.append_command_row(row)
+            row._command_id = call["id"]
+            batch.add(row)
+            row.set_suggested_command(call["command"])
+        return False
+    
     def _process_tool_request(self, tool_content):
         """Process a tool request from the AI"""
         try:
@@ -675,40 +867,7 @@ class CommandRow(Adw.ExpanderRow):
             # Check if this is a single tool call or multiple tool calls
             if isinstance(tool_json, dict) and "tool_calls" in tool_json:
                 # Multiple tool calls from the API response
-                tool_calls = tool_json["tool_calls"]
-                if tool_calls and len(tool_calls) > 0:
-                    # Store all tool calls for sequential processing
-                    self._pending_tool_calls = []
-                    
-                    # Track unique commands to avoid duplicates
-                    unique_commands = set()
-                    
-                    # Add all tool calls to the queue
-                    for tool_call in tool_calls:
-                        if tool_call["function"]["name"] == "terminal_execute":
-                            try:
-                                arguments = json.loads(tool_call["function"]["arguments"])
-                                command = arguments.get("command", "")
-                                if command:
-                                    # Only add this command if we haven't seen it before
-                                    if command not in unique_commands:
-                                        unique_commands.add(command)
-                                        self._pending_tool_calls.append({
-                                            "id": tool_call["id"],
-                                            "command": command
-                                        })
-                                    else:
-                                        print(f"Skipping duplicate command: {command}")
-                            except Exception as e:
-                                print(f"Error parsing tool call arguments: {e}")
-                    
-                    # Process the first tool call
-                    if self._pending_tool_calls:
-                        first_call = self._pending_tool_calls[0]
-                        self.set_suggested_command(first_call["command"])
-                        self._command_id = first_call["id"]
-                        self.pending_command_id = first_call["id"]
-                        print(f"Set first command: {first_call['command']} with ID: {first_call['id']}")
+                self._handle_tool_calls(tool_json["tool_calls"])
             
             # Handle single tool call (legacy format)
             elif isinstance(tool_json, dict) and tool_json.get("name") == "terminal_execute":
@@ -737,323 +896,627 @@ class CommandRow(Adw.ExpanderRow):
             print(f"Error processing tool request: {e}")
             traceback.print_exc()
     
-    def _add_thinking_expander(self, thinking_content, parent_box=None):
-        """Add an expander for the AI's thinking process"""
-        # Create an expander row for the thinking content
-        thinking_expander = Adw.ExpanderRow()
-        thinking_expander.set_title("AI's Thinking Process")
-        thinking_expander.set_expanded(False)
-        
-        # Create a MarkdownLabel for the thinking content
-        from markdown_renderer import MarkdownLabel
-        thinking_label = MarkdownLabel()
-        thinking_label.set_margin_start(10)
-        thinking_label.set_margin_end(10)
-        thinking_label.set_margin_top(5)
-        thinking_label.set_margin_bottom(5)
-        thinking_label.set_markdown(thinking_content)
-        
-        # Add the label to the expander
-        thinking_expander.add_row(thinking_label)
-        
-        # Add the expander to the specified parent box or the AI response box
-        if parent_box:
-            # Add the expander at the beginning of the box
-            parent_box.prepend(thinking_expander)
-        elif self.ai_response_box:
-            # If there's already content in the AI box, we need to reorganize
-            if self.ai_response_label:
-                # Create a vertical box to hold both the expander and the response
-                vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=5)
-                
-                # Add the expander to the box
-                vbox.append(thinking_expander)
-                
-                # Move the existing label to the box
-                if self.ai_response_label.get_parent() == self.ai_response_box:
-                    self.ai_response_box.remove(self.ai_response_label)
-                    vbox.append(self.ai_response_label)
-                
-                # Add the box to the AI response box
-                self.ai_response_box.append(vbox)
-            else:
-                # Just add the expander
-                self.ai_response_box.append(thinking_expander)
-    
     def get_chat_history(self):
         """Return the chat history in a format compatible with LM Studio"""
         return self.chat_history
-
+    
     # Add new methods for streaming responses
     def start_ai_response(self):
         """Initialize an AI response with a throbber to indicate loading"""
-        # Make sure the AI box is visible
-        self.ai_box.set_visible(True)
-        
-        # Create a new label if needed
-        if not self.ai_response_label:
-            # Use MarkdownLabel instead of regular Gtk.Label
-            from markdown_renderer import MarkdownLabel
-            self.ai_response_label = MarkdownLabel()
-            self.ai_response_label.set_margin_start(10)
-            self.ai_response_label.set_margin_end(10)
-            self.ai_response_label.set_margin_top(5)
-            self.ai_response_label.set_margin_bottom(5)
-            
-            # Add the label to the AI response box
-            self.ai_response_box.append(self.ai_response_label)
-        
-        # Create a spinner (throbber)
-        self.ai_spinner = Gtk.Spinner()
-        self.ai_spinner.set_spinning(True)
-        self.ai_spinner.set_size_request(20, 20)
-        self.ai_spinner.set_margin_start(10)
-        self.ai_spinner.set_margin_end(10)
-        self.ai_spinner.set_margin_top(5)
-        self.ai_spinner.set_margin_bottom(5)
+        primary = self._ensure_primary_response()
         
-        # Add the spinner to the AI box
-        self.ai_response_box.append(self.ai_spinner)
-        
-        # Set initial text
-        self.ai_response_label.set_markdown("_Thinking..._")
+        # Set initial text and show the spinner
+        primary.text = "_Thinking..._"
+        primary.streaming = True
+        self._emit_response_changed(primary)
         
         # Store the current response text
         self._current_response_text = ""
         
         # Add to chat history (will be updated with final response)
         self.chat_history["messages"].append({"role": "assistant", "content": ""})
-
+    
     def update_streaming_response(self, chunk):
         """Update the AI response with a new chunk of text"""
-        if not hasattr(self, '_current_response_text'):
-            self._current_response_text = ""
-            self._thinking_processed = False  # Flag to track if we've already processed thinking tags
-        
         # Append the new chunk to the current text
         self._current_response_text += chunk
         
-        # Process the response to extract the actual content
-        # Only process thinking tags once
-        if not hasattr(self, '_thinking_processed') or not self._thinking_processed:
-            if "<think>" in self._current_response_text and "</think>" in self._current_response_text:
-                # Extract thinking content
-                thinking_start = self._current_response_text.find("<think>")
-                thinking_end = self._current_response_text.find("</think>") + len("</think>")
-                thinking_content = self._current_response_text[thinking_start + len("<think>"):thinking_end - len("</think>")].strip()
-                
-                # Store the thinking content for later use
-                self._thinking_content = thinking_content
-                
-                # Extract the actual response (after the thinking part)
-                processed_response = self._current_response_text[thinking_end:].strip()
-                
-                # If we already have an AI response label, add the thinking expander
-                if self.ai_response_label and self.ai_response_label.get_parent():
-                    self._add_thinking_expander(thinking_content)
-                
-                # Mark that we've processed thinking tags
-                self._thinking_processed = True
-            else:
-                # No complete thinking section yet, just use the current content
-                processed_response = self._current_response_text
-        else:
-            # We've already processed thinking tags, just update with content after the thinking section
-            thinking_end = self._current_response_text.find("</think>") + len("</think>")
-            if thinking_end > 0:
-                processed_response = self._current_response_text[thinking_end:].strip()
-            else:
-                processed_response = self._current_response_text
+        # Split off the thinking section once it is complete
+        thinking_content, processed_response = self._split_thinking(self._current_response_text)
         
-        # Update the label with the current text
-        if self.ai_response_label:
-            self.ai_response_label.set_markdown(processed_response)
+        primary = self._ensure_primary_response()
+        if thinking_content is not None:
+            primary.thinking = thinking_content
+        primary.text = processed_response
+        self._emit_response_changed(primary)
         
         # Update the chat history
         if self.chat_history["messages"] and self.chat_history["messages"][-1]["role"] == "assistant":
             self.chat_history["messages"][-1]["content"] = processed_response
-        
-        # Scroll to bottom as content is updated
-        self._scroll_to_bottom()
-
+    
     def finish_streaming_response(self):
         """Finalize the streaming response by removing the spinner"""
-        # Remove the spinner if it exists
-        if hasattr(self, 'ai_spinner') and self.ai_spinner:
-            parent = self.ai_spinner.get_parent()
-            if parent:
-                parent.remove(self.ai_spinner)
-            self.ai_spinner = None
-        
-        # Reset the thinking processed flag
-        if hasattr(self, '_thinking_processed'):
-            self._thinking_processed = False
-
+        if self._primary_response and self._primary_response.streaming:
+            self._primary_response.streaming = False
+            self._emit_response_changed(self._primary_response)
+        
+        # The text lives on in the response and the chat history
+        self._current_response_text = ""
+    
     def start_new_ai_response(self):
         """Start a new AI response bubble with a spinner"""
-        # Create a new AI response box
-        new_ai_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
-        new_ai_box.set_halign(Gtk.Align.END)
-        new_ai_box.add_css_class("card")
-        new_ai_box.add_css_class("ai-bubble")
-        new_ai_box.set_margin_start(48)
-        
-        # Create a new MarkdownLabel for the response
-        from markdown_renderer import MarkdownLabel
-        new_label = MarkdownLabel()
-        new_label.set_margin_start(10)
-        new_label.set_margin_end(10)
-        new_label.set_margin_top(5)
-        new_label.set_margin_bottom(5)
-        new_label.set_markdown("_Thinking..._")
-        
-        # Create a spinner (throbber)
-        spinner = Gtk.Spinner()
-        spinner.set_spinning(True)
-        spinner.set_size_request(20, 20)
-        spinner.set_margin_start(5)
-        spinner.set_margin_end(10)
-        
-        # Create a box to hold the label and spinner
-        content_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=5)
-        content_box.append(new_label)
-        content_box.append(spinner)
-        
-        # Add the content box to the new AI box
-        new_ai_box.append(content_box)
-        
-        # Add the new AI box to the content box
-        self.content_box.append(new_ai_box)
-        
-        # Make sure the new AI box is visible
-        new_ai_box.set_visible(True)
+        new_response = AIResponse("_Thinking..._", streaming=True)
+        self.responses.append(new_response)
+        self._emit_response_changed(new_response)
         
         # Add placeholder to chat history (will be updated with final response)
         self.chat_history["messages"].append({"role": "assistant", "content": ""})
         
         # Store references for later updates
-        self._streaming_ai_box = new_ai_box
-        self._streaming_label = new_label
-        self._streaming_spinner = spinner
+        self._streaming_response = new_response
         self._streaming_content = ""
         
-        # Return the new AI box and label
-        return new_ai_box, new_label
-
+        return new_response
+    
     def update_streaming_ai_response(self, chunk):
         """Update the streaming AI response with a new chunk of text"""
-        if not hasattr(self, '_streaming_content'):
-            self._streaming_content = ""
-        
         # Append the new chunk to the current text
         self._streaming_content += chunk
         
         # Check if we have a complete thinking section
-        if "<think>" in self._streaming_content and "</think>" in self._streaming_content:
-            # Extract thinking content
-            thinking_start = self._streaming_content.find("<think>")
-            thinking_end = self._streaming_content.find("</think>") + len("</think>")
-            thinking_content = self._streaming_content[thinking_start + len("<think>"):thinking_end - len("</think>")].strip()
-            
-            # Store the thinking content
-            self._thinking_content = thinking_content
-            
-            # Extract the actual response (after the thinking part)
-            processed_response = self._streaming_content[thinking_end:].strip()
-            
-            # If we have a streaming label, update it with just the response part
-            if hasattr(self, '_streaming_label') and self._streaming_label:
-                self._streaming_label.set_markdown(processed_response)
-                
-                # If we don't already have a thinking expander, add one
-                if not hasattr(self, '_thinking_expander_added') or not self._thinking_expander_added:
-                    # Get the parent of the streaming label
-                    parent = self._streaming_label.get_parent()
-                    
-                    # If the parent is a horizontal box (for label and spinner), get its parent
-                    if isinstance(parent, Gtk.Box) and parent.get_orientation() == Gtk.Orientation.HORIZONTAL:
-                        parent = parent.get_parent()
-                    
-                    # Create a vertical box to hold both the thinking expander and the response
-                    if not isinstance(parent, Gtk.Box) or parent.get_orientation() != Gtk.Orientation.VERTICAL:
-                        # Create a new vertical box
-                        vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=5)
-                        
-                        # Replace the streaming label with the vbox in its parent
-                        old_parent = self._streaming_label.get_parent()
-                        if old_parent:
-                            # If the parent is a horizontal box with the spinner, we need to handle differently
-                            if isinstance(old_parent, Gtk.Box) and old_parent.get_orientation() == Gtk.Orientation.HORIZONTAL:
-                                # Get the grandparent
-                                grandparent = old_parent.get_parent()
-                                if grandparent:
-                                    # Remove the horizontal box from its parent
-                                    grandparent.remove(old_parent)
-                                    
-                                    # Add the vbox to the grandparent
-                                    grandparent.append(vbox)
-                                    
-                                    # Create a new horizontal box for the label and spinner
-                                    hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=5)
-                                    
-                                    # Add the label to the horizontal box
-                                    old_parent.remove(self._streaming_label)
-                                    hbox.append(self._streaming_label)
-                                    
-                                    # Add the spinner to the horizontal box if it exists
-                                    if hasattr(self, '_streaming_spinner') and self._streaming_spinner:
-                                        old_parent.remove(self._streaming_spinner)
-                                        hbox.append(self._streaming_spinner)
-                                    
-                                    # Add the horizontal box to the vbox
-                                    vbox.append(hbox)
-                            else:
-                                # Standard case - just replace the label with the vbox
-                                old_parent.remove(self._streaming_label)
-                                old_parent.append(vbox)
-                                vbox.append(self._streaming_label)
-                        
-                        # Add the thinking expander to the vbox
-                        self._add_thinking_expander(thinking_content, vbox)
-                    else:
-                        # Parent is already a vertical box, just add the thinking expander
-                        self._add_thinking_expander(thinking_content, parent)
-                    
-                    # Mark that we've added the thinking expander
-                    self._thinking_expander_added = True
-            
-            # Update the chat history
-            if self.chat_history["messages"] and self.chat_history["messages"][-1]["role"] == "assistant":
-                self.chat_history["messages"][-1]["content"] = processed_response
-        else:
+        thinking_content, processed_response = self._split_thinking(self._streaming_content)
+        if thinking_content is None:
             # No complete thinking section yet, just update with the current content
             processed_response = self._process_response(self._streaming_content)
-            
-            # Update the label with the current text
-            if hasattr(self, '_streaming_label') and self._streaming_label:
-                self._streaming_label.set_markdown(processed_response)
-            
-            # Update the chat history
-            if self.chat_history["messages"] and self.chat_history["messages"][-1]["role"] == "assistant":
-                self.chat_history["messages"][-1]["content"] = processed_response
         
-        # Scroll to bottom as content is updated
-        self._scroll_to_bottom()
-
+        # Update the streaming bubble
+        if self._streaming_response:
+            if thinking_content is not None:
+                self._streaming_response.thinking = thinking_content
+            self._streaming_response.text = processed_response
+            self._emit_response_changed(self._streaming_response)
+        
+        # Update the chat history
+        if self.chat_history["messages"] and self.chat_history["messages"][-1]["role"] == "assistant":
+            self.chat_history["messages"][-1]["content"] = processed_response
+    
     def finish_streaming_ai_response(self):
         """Finalize the streaming AI response by removing the spinner"""
-        # Remove the spinner if it exists
-        if hasattr(self, '_streaming_spinner') and self._streaming_spinner:
-            parent = self._streaming_spinner.get_parent()
-            if parent:
-                parent.remove(self._streaming_spinner)
-            self._streaming_spinner = None
-            
-        # Reset the streaming flags
+        if self._streaming_response and self._streaming_response.streaming:
+            self._streaming_response.streaming = False
+            self._emit_response_changed(self._streaming_response)
+        
+        # Reset the streaming state
         self._streaming_content = ""
-        if hasattr(self, '_thinking_expander_added'):
-            self._thinking_expander_added = False
+        self._streaming_response_active = False
+
+class ResponseBubble(Gtk.Box):
+    """Speech bubble showing one AIResponse"""
+    
+    def __init__(self):
+        super().__init__(orientation=Gtk.Orientation.HORIZONTAL)
+        self.set_halign(Gtk.Align.END)
+        self.add_css_class("card")
+        self.add_css_class("ai-bubble")
+        self.set_margin_start(48)
+        
+        # Vertical box holding the thinking expander (created on demand) and the answer
+        self.vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=5)
+        self.append(self.vbox)
+        self.thinking_expander = None
+        self.thinking_label = None
+        
+        # Answer label and spinner
+        hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=5)
+        self.label = MarkdownLabel()
+        self.label.set_margin_start(10)
+        self.label.set_margin_end(10)
+        self.label.set_margin_top(5)
+        self.label.set_margin_bottom(5)
+        hbox.append(self.label)
+        
+        self.spinner = Gtk.Spinner()
+        self.spinner.set_size_request(20, 20)
+        self.spinner.set_margin_start(5)
+        self.spinner.set_margin_end(10)
+        hbox.append(self.spinner)
+        self.vbox.append(hbox)
+        
+        # Text currently shown, to skip redundant markdown updates
+        self._text = None
+        self._thinking = None
+    
+    def update(self, response):
+        """Show the given response"""
+        if response.thinking and response.thinking != self._thinking:
+            if not self.thinking_expander:
+                # Create an expander row for the thinking content
+                self.thinking_expander = Adw.ExpanderRow()
+                self.thinking_expander.set_title("AI's Thinking Process")
+                self.thinking_expander.set_expanded(False)
+                
+                self.thinking_label = MarkdownLabel()
+                self.thinking_label.set_margin_start(10)
+                self.thinking_label.set_margin_end(10)
+                self.thinking_label.set_margin_top(5)
+                self.thinking_label.set_margin_bottom(5)
+                self.thinking_expander.add_row(self.thinking_label)
+                
+                # The thinking expander goes above the answer
+                self.vbox.prepend(self.thinking_expander)
+            self.thinking_label.set_markdown(response.thinking)
+            self._thinking = response.thinking
+        
+        if self.thinking_expander:
+            self.thinking_expander.set_visible(bool(response.thinking))
+        
+        if response.text != self._text:
+            self.label.set_markdown(response.text)
+            self._text = response.text
+        
+        self.spinner.set_visible(response.streaming)
+        self.spinner.set_spinning(response.streaming)
+
+class CommandRowView(Adw.ExpanderRow):
+    """
+    The widgets showing a CommandRow.
+    
+    Views are created by the conversation list view and rebound to other rows
+    as it scrolls, so only rows on screen hold widgets. A collapsed view drops
+    its output and response widgets and rebuilds them when expanded again.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self.set_title("")
+        self.set_use_markup(False)
+        
+        # The row currently shown and its signal handlers
+        self.row = None
+        self._handler_ids = []
+        self._response_bubbles = []
+        self._updating = False
         
-        # Reset the streaming response active flag
-        if hasattr(self, '_streaming_response_active'):
-            self._streaming_response_active = False
\ No newline at end of file
+        # Whether the output and responses of the row are currently shown
+        self._content_shown = False
+        
+        # Main content box
+        self.content_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=8)
+        self.content_box.set_margin_top(8)
+        self.content_box.set_margin_bottom(8)
+        self.content_box.set_margin_start(16)
+        self.content_box.set_margin_end(16)
+        
+        # User prompt box (speech bubble style)
+        self.user_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        self.user_box.set_halign(Gtk.Align.START)
+        self.user_box.add_css_class("card")
+        self.user_box.add_css_class("user-bubble")
+        self.user_box.set_margin_end(48)
+        
+        self.user_label = Gtk.Label()
+        self.user_label.set_selectable(True)
+        self.user_label.set_wrap(True)
+        self.user_label.set_xalign(0)
+        self.user_label.set_margin_start(12)
+        self.user_label.set_margin_end(12)
+        self.user_label.set_margin_top(8)
+        self.user_label.set_margin_bottom(8)
+        self.user_box.append(self.user_label)
+        
+        # Command row and run button
+        self.command_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=8)
+        
+        self.command_label = Gtk.Label()
+        self.command_label.set_selectable(True)
+        self.command_label.set_wrap(True)
+        self.command_label.set_wrap_mode(Pango.WrapMode.CHAR)
+        self.command_label.set_xalign(0)
+        self.command_label.add_css_class("monospace")
+        self.command_label.add_css_class("command-text")
+        
+        # Put command in a frame
+        command_frame = Gtk.Frame()
+        command_frame.set_child(self.command_label)
+        command_frame.add_css_class("command-frame")
+        command_frame.set_hexpand(True)
+        self.command_box.append(command_frame)
+        
+        # Confirmation buttons for suggested commands
+        self.confirmation_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=4)
+        
+        run_button = Gtk.Button(label="Run")
+        run_button.add_css_class("suggested-action")  # Gives it a highlighted appearance
+        run_button.connect("clicked", self._on_run_command)
+        self.confirmation_box.append(run_button)
+        
+        cancel_button = Gtk.Button(label="Cancel")
+        cancel_button.connect("clicked", self._on_cancel_command)
+        self.confirmation_box.append(cancel_button)
+        
+        # Approves every waiting call of a concurrent tool call batch at once
+        self.run_all_button = Gtk.Button(label="Run All")
+        self.run_all_button.set_tooltip_text("Run all commands of this batch at the same time")
+        self.run_all_button.connect("clicked", self._on_run_all_commands)
+        self.confirmation_box.append(self.run_all_button)
+        
+        # Run the command in a pseudo-terminal instead of pipes
+        self.pty_button = Gtk.ToggleButton()
+        self.pty_button.set_icon_name("utilities-terminal-symbolic")
+        self.pty_button.set_tooltip_text("Run in a terminal (unbuffered output)")
+        self.pty_button.connect("toggled", self._on_pty_toggled)
+        self.confirmation_box.append(self.pty_button)
+        
+        self.command_box.append(self.confirmation_box)
+        
+        # Stops the running command
+        self.stop_button = Gtk.Button(label="Stop")
+        self.stop_button.add_css_class("destructive-action")
+        self.stop_button.set_tooltip_text("Stop the command (interrupt, then terminate, then kill)")
+        self.stop_button.set_valign(Gtk.Align.START)
+        self.stop_button.connect("clicked", self._on_stop_command)
+        self.command_box.append(self.stop_button)
+        
+        # Output box with monospace text
+        self.output_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        self.output_box.add_css_class("terminal-output")
+        
+        # Copy button for the output (the view itself may be trimmed)
+        copy_button = Gtk.Button()
+        copy_button.set_icon_name("edit-copy-symbolic")
+        copy_button.set_tooltip_text("Copy Output")
+        copy_button.set_halign(Gtk.Align.END)
+        copy_button.add_css_class("flat")
+        copy_button.connect("clicked", self._on_copy_output)
+        
+        # Badge for results served from the command cache, and a button to run the command again
+        output_header = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=4)
+        
+        self.cache_label = Gtk.Label()
+        self.cache_label.add_css_class("cached-badge")
+        self.cache_label.set_visible(False)
+        output_header.append(self.cache_label)
+        
+        self.rerun_button = Gtk.Button()
+        self.rerun_button.set_icon_name("view-refresh-symbolic")
+        self.rerun_button.set_tooltip_text("Run Again")
+        self.rerun_button.add_css_class("flat")
+        self.rerun_button.connect("clicked", self._on_rerun_command)
+        output_header.append(self.rerun_button)
+        
+        header_spacer = Gtk.Box()
+        header_spacer.set_hexpand(True)
+        output_header.append(header_spacer)
+        
+        output_header.append(copy_button)
+        self.output_box.append(output_header)
+        
+        # Pager for outputs too large to keep in memory; pages are read from the spill file
+        self.pager_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=4)
+        self.pager_box.set_visible(False)
+        
+        self.pager_label = Gtk.Label()
+        self.pager_label.set_hexpand(True)
+        self.pager_label.set_xalign(0)
+        self.pager_label.add_css_class("dim-label")
+        self.pager_box.append(self.pager_label)
+        
+        for icon_name, tooltip, callback in (
+            ("go-previous-symbolic", "Previous Page", lambda button: self._on_page(-1)),
+            ("go-next-symbolic", "Next Page", lambda button: self._on_page(1)),
+            ("go-bottom-symbolic", "Latest Output", self._on_page_latest),
+        ):
+            page_button = Gtk.Button()
+            page_button.set_icon_name(icon_name)
+            page_button.set_tooltip_text(tooltip)
+            page_button.add_css_class("flat")
+            page_button.connect("clicked", callback)
+            self.pager_box.append(page_button)
+        
+        # The full output is too large for the clipboard, but can be saved
+        save_button = Gtk.Button()
+        save_button.set_icon_name("document-save-symbolic")
+        save_button.set_tooltip_text("Save Output…")
+        save_button.add_css_class("flat")
+        save_button.connect("clicked", self._on_save_output)
+        self.pager_box.append(save_button)
+        self.output_box.append(self.pager_box)
+        
+        # Page of the spill file shown, or None for the latest output
+        self._page = None
+        
+        # Append-only text view, so streaming output never re-lays-out the whole text
+        self.output_view = OutputView()
+        
+        self.output_scroll = Gtk.ScrolledWindow()
+        self.output_scroll.add_css_class("terminal-scrolled")
+        self.output_scroll.set_min_content_height(100)
+        self.output_scroll.set_max_content_height(400)
+        self.output_scroll.set_propagate_natural_height(True)
+        self.output_scroll.set_child(self.output_view)
+        self.output_box.append(self.output_scroll)
+        
+        # What the last run cost (time, CPU, memory, I/O)
+        self.usage_label = Gtk.Label()
+        self.usage_label.set_xalign(0)
+        self.usage_label.set_wrap(True)
+        self.usage_label.set_selectable(True)
+        self.usage_label.add_css_class("dim-label")
+        self.usage_label.add_css_class("caption")
+        self.usage_label.set_visible(False)
+        self.output_box.append(self.usage_label)
+        
+        # Follow new output unless the user scrolled up in it
+        self.output_autoscroll = AutoScroller(self.output_scroll)
+        
+        # Keep the row's terminal size in sync with the width of the output
+        self.output_scroll.get_hadjustment().connect("notify::page-size", self._on_output_resized)
+        
+        # AI response bubbles
+        self.responses_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=8)
+        
+        # Add all elements to the content box
+        self.content_box.append(self.user_box)
+        self.content_box.append(self.command_box)
+        self.content_box.append(self.output_box)
+        self.content_box.append(self.responses_box)
+        
+        self.add_row(self.content_box)
+        
+        # Keep the model in sync when the user expands or collapses the row
+        self.connect("notify::expanded", self._on_expanded_changed)
+    
+    def bind(self, row):
+        """Show the given row in this view"""
+        self.unbind()
+        self.row = row
+        self._handler_ids = [
+            row.connect("changed", self._on_row_changed),
+            row.connect("output-appended", self._on_output_appended),
+            row.connect("response-changed", self._on_response_changed),
+        ]
+        for part in ("title", "expanded", "user", "command", "output", "cache", "usage", "responses"):
+            self._update(part)
+    
+    def unbind(self):
+        """Stop showing the current row and release its content"""
+        if self.row is None:
+            return
+        for handler_id in self._handler_ids:
+            self.row.disconnect(handler_id)
+        self._handler_ids = []
+        
+        # Drop the content so recycled views don't keep old text alive, and let
+        # the row shrink to its compact form while it is off screen
+        self._release_content()
+        row = self.row
+        self.row = None
+        row.dehydrate()
+    
+    def _on_row_changed(self, row, part):
+        """Handle a change in the bound row"""
+        self._update(part)
+        if part == "expanded":
+            self._on_row_expanded_changed()
+    
+    def _update(self, part):
+        """Update the widgets for one part of the row"""
+        row = self.row
+        self._updating = True
+        try:
+            if part == "title":
+                self.set_title(row.title)
+            elif part == "expanded":
+                self.set_expanded(row.expanded)
+            elif part == "user":
+                self.user_label.set_text(row.user_prompt or "")
+                self.user_box.set_visible(row.user_prompt is not None)
+            elif part == "command":
+                self.command_label.set_text(row.command)
+                self.command_box.set_visible(row.command_state != COMMAND_NONE)
+                running = row.process_handle is not None
+                self.confirmation_box.set_visible(row.command_state == COMMAND_SUGGESTED)
+                self.stop_button.set_visible(running)
+                self.run_all_button.set_visible(row.tool_call_batch is not None and len(row.tool_call_batch.rows) > 1)
+                self.rerun_button.set_visible(row.command_state in (COMMAND_DIRECT, COMMAND_FINISHED) and not running)
+                if row.use_pty is None:
+                    self.pty_button.set_active(get_config("execution_mode", "pipe") == "pty")
+                else:
+                    self.pty_button.set_active(row.use_pty)
+            elif part == "cache":
+                if row.output_cached_age is not None:
+                    self.cache_label.set_text(f"Cached result ({row.output_cached_age:.0f}s old)")
+                self.cache_label.set_visible(row.output_cached_age is not None)
+            elif part == "usage":
+                self.usage_label.set_text(row.usage_text or "")
+                self.usage_label.set_visible(row.usage_text is not None)
+            elif part == "output":
+                self.output_box.set_visible(row.output_visible)
+                if row.expanded:
+                    self.output_view.set_text(row.get_command_output())
+                    self.output_autoscroll.scroll_to_bottom()
+                    self._page = None
+                    self._update_pager()
+                    self._content_shown = True
+            elif part == "responses":
+                self._clear_responses()
+                if row.expanded:
+                    for index in range(len(row.responses)):
+                        self._on_response_changed(row, index)
+                    self._content_shown = True
+        finally:
+            self._updating = False
+    
+    def _on_output_appended(self, row, chunk):
+        """Append new output to the view"""
+        if self._content_shown and self._page is None:
+            self.output_view.append(chunk)
+        
+        # The output just outgrew memory and went to a spill file
+        if not self.pager_box.get_visible() and row.output_spill is not None and row.output_spill.spilled:
+            self._update_pager()
+    
+    def _on_response_changed(self, row, index):
+        """Update or add the bubble for a response"""
+        if not row.expanded:
+            # Collapsed rows don't show responses, they are rebuilt on expand
+            return
+        self._content_shown = True
+        
+        # Create bubbles for any responses we don't show yet
+        while len(self._response_bubbles) <= index:
+            bubble = ResponseBubble()
+            self.responses_box.append(bubble)
+            self._response_bubbles.append(bubble)
+        
+        self._response_bubbles[index].update(row.responses[index])
+    
+    def _clear_responses(self):
+        """Remove all response bubbles"""
+        for bubble in self._response_bubbles:
+            self.responses_box.remove(bubble)
+        self._response_bubbles = []
+    
+    def _release_content(self):
+        """Drop the output text and response widgets"""
+        self.output_view.clear()
+        self._clear_responses()
+        self._content_shown = False
+        self._page = None
+        self.pager_box.set_visible(False)
+    
+    def _update_pager(self):
+        """Show the pager if the row's output is in a spill file"""
+        spill = self.row.output_spill if self.row is not None else None
+        if spill is None or not spill.spilled:
+            self.pager_box.set_visible(False)
+            return
+        
+        page_count = spill.page_count()
+        if self._page is None:
+            self.pager_label.set_text(f"Large output, showing its start and end ({page_count} pages in total)")
+        else:
+            self.pager_label.set_text(f"Page {self._page + 1} of {page_count}")
+        self.pager_box.set_visible(True)
+    
+    def _on_page(self, delta):
+        """Show the previous or next page of the full output"""
+        spill = self.row.output_spill if self.row is not None else None
+        if spill is None or not spill.spilled:
+            return
+        
+        # Going back from the latest output starts at the last page
+        page_count = spill.page_count()
+        if self._page is None:
+            if delta > 0:
+                return
+            page = page_count - 1
+        else:
+            page = min(max(self._page + delta, 0), page_count - 1)
+        
+        self._page = page
+        self.output_view.set_text(spill.read_page(page))
+        
+        # Stop following new output and show the page from its top
+        self.output_autoscroll.following = False
+        self.output_scroll.get_vadjustment().set_value(0)
+        self._update_pager()
+    
+    def _on_page_latest(self, button):
+        """Go back to the latest output"""
+        if self._page is not None:
+            self._page = None
+            self._update("output")
+    
+    def _on_expanded_changed(self, view, pspec):
+        """Store the expanded state in the row"""
+        if self.row is not None and not self._updating:
+            self.row.set_expanded(self.get_expanded())
+    
+    def _on_row_expanded_changed(self):
+        """Rebuild the content on expand, release it on collapse"""
+        row = self.row
+        if row.expanded and not self._content_shown:
+            self._update("output")
+            self._update("responses")
+        elif not row.expanded and self._content_shown:
+            self._release_content()
+            row.dehydrate()
+    
+    def _on_pty_toggled(self, button):
+        """Store the pty choice for the row's command"""
+        if self.row is not None and not self._updating:
+            self.row.use_pty = button.get_active()
+    
+    def _on_output_resized(self, adjustment, pspec):
+        """Tell the row how much text fits in the output view"""
+        if self.row is None:
+            return
+        size = self.output_view.get_terminal_size(self.output_scroll.get_max_content_height())
+        if size:
+            self.row.set_terminal_size(size)
+    
+    def _on_run_command(self, button):
+        """Handle running a suggested command"""
+        if self.row is not None:
+            self.row.run_command()
+    
+    def _on_run_all_commands(self, button):
+        """Handle running all commands of a tool call batch"""
+        if self.row is not None and self.row.tool_call_batch is not None:
+            self.row.tool_call_batch.run_all()
+    
+    def _on_rerun_command(self, button):
+        """Handle running the command again without the cache"""
+        if self.row is not None:
+            self.row.rerun_command()
+    
+    def _on_stop_command(self, button):
+        """Handle stopping the running command"""
+        if self.row is not None:
+            self.row.stop_command()
+    
+    def _on_cancel_command(self, button):
+        """Handle canceling a suggested command"""
+        if self.row is not None:
+            self.row.cancel_command()
+    
+    def _on_copy_output(self, button):
+        """
+        Copy the command output to the clipboard. Of a large output only the
+        head and tail kept in memory are copied, with the omission marker
+        between them; the whole output can be saved to a file instead.
+        """
+        if self.row is None:
+            return
+        self.get_clipboard().set(strip_ansi(self.row.get_command_output()))
+    
+    def _on_save_output(self, button):
+        """Ask for a file and save the full output of the spill file to it"""
+        spill = self.row.output_spill if self.row is not None else None
+        if spill is None or not spill.spilled:
+            return
+        dialog = Gtk.FileDialog()
+        dialog.set_title("Save Output")
+        dialog.set_initial_name("output.txt")
+        dialog.save(self.get_root(), None, self._on_save_output_chosen, spill)
+    
+    def _on_save_output_chosen(self, dialog, result, spill):
+        """Stream the spill file to the chosen file on a thread, without escape sequences"""
+        try:
+            path = dialog.save_finish(result).get_path()
+        except GLib.Error:
+            # Canceled
+            return
+        
+        def save_in_thread():
+            parser = AnsiParser()
+            try:
+                with open(path, "w", encoding="utf-8") as f:
+                    for text in spill.iter_text():
+                        f.write(parser.feed(text)[0])
+                print(f"DEBUG - Saved output to {path}")
+            except OSError as e:
+                print(f"DEBUG - Could not save output to {path}: {e}")
+        
+        threading.Thread(target=save_in_thread, daemon=True).start()
@@ -0,0 +1,329 @@
+import os
+import pty
+import time
+import errno
+import fcntl
+import codecs
+import struct
+import signal
+import termios
+import selectors
+import threading
+import subprocess
+
+from command_result import CommandResult, ResourceUsage
+from config import get_config
+
+# Maximum number of bytes read from a pipe at once
+READ_SIZE = 64 * 1024
+
+# Execution modes: plain pipes, or a pseudo-terminal so programs don't block-buffer their output
+MODE_PIPE = "pipe"
+MODE_PTY = "pty"
+
+# Terminal size (rows, columns) used when the caller doesn't give one
+DEFAULT_TERMINAL_SIZE = (24, 80)
+
+# Terminal type announced to commands run in a pty
+DEFAULT_PTY_TERM = "xterm-256color"
+
+# Seconds a stopped command gets to exit before the next, stronger signal
+DEFAULT_GRACE_PERIOD = 2
+
+# Signals sent in turn to stop a command
+STOP_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGKILL)
+
+class ProcessHandle:
+    """
+    Stops a running command, escalating from SIGINT to SIGTERM to SIGKILL.
+    
+    The runner attaches a function that sends a signal to the command
+    (normally to its whole process group) and marks the handle finished once
+    the command is gone. stop() can be called from any thread, even before the
+    command has started.
+    """
+    
+    def __init__(self, grace_period=None):
+        if grace_period is None:
+            grace_period = get_config("kill_grace_period", DEFAULT_GRACE_PERIOD)
+        self.grace_period = grace_period
+        self.finished = threading.Event()
+        self.stop_requested = False
+        
+        # The last signal sent to stop the command
+        self.last_signal = None
+        
+        self._send = None
+        self._lock = threading.Lock()
+    
+    def attach(self, send):
+        """Set the function that signals the command (called by the runner)"""
+        with self._lock:
+            self._send = send
+            escalate = self.stop_requested
+        if escalate:
+            self._start_escalation()
+    
+    def attach_process_group(self, pgid):
+        """Signal the whole process group of the command"""
+        self.attach(lambda signum: os.killpg(pgid, signum))
+    
+    def stop(self):
+        """Stop the command"""
+        with self._lock:
+            if self.stop_requested or self.finished.is_set():
+                return
+            self.stop_requested = True
+            escalate = self._send is not None
+        if escalate:
+            self._start_escalation()
+    
+    def finish(self):
+        """Mark the command as gone (called by the runner)"""
+        self.finished.set()
+    
+    def _start_escalation(self):
+        """Send the stop signals on a separate thread, so the reader keeps draining output"""
+        threading.Thread(target=self._escalate, name="stop-command", daemon=True).start()
+    
+    def _escalate(self):
+        """Send each stop signal until the command is gone"""
+        for signum in STOP_SIGNALS:
+            if self.finished.is_set():
+                return
+            try:
+                self._send(signum)
+            except ProcessLookupError:
+                return
+            except OSError as e:
+                print(f"DEBUG - Could not send {signal.Signals(signum).name}: {e}")
+                return
+            self.last_signal = signum
+            print(f"DEBUG - Sent {signal.Signals(signum).name} to stop the command")
+            if self.finished.wait(self.grace_period):
+                return
+
+def resource_limits():
+    """The configured resource limits as (ulimit option, value) pairs; -t and -v work in both bash and dash"""
+    limits = []
+    cpu_limit = get_config("command_cpu_limit")
+    if cpu_limit:
+        limits.append(("-t", int(cpu_limit)))
+    memory_limit = get_config("command_memory_limit_mb")
+    if memory_limit:
+        limits.append(("-v", int(memory_limit) * 1024))
+    return limits
+
+def limits_prefix():
+    """
+    Shell commands that apply the configured resource limits, to put in front
+    of a command line (empty when no limits are set).
+    
+    Limits are set with ulimit in the command's shell, so they apply to the
+    shell and everything it starts.
+    """
+    return "".join(f"ulimit {option} {value}; " for option, value in resource_limits())
+
+def command_timeout():
+    """The configured wall-clock timeout for commands in seconds, or None"""
+    return get_config("command_timeout") or None
+
+def output_limit():
+    """The configured limit on a command's output in bytes, or None"""
+    limit = get_config("command_output_limit_mb")
+    return int(limit * 1024 * 1024) if limit else None
+
+def run_streaming(command, on_output=None, output=None, cwd=None, timeout=None,
+                  mode=MODE_PIPE, terminal_size=None, on_spawn=None, handle=None,
+                  max_output=None, input_text=None):
+    """
+    Run a shell command once and pass its output to on_output as it arrives.
+    
+    The reader blocks on a selector until one of the pipes is readable, reads
+    whatever bytes are available and decodes them incrementally, so multi-byte
+    UTF-8 characters split across reads are never mangled. on_output is called
+    on the calling thread with each decoded chunk, and the chunks are appended
+    to output (e.g. an OutputBuffer) if given. Returns a CommandResult.
+    
+    In MODE_PTY stdout and stderr are a pseudo-terminal of the given size, so
+    programs write line by line as they would in a terminal; the two streams are
+    merged and counted as stdout.
+    
+    The command gets its own process group; on_spawn, if given, is called with
+    the Popen object once the process has started. The command is stopped
+    through its process group when handle.stop() is called, when it runs
+    longer than timeout seconds or prints more than max_output bytes; the
+    configured resource limits (limits_prefix) apply to it.
+    
+    The command's stdin is /dev/null, or a pipe holding input_text if given
+    (e.g. a password for sudo -S).
+    """
+    start = time.monotonic()
+    deadline = start + timeout if timeout else None
+    if handle is None:
+        handle = ProcessHandle()
+    
+    try:
+        command_line = limits_prefix() + command
+        if mode == MODE_PTY:
+            process, fds = _spawn_pty(command_line, cwd, terminal_size or DEFAULT_TERMINAL_SIZE, input_text)
+        else:
+            process, fds = _spawn_pipes(command_line, cwd, input_text)
+    except OSError as e:
+        handle.finish()
+        return CommandResult(command, output=output, error=str(e))
+    handle.attach_process_group(process.pid)
+    if on_spawn:
+        on_spawn(process)
+    
+    # Bytes read from each stream, by file descriptor
+    byte_counts = dict.fromkeys(fds, 0)
+    timed_out = False
+    output_limited = False
+    
+    selector = selectors.DefaultSelector()
+    try:
+        # One decoder per stream, since each one is its own byte stream
+        for fd in fds:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            selector.register(fd, selectors.EVENT_READ, decoder)
+        
+        # Read until all streams are closed; we only wake up for data (or the timeout)
+        while selector.get_map():
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # Stop the command but keep reading until it is gone
+                    timed_out = True
+                    deadline = None
+                    remaining = None
+                    handle.stop()
+            
+            for key, _ in selector.select(remaining):
+                try:
+                    data = os.read(key.fd, READ_SIZE)
+                except OSError as e:
+                    # A pty master reports EIO once the last writer has gone
+                    if e.errno != errno.EIO:
+                        raise
+                    data = b""
+                
+                if data:
+                    byte_counts[key.fd] += len(data)
+                    text = key.data.decode(data)
+                else:
+                    # End of file, flush whatever the decoder still holds
+                    text = key.data.decode(b"", final=True)
+                    selector.unregister(key.fd)
+                
+                if max_output is not None and not output_limited and sum(byte_counts.values()) > max_output:
+                    output_limited = True
+                    handle.stop()
+                if output_limited:
+                    # Drain the rest without keeping it
+                    continue
+                if text:
+                    if output is not None:
+                        output.append(text)
+                    if on_output:
+                        on_output(text)
+    finally:
+        selector.close()
+        for fd in fds:
+            os.close(fd)
+    
+    # Reap the process ourselves to get its resource usage (which includes the
+    # children it waited for, i.e. the whole tree of a normal command)
+    _, status, rusage = os.wait4(process.pid, 0)
+    handle.finish()
+    exit_code = None
+    signal = None
+    if os.WIFSIGNALED(status):
+        signal = os.WTERMSIG(status)
+        process.returncode = -signal
+    else:
+        exit_code = os.WEXITSTATUS(status)
+        process.returncode = exit_code
+    
+    return CommandResult(
+        command,
+        exit_code=exit_code,
+        signal=signal,
+        stdout_bytes=byte_counts[fds[0]],
+        stderr_bytes=byte_counts[fds[1]] if len(fds) > 1 else 0,
+        wall_time=time.monotonic() - start,
+        cpu_time=rusage.ru_utime + rusage.ru_stime,
+        usage=ResourceUsage.from_rusage(rusage),
+        output=output,
+        timed_out=timed_out,
+        stopped=handle.stop_requested and not timed_out and not output_limited,
+        output_limited=output_limited,
+    )
+
+def _write_input(process, input_text):
+    """Give the process its input and close its stdin"""
+    if input_text is None:
+        return
+    try:
+        process.stdin.write(input_text.encode("utf-8"))
+    except BrokenPipeError:
+        pass
+    finally:
+        process.stdin.close()
+
+def _spawn_pipes(command, cwd, input_text=None):
+    """Start the command with stdout and stderr on pipes; returns (process, [stdout fd, stderr fd])"""
+    process = subprocess.Popen(
+        command,
+        shell=True,
+        cwd=cwd,
+        stdin=subprocess.PIPE if input_text is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        bufsize=0,
+        start_new_session=True
+    )
+    
+    _write_input(process, input_text)
+    
+    # Take over the descriptors, the reader closes them
+    fds = [os.dup(process.stdout.fileno()), os.dup(process.stderr.fileno())]
+    process.stdout.close()
+    process.stderr.close()
+    return process, fds
+
+def _spawn_pty(command, cwd, terminal_size, input_text=None):
+    """Start the command with stdout and stderr on a new pty; returns (process, [master fd])"""
+    master, slave = pty.openpty()
+    try:
+        rows, columns = terminal_size
+        fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack("HHHH", rows, columns, 0, 0))
+        
+        # Keep plain "\n" line endings instead of the terminal's "\r\n"
+        attrs = termios.tcgetattr(slave)
+        attrs[1] &= ~termios.ONLCR
+        termios.tcsetattr(slave, termios.TCSANOW, attrs)
+        
+        # The output view renders colors; other escape sequences are dropped there
+        env = dict(os.environ, TERM=get_config("pty_term", DEFAULT_PTY_TERM),
+                   COLUMNS=str(columns), LINES=str(rows))
+        
+        process = subprocess.Popen(
+            command,
+            shell=True,
+            cwd=cwd,
+            env=env,
+            stdin=subprocess.PIPE if input_text is not None else subprocess.DEVNULL,
+            stdout=slave,
+            stderr=slave,
+            start_new_session=True
+        )
+        _write_input(process, input_text)
+    except OSError:
+        os.close(master)
+        raise
+    finally:
+        # Only the child keeps the slave open, so we see EOF when it exits
+        os.close(slave)
+    return process, [master]
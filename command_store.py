@@ -0,0 +1,191 @@
+import sys
+import copy
+import time
+import weakref
+import threading
+import collections
+
+from command_result import CommandResult, format_size
+from config import get_config
+
+# Most entries a store keeps; the least recently used finished ones go first,
+# pending and running ones are never evicted
+DEFAULT_MAX_ENTRIES = 200
+
+# Seconds a finished (completed or canceled) entry is kept after its last use
+DEFAULT_TTL = 3600
+
+# Entry states that are still waiting for or running their command, never expired
+ACTIVE_STATES = ("pending", "executing")
+
+# All stores of this process, for the memory report
+_stores = weakref.WeakSet()
+
+class OutputReference:
+    """
+    Stands in for the output of a stored result without keeping it alive.
+    
+    Holds only a weak reference to the output buffer (and the path of its
+    spill file), so a completed command doesn't pin its output in memory
+    once the row showing it has let go of it.
+    """
+    
+    def __init__(self, buffer):
+        self.spill_path = getattr(buffer, "spill_path", None)
+        self.length = len(buffer)
+        self._buffer = weakref.ref(buffer)
+    
+    @property
+    def available(self):
+        """Whether the output is still around"""
+        return self._buffer() is not None
+    
+    def getvalue(self):
+        """Return the output while the buffer is alive, or an empty string"""
+        buffer = self._buffer()
+        return buffer.getvalue() if buffer is not None else ""
+    
+    def __len__(self):
+        return self.length
+
+class CommandStore:
+    """
+    Bounded store of pending and completed commands, keyed by command or tool call ID.
+    
+    Entries are dicts with at least a "status" (see ACTIVE_STATES), used like
+    the plain dicts this replaces. Finished entries expire ttl seconds after
+    their last use, and beyond max_entries the least recently used finished
+    ones are evicted. Pending and running entries are never evicted, so a
+    store full of them grows beyond max_entries until they finish. Results
+    are stored through complete(), which keeps CommandResult output by
+    reference instead of by value.
+    """
+    
+    def __init__(self, name, max_entries=None, ttl=None):
+        self.name = name
+        self.max_entries = max_entries or get_config("command_store_max_entries", DEFAULT_MAX_ENTRIES)
+        self.ttl = ttl or get_config("command_store_ttl", DEFAULT_TTL)
+        self.evicted = 0
+        
+        # Key -> [entry, time of last use], least recently used first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.RLock()
+        _stores.add(self)
+    
+    def __setitem__(self, key, entry):
+        with self._lock:
+            self._entries[key] = [entry, time.monotonic()]
+            self._entries.move_to_end(key)
+            self._evict()
+    
+    def __getitem__(self, key):
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+    
+    def __contains__(self, key):
+        return self.get(key) is not None
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+    
+    def get(self, key, default=None):
+        """Return the entry for key and mark it as used, or default"""
+        with self._lock:
+            self._expire()
+            item = self._entries.get(key)
+            if item is None:
+                return default
+            item[1] = time.monotonic()
+            self._entries.move_to_end(key)
+            return item[0]
+    
+    def pop(self, key, default=None):
+        """Remove the entry for key and return it, or default"""
+        with self._lock:
+            item = self._entries.pop(key, None)
+            return item[0] if item is not None else default
+    
+    def complete(self, key, result):
+        """Mark an entry as completed with its result; returns False if the entry is gone"""
+        with self._lock:
+            entry = self.get(key)
+            if entry is None:
+                return False
+            entry["result"] = _compact_result(result)
+            entry["status"] = "completed"
+            return True
+    
+    def _expire(self):
+        """Drop the finished entries not used for ttl seconds"""
+        cutoff = time.monotonic() - self.ttl
+        
+        # The entries are in order of last use, so only the front needs a look
+        expired = []
+        for key, (entry, used) in self._entries.items():
+            if used >= cutoff:
+                break
+            if entry.get("status") not in ACTIVE_STATES:
+                expired.append(key)
+        for key in expired:
+            del self._entries[key]
+        self.evicted += len(expired)
+    
+    def _evict(self):
+        """Keep the store within max_entries"""
+        self._expire()
+        excess = len(self._entries) - self.max_entries
+        if excess <= 0:
+            return
+        
+        # The least recently used finished entries; pending and running ones stay
+        evicted = []
+        for key, (entry, _) in self._entries.items():
+            if len(evicted) == excess:
+                break
+            if entry.get("status") not in ACTIVE_STATES:
+                evicted.append(key)
+        for key in evicted:
+            del self._entries[key]
+        self.evicted += len(evicted)
+    
+    def memory_usage(self):
+        """Estimated bytes held by the entries (not counting referenced output)"""
+        with self._lock:
+            return sum(sys.getsizeof(key) + _entry_size(entry) for key, (entry, _) in self._entries.items())
+    
+    def stats(self):
+        """Counts and memory usage of the store"""
+        with self._lock:
+            pending = sum(1 for entry, _ in self._entries.values() if entry.get("status") in ACTIVE_STATES)
+            return {"entries": len(self._entries), "pending": pending,
+                    "memory": self.memory_usage(), "evicted": self.evicted}
+    
+    def report(self):
+        """One line with the statistics of the store"""
+        stats = self.stats()
+        return (f"{self.name}: {stats['entries']} entries ({stats['pending']} pending), "
+                f"{format_size(stats['memory'])}, {stats['evicted']} evicted")
+
+def _compact_result(result):
+    """A copy of a CommandResult that refers to its output instead of holding it"""
+    if not isinstance(result, CommandResult) or result.output is None or isinstance(result.output, OutputReference):
+        return result
+    compact = copy.copy(result)
+    compact.output = OutputReference(result.output)
+    return compact
+
+def _entry_size(entry):
+    """Estimated size of an entry dict and the values in it"""
+    size = sys.getsizeof(entry)
+    for key, value in entry.items():
+        size += sys.getsizeof(key) + sys.getsizeof(value)
+        if isinstance(value, CommandResult):
+            size += sys.getsizeof(value.__dict__) + sys.getsizeof(value.command)
+    return size
+
+def memory_report():
+    """One line per command store with its entries and memory usage"""
+    return [store.report() for store in list(_stores)]
@@ -0,0 +1,25 @@
+import json
+import os
+
+# Path of the configuration file, next to the application
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
+
+# Cached contents of the configuration file
+_config = None
+
+def load_config():
+    """Load the configuration file (once) and return it as a dict"""
+    global _config
+    if _config is None:
+        _config = {}
+        try:
+            if os.path.exists(CONFIG_PATH):
+                with open(CONFIG_PATH, 'r') as f:
+                    _config = json.load(f)
+        except Exception as e:
+            print(f"Error loading config: {e}")
+    return _config
+
+def get_config(key, default=None):
+    """Return one configuration value, or the default if it isn't set"""
+    return load_config().get(key, default)
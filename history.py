@@ -0,0 +1,1203 @@
+import os
+import re
+import json
+import math
+import time
+import array
+import queue
+import fcntl
+import atexit
+import functools
+import threading
+
+# Location of the history journal, and of the old single-file history it replaces
+HISTORY_DIR = os.path.join(os.path.expanduser("~"), ".config", "lmterm")
+JOURNAL_PATH = os.path.join(HISTORY_DIR, "history.jsonl")
+LEGACY_PATH = os.path.join(HISTORY_DIR, "history.json")
+
+# Most commands kept in the history (0 for no limit); the least recently used are dropped
+DEFAULT_MAX_ENTRIES = 0
+
+# Bytes at the end of the journal read right away at startup, so the recent
+# commands are there while the whole journal is loaded in the background
+RECENT_TAIL_SIZE = 64 * 1024
+
+# Most recent commands scanned for queries too short for trigrams
+SCAN_LIMIT = 50000
+
+# Characters of the most recent commands scanned for fuzzy matches, which
+# keeps a query matching nothing within the per-keystroke budget
+FUZZY_SCAN_SIZE = 256 * 1024
+
+# Commands indexed at a time by the background indexer
+INDEX_BATCH_SIZE = 2000
+
+# The index is rebuilt once this fraction of its slots belong to replaced commands
+INDEX_GARBAGE_RATIO = 0.5
+
+# The journal is compacted once it has this many times more lines than the
+# history has commands (and at least MIN_COMPACT_LINES lines)
+COMPACT_RATIO = 2
+MIN_COMPACT_LINES = 1000
+
+# Commands a prefix index node keeps as its best suggestions, and most commands
+# kept in a leaf before it is split by the next character
+SUGGESTION_CANDIDATES = 8
+PREFIX_BUCKET_SIZE = 32
+
+# Frecency: a use counts e times less for every FRECENCY_DECAY seconds of age,
+# and commands last run in the current directory count CWD_BOOST times more
+FRECENCY_DECAY = 7 * 24 * 3600
+CWD_BOOST = 4
+
+class HistoryEntry:
+    """One command of the history: when and where it was last run, and how often"""
+    
+    __slots__ = ("command", "timestamp", "cwd", "count")
+    
+    def __init__(self, command, timestamp, cwd=None, count=1):
+        self.command = command
+        self.timestamp = timestamp
+        self.cwd = cwd
+        self.count = count
+    
+    def to_record(self):
+        """The journal line for this entry (used when compacting)"""
+        record = {"command": self.command, "ts": self.timestamp, "cwd": self.cwd}
+        if self.count > 1:
+            record["count"] = self.count
+        return record
+
+class CommandHistory:
+    """
+    Command history backed by an append-only journal.
+    
+    Every use of a command appends one JSON line (command, timestamp, working
+    directory) to the journal; the file is never rewritten on submit.
+    Duplicates are folded through a dict keyed by command, whose insertion
+    order is the history order (a command used again moves to the end), so
+    adding is O(1) whatever the size of the history.
+    
+    Appends go through a queue to a writer thread, so add() never waits for
+    the disk. Loading and refreshing run on a reader thread: load() only reads
+    the end of the journal, for the recent commands, and the reader thread
+    replaces them with the whole journal once read (then starts the writer and
+    sets loaded). A line cut short by a crash is skipped on load. The writer
+    compacts the journal (one line per command, written to a temporary file
+    and renamed over the journal) when it has grown to COMPACT_RATIO times
+    the number of commands.
+    
+    The history's own search indexes are updated on the reader thread, and
+    the indexes added with add_index (e.g. a GTK list) through dispatch, in
+    the order the commands were used.
+    
+    Several instances can share the journal. Appends and compactions hold an
+    exclusive flock on it, reads a shared one. refresh() (called when the
+    file changes) has the reader thread read only the bytes added since the
+    last read, skipping the ranges this instance appended itself. A compacted journal starts
+    with a {"compacted": size, "replaces": file id} line giving the size of
+    the one-line-per-command part, which every instance that had read the
+    replaced file has in memory, so reading goes on right after that part.
+    """
+    
+    def __init__(self, path=JOURNAL_PATH, max_entries=None, legacy_path=LEGACY_PATH, dispatch=None):
+        self.path = path
+        self.max_entries = max_entries or DEFAULT_MAX_ENTRIES
+        self.legacy_path = legacy_path
+        
+        # The history's own (thread-safe) search indexes, updated on the reader thread
+        self.search_index = TrigramIndex()
+        self.prefix_index = PrefixIndex()
+        self._own_indexes = (self.search_index, self.prefix_index)
+        
+        # Indexes added with add_index, and how calls reach the thread that owns
+        # them (e.g. GLib.idle_add); called directly by default
+        self._indexes = []
+        self._dispatch = dispatch or _call
+        
+        # Command -> HistoryEntry, least recently used first; the generation
+        # changes when the whole dict is replaced by a load
+        self._entries = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        
+        # Loading and refreshing tasks for the reader thread, as (function, args)
+        self._tasks = queue.Queue()
+        self._reader_thread = None
+        self._refresh_queued = threading.Event()
+        
+        # Set once the whole journal is in memory
+        self.loaded = threading.Event()
+        
+        # Lines in the journal file, to decide when to compact
+        self._journal_lines = 0
+        
+        # Descriptor the journal is read through, with the (device, inode) of its
+        # file; only changed on the reader thread
+        self._reader = None
+        self._file_id = None
+        
+        # Guards the ones below: file id -> bytes of that file reflected in
+        # memory, (file id, start, end) of lines appended but not read past
+        # yet, and the file this instance compacted to, kept open so its inode
+        # can't be reused, until the reader moves on to it
+        self._journal_lock = threading.Lock()
+        self._read_positions = {}
+        self._own_appends = []
+        self._compacted = None
+        
+        # Records added but not in the journal yet; they only leave this list
+        # while the writer holds the exclusive lock, so whoever holds it finds
+        # every record either in the file or here
+        self._unwritten = []
+        
+        # Wakes the writer: True to write, None to compact, False to stop
+        self._queue = queue.Queue()
+        self._writer = None
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, command):
+        return command in self._entries
+    
+    def commands(self):
+        """All commands, oldest first"""
+        with self._lock:
+            return list(self._entries)
+    
+    def get(self, command):
+        """The HistoryEntry of a command, or None"""
+        return self._entries.get(command)
+    
+    def search(self, query, limit=50):
+        """Commands matching a reverse-search query, best first"""
+        return self.search_index.search(query, limit)
+    
+    def suggest(self, prefix, cwd=None):
+        """The best command to complete prefix as typed, or None"""
+        return self.prefix_index.suggest(prefix, cwd)
+    
+    def add_index(self, index):
+        """
+        Keep a search index up to date with the history.
+        
+        The index is built from the current entries right away, on the calling
+        thread, then gets add(entry) for every use of a command, discard(command)
+        for every command dropped and rebuild(entries) when the history is
+        loaded, all through dispatch.
+        """
+        with self._lock:
+            index.rebuild(list(self._entries.values()))
+            self._indexes.append(index)
+    
+    def load(self):
+        """
+        Put the most recent commands in memory and have the reader thread
+        load the whole journal (or import the old history file); loaded is
+        set once it is done.
+        """
+        try:
+            entries = self._read_recent()
+        except OSError as e:
+            print(f"Error loading command history: {e}")
+            entries = {}
+        with self._lock:
+            self._entries = entries
+        for index in self._own_indexes:
+            index.rebuild(entries.values())
+        
+        self._reader_thread = threading.Thread(target=self._read_loop, name="history-reader", daemon=True)
+        self._reader_thread.start()
+        self._tasks.put((self._load, ()))
+        atexit.register(self.close)
+    
+    def sync(self, timeout=None):
+        """
+        Wait until the reader thread has done what it was asked so far,
+        including the index updates of the commands it read; returns False
+        on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            done = threading.Event()
+            self._tasks.put((done.set, ()))
+            if not done.wait(None if deadline is None else max(deadline - time.monotonic(), 0)):
+                return False
+            if self._tasks.empty():
+                return True
+    
+    def _read_recent(self):
+        """The entries of the commands at the end of the journal, counting only the uses there"""
+        entries = {}
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return entries
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size > RECENT_TAIL_SIZE:
+                # From the first whole line
+                f.seek(size - RECENT_TAIL_SIZE)
+                f.readline()
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                    _fold(entries, record["command"], record.get("ts", 0), record.get("cwd"), record.get("count", 1))
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return _trimmed(entries, self.max_entries)
+    
+    def _read_loop(self):
+        """Run the loading and refreshing tasks one after the other (on the reader thread)"""
+        while True:
+            function, args = self._tasks.get()
+            try:
+                function(*args)
+            except Exception as e:
+                print(f"Error reading command history: {e}")
+    
+    def _load(self):
+        """Read the whole journal, then start the writer (on the reader thread)"""
+        start = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if not os.path.exists(self.path) and self.legacy_path and os.path.exists(self.legacy_path):
+                self._import_legacy()
+            self._read_journal()
+        except OSError as e:
+            print(f"Error loading command history: {e}")
+        print(f"DEBUG - Loaded {len(self._entries)} history commands in {time.monotonic() - start:.2f}s")
+        
+        # Only now, so the commands added meanwhile are written after the journal was read
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+        if self._needs_compaction():
+            self._queue.put(None)
+        self.loaded.set()
+    
+    def _open_journal(self, operation):
+        """Open the journal for appending, locked with operation (fcntl.LOCK_SH or LOCK_EX)"""
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+            fcntl.flock(fd, operation)
+            
+            # A compaction may have replaced the file while we waited for the lock
+            try:
+                current = os.stat(self.path)
+            except FileNotFoundError:
+                current = None
+            opened = os.fstat(fd)
+            if current is not None and (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino):
+                return fd
+            os.close(fd)
+    
+    def _read_journal(self):
+        """
+        Replace the entries with the whole journal's, and read it through a
+        new reader from then on. The journal is replayed into a new dict, so
+        add() doesn't wait for it.
+        """
+        entries = {}
+        fd = self._open_journal(fcntl.LOCK_EX)
+        try:
+            stat = os.fstat(fd)
+            with open(fd, "rb", closefd=False) as f, self._journal_lock:
+                self._journal_lines = 0
+                end = self._replay(f, 0, functools.partial(_fold, entries))
+                if end < stat.st_size:
+                    # The last append was cut short; cut it off, so the next one starts on a new line
+                    os.ftruncate(fd, end)
+                self._attach(os.open(self.path, os.O_RDONLY), (stat.st_dev, stat.st_ino), end)
+                
+                with self._lock:
+                    # Added but not written yet (all the commands added while loading)
+                    for record in self._unwritten:
+                        _fold(entries, record["command"], record["ts"], record["cwd"], 1)
+                    self._entries = _trimmed(entries, self.max_entries)
+                    self._generation += 1
+                    snapshot = list(self._entries.values())
+                    for index in self._indexes:
+                        self._dispatch(index.rebuild, snapshot)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        
+        # Index updates queued before this are of the old generation and skipped
+        for index in self._own_indexes:
+            index.rebuild(snapshot)
+    
+    def _attach(self, reader, file_id, position):
+        """Read the journal through reader, from position on (with the journal lock held)"""
+        if self._reader is not None:
+            os.close(self._reader)
+        if self._compacted is not None and self._compacted[1] != file_id:
+            os.close(self._compacted[0])
+        self._compacted = None
+        
+        # Positions and appends of any other file are of no use any more
+        self._read_positions = {file_id: position}
+        self._own_appends = [append for append in self._own_appends
+                             if append[0] == file_id and append[2] > position]
+        self._reader = reader
+        self._file_id = file_id
+    
+    def _replay(self, f, position, apply, skip=()):
+        """
+        Pass the uses in the complete journal lines read from f, which is at
+        byte position, to apply(command, timestamp, cwd, count), except those
+        starting in one of the skip ranges; returns the position after the
+        last complete line.
+        """
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            start = position
+            position += len(line)
+            if any(skip_start <= start < skip_end for skip_start, skip_end in skip):
+                continue
+            self._journal_lines += 1
+            try:
+                record = json.loads(line)
+                apply(record["command"], record.get("ts", 0), record.get("cwd"), record.get("count", 1))
+            except (ValueError, KeyError, TypeError):
+                continue
+        return position
+    
+    def _import_legacy(self):
+        """Turn the old history.json (a plain list of commands) into a journal"""
+        with open(self.legacy_path, "r") as f:
+            commands = json.load(f)
+        with self._lock:
+            # Older than anything added since lmTerm started
+            self._unwritten[:0] = [{"command": command, "ts": 0, "cwd": None}
+                                   for command in commands if isinstance(command, str)]
+        self._flush()
+        print(f"DEBUG - Imported {len(commands)} commands from {self.legacy_path}")
+    
+    def refresh(self):
+        """
+        Have the reader thread take in the lines other instances appended to
+        the journal since it was last read, following it through compactions.
+        Calls made while a refresh is waiting to run are merged into it.
+        """
+        if self._reader_thread is None or self._refresh_queued.is_set():
+            return
+        self._refresh_queued.set()
+        self._tasks.put((self._refresh, ()))
+    
+    def _refresh(self):
+        """refresh(), on the reader thread"""
+        self._refresh_queued.clear()
+        if self._reader is None:
+            return
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        file_id = (stat.st_dev, stat.st_ino)
+        if file_id == self._file_id and stat.st_size == self._read_positions.get(file_id):
+            return
+        
+        try:
+            self._read_tail()
+            if file_id != self._file_id:
+                self._follow_compaction()
+        except OSError as e:
+            print(f"Error reading command history: {e}")
+    
+    def _read_tail(self):
+        """Apply the lines added to the journal file being read since the last read"""
+        fcntl.flock(self._reader, fcntl.LOCK_SH)
+        try:
+            with self._journal_lock:
+                position = self._read_positions[self._file_id]
+                skip = [(start, end) for file_id, start, end in self._own_appends if file_id == self._file_id]
+                with open(self._reader, "rb", closefd=False) as f:
+                    f.seek(position)
+                    with self._lock:
+                        position = self._replay(f, position, self._apply, skip)
+                self._read_positions[self._file_id] = position
+                self._own_appends = [append for append in self._own_appends
+                                     if append[0] != self._file_id or append[2] > position]
+        finally:
+            fcntl.flock(self._reader, fcntl.LOCK_UN)
+    
+    def _follow_compaction(self):
+        """
+        Move on to the journal that replaced the one being read (which has
+        been read to its end), skipping the compacted part already in memory
+        """
+        fd = self._open_journal(fcntl.LOCK_SH)
+        try:
+            stat = os.fstat(fd)
+            file_id = (stat.st_dev, stat.st_ino)
+            with self._journal_lock:
+                position = None
+                if self._compacted is not None and self._compacted[1] == file_id:
+                    # Compacted by this instance, which knows where its part ends
+                    position = self._read_positions[file_id]
+                    self._attach(self._compacted[0], file_id, position)
+                else:
+                    with open(fd, "rb", closefd=False) as f:
+                        header = f.readline()
+                    try:
+                        header_record = json.loads(header)
+                        # Compacted from the file read, not from one that came in between
+                        if header_record["replaces"] == list(self._file_id):
+                            position = len(header) + header_record["compacted"]
+                    except (ValueError, KeyError, TypeError):
+                        pass
+                    if position is not None:
+                        self._attach(os.open(self.path, os.O_RDONLY), file_id, position)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        
+        if position is None:
+            # Not a compaction of the file read (e.g. the file was replaced by hand): start over
+            self._reload()
+        else:
+            self._read_tail()
+    
+    def _reload(self):
+        """Replace the history in memory with the journal's contents"""
+        self._read_journal()
+        print(f"DEBUG - Reloaded {len(self._entries)} commands from {self.path}")
+    
+    def _apply(self, command, timestamp, cwd, count):
+        """
+        Record a use of a command in memory (with self._lock held); returns
+        its entry. The indexes are told in the same order: the history's own
+        through the reader thread, the others through dispatch.
+        """
+        entry = _fold(self._entries, command, timestamp, cwd, count)
+        
+        # Drop the least recently used commands beyond the limit
+        dropped = []
+        while self.max_entries and len(self._entries) > self.max_entries:
+            dropped.append(next(iter(self._entries)))
+            del self._entries[dropped[-1]]
+        
+        self._tasks.put((self._index_use, (entry, dropped, self._generation)))
+        for index in self._indexes:
+            self._dispatch(index.add, entry)
+            for dropped_command in dropped:
+                self._dispatch(index.discard, dropped_command)
+        return entry
+    
+    def _index_use(self, entry, dropped, generation):
+        """Update the history's own indexes for a use of a command (on the reader thread)"""
+        # A load since then rebuilt them with the command in
+        if generation != self._generation:
+            return
+        for index in self._own_indexes:
+            index.add(entry)
+            for command in dropped:
+                index.discard(command)
+    
+    def add(self, command, cwd=None):
+        """Record a use of a command; the journal is written in the background"""
+        timestamp = time.time()
+        with self._lock:
+            entry = self._apply(command, timestamp, cwd, 1)
+            # Under the lock, so a compaction sees either both or neither
+            self._unwritten.append({"command": command, "ts": timestamp, "cwd": cwd})
+        self._queue.put(True)
+        return entry
+    
+    def close(self):
+        """Write out what is still queued and stop the writer"""
+        # The writer starts once the journal is loaded
+        if self._reader_thread is not None:
+            self.loaded.wait(timeout=5)
+        if self._writer is None or not self._writer.is_alive():
+            return
+        self._queue.put(False)
+        self._writer.join(timeout=5)
+    
+    def _write_loop(self):
+        """Append queued records to the journal (on the writer thread)"""
+        while True:
+            signals = [self._queue.get()]
+            
+            # Take everything that piled up, and write it with one fsync
+            while True:
+                try:
+                    signals.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            self._flush()
+            if self._needs_compaction() or None in signals:
+                self._compact()
+            if False in signals:
+                return
+    
+    def _flush(self):
+        """Append the unwritten records to the journal and flush them to disk"""
+        if not self._unwritten:
+            return
+        try:
+            fd = self._open_journal(fcntl.LOCK_EX)
+            try:
+                with self._lock:
+                    records, self._unwritten = self._unwritten, []
+                if records:
+                    self._write_locked(fd, [json.dumps(record) + "\n" for record in records])
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+        except OSError as e:
+            print(f"Error saving command history: {e}")
+    
+    def _write_locked(self, fd, lines):
+        """Append lines through fd, which holds the exclusive lock, and note them as this instance's"""
+        data = "".join(lines).encode("utf-8")
+        stat = os.fstat(fd)
+        start = stat.st_size
+        
+        # A line cut short by a crashed instance must not swallow the first one appended
+        if start and os.pread(fd, 1, start - 1) != b"\n":
+            data = b"\n" + data
+        os.write(fd, data)
+        os.fsync(fd)
+        self._journal_lines += len(lines)
+        
+        file_id = (stat.st_dev, stat.st_ino)
+        with self._journal_lock:
+            # Right after what was read: nothing to skip, just read past it
+            if self._read_positions.get(file_id) == start:
+                self._read_positions[file_id] = start + len(data)
+            else:
+                self._own_appends.append((file_id, start, start + len(data)))
+    
+    def _needs_compaction(self):
+        """Whether the journal has grown enough to be rewritten"""
+        return self._journal_lines >= max(MIN_COMPACT_LINES, COMPACT_RATIO * len(self._entries))
+    
+    def _compact(self):
+        """
+        Rewrite the journal with one line per command, replacing it atomically.
+        
+        Only done when every line in the journal is in memory; otherwise it
+        waits for a later write, after refresh() has read the other
+        instances' lines. Unwritten records are already part of the entries
+        written; they are appended to the old journal first, so the other
+        instances get them too.
+        """
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            fd = self._open_journal(fcntl.LOCK_EX)
+        except OSError as e:
+            print(f"Error compacting command history: {e}")
+            return
+        try:
+            stat = os.fstat(fd)
+            file_id = (stat.st_dev, stat.st_ino)
+            with self._journal_lock:
+                position = self._read_positions.get(file_id)
+                if position is None:
+                    return
+                own = sum(end - start for append_id, start, end in self._own_appends
+                          if append_id == file_id and start >= position)
+                if stat.st_size - position - own > 0:
+                    return
+            
+            with self._lock:
+                lines = [json.dumps(entry.to_record()) + "\n" for entry in self._entries.values()]
+                records, self._unwritten = self._unwritten, []
+            if records:
+                self._write_locked(fd, [json.dumps(record) + "\n" for record in records])
+            
+            data = "".join(lines).encode("utf-8")
+            header = (json.dumps({"compacted": len(data), "replaces": file_id}) + "\n").encode("utf-8")
+            compacted_fd = os.open(temp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                with open(compacted_fd, "wb", closefd=False) as f:
+                    f.write(header)
+                    f.write(data)
+                os.fsync(compacted_fd)
+                compacted = os.fstat(compacted_fd)
+                os.replace(temp_path, self.path)
+            except OSError:
+                os.close(compacted_fd)
+                raise
+            
+            with self._journal_lock:
+                # Everything in the new file is in memory already
+                if self._compacted is not None:
+                    os.close(self._compacted[0])
+                    if self._compacted[1] != self._file_id:
+                        self._read_positions.pop(self._compacted[1], None)
+                compacted_id = (compacted.st_dev, compacted.st_ino)
+                self._compacted = (compacted_fd, compacted_id)
+                self._read_positions[compacted_id] = len(header) + len(data)
+            self._journal_lines = len(lines) + 1
+            print(f"DEBUG - Compacted command history to {len(lines)} lines")
+        except OSError as e:
+            print(f"Error compacting command history: {e}")
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+def _call(function, *args):
+    """Call a function right away (the default dispatch of CommandHistory)"""
+    function(*args)
+
+def _fold(entries, command, timestamp, cwd, count):
+    """Record a use of a command in a dict of entries, least recently used first; returns its entry"""
+    entry = entries.pop(command, None)
+    if entry is None:
+        entry = HistoryEntry(command, timestamp, cwd, count)
+    else:
+        entry.timestamp = timestamp
+        entry.cwd = cwd
+        entry.count += count
+    entries[command] = entry
+    return entry
+
+def _trimmed(entries, max_entries):
+    """The entries without the least recently used ones beyond max_entries (0 for no limit)"""
+    while max_entries and len(entries) > max_entries:
+        del entries[next(iter(entries))]
+    return entries
+
+def trigrams(text):
+    """The distinct three-character substrings of text"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class TrigramIndex:
+    """
+    Search index for reverse search (Ctrl-R) over the history.
+    
+    Every use of a command gives it a new slot number, so slot order is
+    recency order; the slot it had before is left behind as garbage. For each
+    trigram of the lowercased commands the index keeps an array of the slots
+    containing it, in increasing order, so adding a command only appends.
+    
+    A query is split into words that must all appear in the command (case
+    insensitive, in any order). The candidates are the slots of the word
+    trigram with the shortest array, walked from the most recent, so the
+    search stops as soon as it has enough matches. Queries without a word of
+    three characters, and fuzzy matches (the query's characters in order,
+    ranked below the others, used when there are too few matches), are
+    searched with one regular expression over the most recent commands
+    joined into a single string; fuzzy matches only over the first
+    FUZZY_SCAN_SIZE characters of it, so a query that matches nothing
+    stays cheap however long the history is.
+    
+    rebuild() only records the commands; the trigram arrays of a large
+    history are filled in by a background thread in small batches, and
+    searches scan the recent commands until it is done.
+    """
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._generation = 0
+        self.rebuild([])
+    
+    def rebuild(self, entries):
+        """Index the given entries, oldest first"""
+        with self._lock:
+            # Slot -> command (None once the command got a newer slot), command -> slot
+            self._commands = []
+            self._slots = {}
+            self._postings = {}
+            self._recent_text = None
+            
+            # Slots below this one are in the trigram arrays
+            self._indexed = 0
+            self._generation += 1
+            for entry in entries:
+                self._add_command(entry.command)
+            
+            if len(self._commands) <= INDEX_BATCH_SIZE:
+                self._index_pending()
+            else:
+                threading.Thread(target=self._build, args=(self._generation,),
+                                 name="history-index", daemon=True).start()
+    
+    def __len__(self):
+        return len(self._slots)
+    
+    @property
+    def ready(self):
+        """Whether every command is in the trigram arrays"""
+        return self._indexed == len(self._commands)
+    
+    def add(self, entry):
+        """Index a use of a command"""
+        with self._lock:
+            catching_up = not self.ready
+            self._add_command(entry.command)
+            self._extend_recent_text(entry.command)
+            if not catching_up:
+                self._index_pending()
+            
+            # Drop the garbage left by commands used again, once it dominates
+            if len(self._commands) > 1000 and len(self._slots) < len(self._commands) * (1 - INDEX_GARBAGE_RATIO):
+                live = [command for command in self._commands if command is not None]
+                self.rebuild(HistoryEntry(command, 0) for command in live)
+    
+    def _add_command(self, command):
+        """Give a command the next slot"""
+        old_slot = self._slots.get(command)
+        if old_slot is not None:
+            self._commands[old_slot] = None
+        self._slots[command] = len(self._commands)
+        self._commands.append(command)
+    
+    def _index_pending(self, limit=None):
+        """Add the trigrams of the slots not indexed yet (up to limit of them)"""
+        end = len(self._commands) if limit is None else min(len(self._commands), self._indexed + limit)
+        postings = self._postings
+        for slot in range(self._indexed, end):
+            command = self._commands[slot]
+            if command is None:
+                continue
+            for gram in trigrams(command.lower()):
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array.array("l")
+                posting.append(slot)
+        self._indexed = end
+    
+    def _build(self, generation):
+        """Fill in the trigram arrays in batches (on a background thread)"""
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                if generation != self._generation:
+                    return
+                self._index_pending(INDEX_BATCH_SIZE)
+                if self.ready:
+                    # Also prepare the text scanned for short and fuzzy queries
+                    self._ensure_recent_text()
+                    break
+            # Let the main thread in between batches
+            time.sleep(0)
+        print(f"DEBUG - Indexed {len(self._slots)} history commands in {time.monotonic() - start:.2f}s")
+    
+    def _extend_recent_text(self, command):
+        """Put a command in front of the joined recent commands, if they are built"""
+        if self._recent_text is None:
+            return
+        text, lowered, count = self._recent_text
+        lowered_command = command.lower()
+        if count >= 2 * SCAN_LIMIT or "\n" in command or len(lowered_command) != len(command):
+            # Rebuild on the next scan
+            self._recent_text = None
+            return
+        # The command's previous line stays behind; the scan skips repeated lines
+        self._recent_text = (f"{command}\n{text}", f"{lowered_command}\n{lowered}", count + 1)
+    
+    def discard(self, command):
+        """Forget a command"""
+        slot = self._slots.pop(command, None)
+        if slot is not None:
+            self._commands[slot] = None
+            self._recent_text = None
+    
+    def search(self, query, limit=50):
+        """Return up to limit commands matching query, best first"""
+        words = query.lower().split()
+        if not words:
+            return []
+        with self._lock:
+            return self._search(words, limit)
+    
+    def _search(self, words, limit):
+        """search() for lowercased query words, with the lock held"""
+        # The rarest trigram of any word gives the fewest candidates; a trigram
+        # that no command has means there can only be fuzzy matches
+        candidates = None
+        if self.ready:
+            for word in words:
+                for gram in trigrams(word):
+                    posting = self._postings.get(gram)
+                    if posting is None:
+                        return self._scan(_fuzzy_pattern(words), limit, size=FUZZY_SCAN_SIZE)
+                    if candidates is None or len(posting) < len(candidates):
+                        candidates = posting
+        
+        if candidates is None:
+            # Only short words, or the trigrams are still being built: scan the
+            # recent commands for the first word instead
+            others = words[1:]
+            matches = self._scan(re.compile(re.escape(words[0])), limit,
+                                 lambda line: all(word in line for word in others))
+        else:
+            matches = []
+            commands = self._commands
+            for slot in reversed(candidates):
+                command = commands[slot]
+                if command is None:
+                    continue
+                lowered = command.lower()
+                if all(word in lowered for word in words):
+                    matches.append(command)
+                    if len(matches) >= limit:
+                        break
+        
+        # Commands starting with the query first, otherwise most recent first
+        results = sorted(matches, key=lambda command: not command.lower().startswith(words[0]))
+        if len(results) < limit:
+            exclude = set(results)
+            results += [command for command in self._scan(_fuzzy_pattern(words), limit + len(exclude),
+                                                          size=FUZZY_SCAN_SIZE)
+                        if command not in exclude][:limit - len(results)]
+        return results
+    
+    def _ensure_recent_text(self):
+        """Join the recent commands (one per line, most recent first) if they aren't yet"""
+        if self._recent_text is None:
+            recent = []
+            for command in reversed(self._commands):
+                # Commands spanning lines, or whose length changes when lowercased,
+                # would break the line offsets shared by the two texts
+                if command is not None and "\n" not in command and len(command.lower()) == len(command):
+                    recent.append(command)
+                    if len(recent) >= SCAN_LIMIT:
+                        break
+            text = "\n".join(recent)
+            self._recent_text = (text, text.lower(), len(recent))
+        return self._recent_text
+    
+    def _scan(self, pattern, limit, check=None, size=None):
+        """
+        The most recent commands in which the pattern (lowercase) matches and
+        for which check(lowercased command), if given, is true; only the
+        commands within the first size characters, if given, are scanned.
+        
+        The recent commands are joined into one string, one per line, and the
+        pattern is run over it once, instead of once per command.
+        """
+        text, lowered, _ = self._ensure_recent_text()
+        end_position = len(lowered)
+        if size is not None and end_position > size:
+            # Up to the end of the last whole line
+            end_position = max(lowered.rfind("\n", 0, size), 0)
+        
+        results = []
+        seen = set()
+        position = 0
+        while len(results) < limit:
+            match = pattern.search(lowered, position, end_position)
+            if match is None:
+                break
+            # Widen the match to its whole line and go on after that line
+            start = lowered.rfind("\n", 0, match.start()) + 1
+            end = lowered.find("\n", match.end())
+            if end < 0:
+                end = len(lowered)
+            line = text[start:end]
+            if line not in seen and (check is None or check(lowered[start:end])):
+                results.append(line)
+                seen.add(line)
+            position = end + 1
+        return results
+
+def _fuzzy_pattern(words):
+    """
+    A pattern for lowercase text containing the characters of the words in
+    order, within one line; each character is looked for only up to its
+    first occurrence, so matching takes linear time.
+    """
+    characters = "".join(words)
+    parts = [re.escape(characters[0])]
+    for char in characters[1:]:
+        parts.append(f"[^\\n{re.escape(char)}]*{re.escape(char)}")
+    return re.compile("".join(parts))
+
+def frecency(entry):
+    """
+    Log of the frecency of an entry (uses weighted down by age); the age is
+    relative to a fixed time, so comparisons between entries never change
+    """
+    return math.log(max(entry.count, 1)) + entry.timestamp / FRECENCY_DECAY
+
+class _PrefixNode:
+    """A node of the prefix index: a leaf bucket of entries or an inner node"""
+    
+    __slots__ = ("bucket", "children", "terminal", "top")
+    
+    def __init__(self, bucket=None):
+        # Leaf: the entries below this prefix (children is None)
+        self.bucket = bucket if bucket is not None else []
+        
+        # Inner node: next character -> node, the entry whose command is
+        # exactly this prefix, and the best entries below, best first
+        self.children = None
+        self.terminal = None
+        self.top = None
+    
+    def candidates(self):
+        """The best entries below this node (all of them for a leaf)"""
+        return self.bucket if self.children is None else self.top
+
+class PrefixIndex:
+    """
+    Prefix index for inline suggestions while a command is typed.
+    
+    A trie over the commands, character by character, in which every inner
+    node keeps its SUGGESTION_CANDIDATES best entries by frecency. Commands
+    with a prefix shared by few others sit together in a leaf bucket instead
+    of getting nodes of their own, which keeps the trie small; a bucket is
+    split once it holds more than PREFIX_BUCKET_SIZE commands.
+    
+    A lookup walks down the prefix and ranks at most a bucket or a node's
+    candidates, so it takes microseconds whatever the size of the history.
+    Because frecency() is measured from a fixed time, the order of two
+    entries only changes when one of them is used, and add() only re-ranks
+    the nodes on the path of the command used. The working directory boost
+    is applied to the candidates at lookup.
+    
+    rebuild() of a large history builds the trie on a background thread;
+    suggest() returns None until it is done.
+    """
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._generation = 0
+        self._root = _PrefixNode()
+        
+        # (method, argument) calls made while a background build runs, replayed when it is done
+        self._pending = None
+    
+    def rebuild(self, entries):
+        """Index the given entries"""
+        entries = list(entries)
+        with self._lock:
+            self._generation += 1
+            if len(entries) <= INDEX_BATCH_SIZE:
+                self._root = _build_prefix_node(entries, 0)
+                self._pending = None
+                return
+            self._pending = []
+        threading.Thread(target=self._build, args=(entries, self._generation),
+                         name="history-prefix-index", daemon=True).start()
+    
+    @property
+    def ready(self):
+        """Whether the trie holds every command"""
+        return self._pending is None
+    
+    def _build(self, entries, generation):
+        """Build the trie off the main thread, then swap it in"""
+        start = time.monotonic()
+        root = _build_prefix_node(entries, 0)
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._root = root
+            pending, self._pending = self._pending, None
+            for method, argument in pending:
+                method(argument)
+        print(f"DEBUG - Built the prefix index of {len(entries)} history commands in {time.monotonic() - start:.2f}s")
+    
+    def add(self, entry):
+        """Index a use of a command (its entry is new or ranks higher than before)"""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self.add, entry))
+                return
+            command = entry.command
+            score = frecency(entry)
+            node = self._root
+            depth = 0
+            while node.children is not None:
+                _promote(node.top, entry, score)
+                if depth == len(command):
+                    node.terminal = entry
+                    return
+                child = node.children.get(command[depth])
+                if child is None:
+                    child = node.children[command[depth]] = _PrefixNode()
+                node = child
+                depth += 1
+            
+            if entry not in node.bucket:
+                node.bucket.append(entry)
+                if len(node.bucket) > PREFIX_BUCKET_SIZE:
+                    split = _build_prefix_node(node.bucket, depth)
+                    node.bucket, node.children, node.terminal, node.top = (
+                        split.bucket, split.children, split.terminal, split.top)
+    
+    def discard(self, command):
+        """Forget a command"""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self.discard, command))
+                return
+            path = []
+            node = self._root
+            depth = 0
+            while node.children is not None and depth < len(command):
+                path.append(node)
+                node = node.children.get(command[depth])
+                if node is None:
+                    return
+                depth += 1
+            
+            if node.children is None:
+                node.bucket = [entry for entry in node.bucket if entry.command != command]
+            else:
+                path.append(node)
+                if node.terminal is not None and node.terminal.command == command:
+                    node.terminal = None
+            
+            # Refill the best entries of the nodes above from their children
+            for node in reversed(path):
+                if not any(entry.command == command for entry in node.top):
+                    break
+                candidates = [entry for child in node.children.values() for entry in child.candidates()]
+                if node.terminal is not None:
+                    candidates.append(node.terminal)
+                candidates.sort(key=frecency, reverse=True)
+                node.top = candidates[:SUGGESTION_CANDIDATES]
+    
+    def suggest(self, prefix, cwd=None):
+        """The best command starting with (and longer than) prefix, or None"""
+        if not prefix:
+            return None
+        with self._lock:
+            if self._pending is not None:
+                return None
+            node = self._root
+            depth = 0
+            while node.children is not None and depth < len(prefix):
+                node = node.children.get(prefix[depth])
+                if node is None:
+                    return None
+                depth += 1
+            
+            best = None
+            best_score = None
+            for entry in node.candidates():
+                command = entry.command
+                # Only single-line commands can be shown in the entry
+                if len(command) <= len(prefix) or not command.startswith(prefix) or "\n" in command:
+                    continue
+                score = frecency(entry)
+                if cwd is not None and entry.cwd == cwd:
+                    score += math.log(CWD_BOOST)
+                if best_score is None or score > best_score:
+                    best = command
+                    best_score = score
+            return best
+
+def _promote(top, entry, score):
+    """Put an entry whose frecency went up (to score) into a node's best entries"""
+    if entry in top:
+        top.remove(entry)
+    # A command just used usually ranks first, so look from the front
+    position = 0
+    while position < len(top) and frecency(top[position]) >= score:
+        position += 1
+    if position < SUGGESTION_CANDIDATES:
+        top.insert(position, entry)
+        del top[SUGGESTION_CANDIDATES:]
+
+def _build_prefix_node(entries, depth):
+    """Build the prefix index node for entries sharing their first depth characters"""
+    entries = sorted(entries, key=frecency, reverse=True)
+    root = _PrefixNode()
+    
+    # Iterative, since long shared prefixes would go beyond the recursion limit
+    stack = [(root, entries, depth)]
+    while stack:
+        node, entries, depth = stack.pop()
+        if len(entries) <= PREFIX_BUCKET_SIZE:
+            node.bucket = entries
+            continue
+        node.bucket = None
+        node.children = {}
+        node.top = entries[:SUGGESTION_CANDIDATES]
+        
+        # Grouping keeps the frecency order within each group
+        groups = {}
+        for entry in entries:
+            if len(entry.command) == depth:
+                node.terminal = entry
+            else:
+                groups.setdefault(entry.command[depth], []).append(entry)
+        for char, group in groups.items():
+            child = node.children[char] = _PrefixNode()
+            stack.append((child, group, depth + 1))
+    return root
+
+class RecencyPositions:
+    """
+    Positions of the commands in a list ordered by last use, such as the
+    history popover's, where a command used again moves to the end.
+    
+    Every append() gives a command a new slot at the end, and remove() leaves
+    its old slot empty. A Fenwick tree over the slots counts the commands in
+    the slots before a given one, so finding, removing and appending a command
+    take O(log n) instead of a scan of the list. The slots are renumbered
+    when they run out, at most once per as many appends as there are commands.
+    """
+    
+    def __init__(self, commands=()):
+        self.rebuild(commands)
+    
+    def __len__(self):
+        return len(self._slots)
+    
+    def rebuild(self, commands):
+        """Start over with the given (distinct) commands, oldest first"""
+        # Command in each slot, None for the slots of moved or removed ones
+        self._order = list(commands)
+        self._slots = {command: slot for slot, command in enumerate(self._order)}
+        
+        # Node i of the tree counts the commands in the (i & -i) slots ending at
+        # slot i - 1; with the first n slots taken, that count has a closed form
+        count = len(self._order)
+        size = max(2 * count, 1024)
+        self._tree = [0] + [index & -index for index in range(1, count + 1)]
+        self._tree += [max(0, count - index + (index & -index)) for index in range(count + 1, size + 1)]
+    
+    def position(self, command):
+        """Position of a command in the list, or -1"""
+        slot = self._slots.get(command)
+        return -1 if slot is None else self._count_before(slot)
+    
+    def append(self, command):
+        """Add a command that isn't in the list at the end"""
+        if len(self._order) >= len(self._tree) - 1:
+            self.rebuild([command for command in self._order if command is not None])
+        slot = len(self._order)
+        self._order.append(command)
+        self._slots[command] = slot
+        self._add(slot, 1)
+    
+    def remove(self, command):
+        """Remove a command from the list; returns the position it had, or -1"""
+        slot = self._slots.pop(command, None)
+        if slot is None:
+            return -1
+        self._order[slot] = None
+        self._add(slot, -1)
+        return self._count_before(slot)
+    
+    def _count_before(self, slot):
+        """Number of commands in the slots before a slot"""
+        count = 0
+        while slot > 0:
+            count += self._tree[slot]
+            slot -= slot & -slot
+        return count
+    
+    def _add(self, slot, delta):
+        """Change the count of a slot"""
+        index = slot + 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
@@ -0,0 +1,152 @@
+import gi
+
+gi.require_version('Gtk', '4.0')
+from gi.repository import Gtk, Gdk, GLib, Pango
+
+from history import RecencyPositions
+
+class HistoryPopover(Gtk.Popover):
+    """
+    Up-arrow history popover listing every command, most recent at the bottom.
+    
+    The commands live in a Gtk.StringList that is registered as an index of
+    the history (see CommandHistory.add_index): it is filled once, then each
+    use of a command moves that one string to the end, found through
+    RecencyPositions in O(log n). The list view only creates labels for the
+    rows on screen and recycles them while scrolling, so opening the popover
+    costs the same whatever the size of the history. The history must be
+    created with GLib.idle_add as its dispatch, so the list is only changed
+    on the GTK thread.
+    
+    Moving through the list calls on_select with the selected command (to
+    preview it in the command entry), activating a row calls on_run, and
+    moving down past the most recent command calls on_leave.
+    """
+    
+    def __init__(self, history, on_select, on_run, on_leave):
+        super().__init__()
+        self.on_select = on_select
+        self.on_run = on_run
+        self.on_leave = on_leave
+        self.set_position(Gtk.PositionType.TOP)
+        
+        # Positions of the commands in the model, oldest first
+        self._positions = RecencyPositions()
+        self.model = Gtk.StringList()
+        self.selection = Gtk.SingleSelection(model=self.model)
+        self.selection.set_autoselect(False)
+        self.selection.set_can_unselect(True)
+        
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self._on_item_setup)
+        factory.connect("bind", self._on_item_bind)
+        
+        self.list_view = Gtk.ListView(model=self.selection, factory=factory)
+        self.list_view.set_single_click_activate(True)
+        self.list_view.connect("activate", self._on_activate)
+        
+        # One controller for the keys, before the list view moves the focus itself
+        key_controller = Gtk.EventControllerKey.new()
+        key_controller.set_propagation_phase(Gtk.PropagationPhase.CAPTURE)
+        key_controller.connect("key-pressed", self._on_key_pressed)
+        self.list_view.add_controller(key_controller)
+        
+        scroll = Gtk.ScrolledWindow()
+        scroll.set_min_content_height(200)
+        scroll.set_max_content_height(400)
+        scroll.set_min_content_width(400)
+        scroll.set_child(self.list_view)
+        self.set_child(scroll)
+        
+        history.add_index(self)
+    
+    def __len__(self):
+        return self.model.get_n_items()
+    
+    def rebuild(self, entries):
+        """Replace the list with the given entries, oldest first"""
+        commands = [entry.command for entry in entries]
+        self._positions.rebuild(commands)
+        self.model.splice(0, self.model.get_n_items(), commands)
+    
+    def add(self, entry):
+        """Move a command used again (or a new one) to the end"""
+        self.discard(entry.command)
+        self._positions.append(entry.command)
+        self.model.append(entry.command)
+    
+    def discard(self, command):
+        """Remove a command from the list"""
+        position = self._positions.remove(command)
+        if position >= 0:
+            self.model.remove(position)
+    
+    def open(self):
+        """Show the popover with the most recent command selected"""
+        self.popup()
+        self.list_view.grab_focus()
+        self.select(len(self) - 1)
+    
+    @property
+    def selected(self):
+        """Position of the selected command, or -1"""
+        position = self.selection.get_selected()
+        return -1 if position == Gtk.INVALID_LIST_POSITION else position
+    
+    def select(self, position):
+        """Select a command, scroll it into view and preview it"""
+        if not 0 <= position < len(self):
+            return
+        self.selection.set_selected(position)
+        self.list_view.activate_action("list.scroll-to-item", GLib.Variant.new_uint32(position))
+        self.on_select(self.model.get_string(position))
+    
+    def select_previous(self):
+        """Select the next older command"""
+        if self.selected > 0:
+            self.select(self.selected - 1)
+    
+    def select_next(self):
+        """Select the next newer command, or leave the list after the most recent one"""
+        if 0 <= self.selected < len(self) - 1:
+            self.select(self.selected + 1)
+        else:
+            self.selection.unselect_all()
+            self.popdown()
+            self.on_leave()
+    
+    def _on_item_setup(self, factory, list_item):
+        label = Gtk.Label()
+        label.set_halign(Gtk.Align.START)
+        label.set_ellipsize(Pango.EllipsizeMode.END)
+        label.set_max_width_chars(60)
+        label.set_margin_start(5)
+        label.set_margin_end(5)
+        label.set_margin_top(5)
+        label.set_margin_bottom(5)
+        list_item.set_child(label)
+    
+    def _on_item_bind(self, factory, list_item):
+        list_item.get_child().set_text(list_item.get_item().get_string())
+    
+    def _on_activate(self, list_view, position):
+        """Run a clicked command"""
+        self.popdown()
+        self.on_run(self.model.get_string(position))
+    
+    def _on_key_pressed(self, controller, keyval, keycode, state):
+        """Handle key press events for history list navigation"""
+        if keyval == Gdk.KEY_Up:
+            self.select_previous()
+            return True
+        if keyval == Gdk.KEY_Down:
+            self.select_next()
+            return True
+        if keyval in (Gdk.KEY_Return, Gdk.KEY_KP_Enter):
+            if self.selected >= 0:
+                self._on_activate(self.list_view, self.selected)
+            return True
+        if keyval == Gdk.KEY_Escape:
+            self.popdown()
+            return True
+        return False
@@ -0,0 +1,158 @@
+import gi
+import time
+
+gi.require_version('Gtk', '4.0')
+from gi.repository import Gtk, Gdk, Pango
+
+# Most matches listed at once
+MAX_RESULTS = 50
+
+class HistorySearchPopover(Gtk.Popover):
+    """
+    Reverse search (Ctrl-R) over the command history.
+    
+    Every keystroke in the search entry asks the history's index for the best
+    matches and lists them, most relevant at the top. Up/Down (or Ctrl-R
+    again) move through the matches; Enter runs the selected command, Tab
+    puts it in the command entry for editing, Escape closes the search.
+    """
+    
+    def __init__(self, history, on_run, on_edit):
+        super().__init__()
+        self.history = history
+        self.on_run = on_run
+        self.on_edit = on_edit
+        self.set_position(Gtk.PositionType.TOP)
+        self.set_autohide(True)
+        
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        self.set_child(box)
+        
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.set_placeholder_text("Search history")
+        self.search_entry.connect("search-changed", self._on_search_changed)
+        self.search_entry.connect("activate", self._on_activate)
+        self.search_entry.connect("stop-search", lambda entry: self.popdown())
+        box.append(self.search_entry)
+        
+        # Results update on every keystroke, not after the default delay
+        if hasattr(self.search_entry, "set_search_delay"):
+            self.search_entry.set_search_delay(0)
+        
+        # Keys that move through the results, before the entry handles them
+        key_controller = Gtk.EventControllerKey.new()
+        key_controller.set_propagation_phase(Gtk.PropagationPhase.CAPTURE)
+        key_controller.connect("key-pressed", self._on_key_pressed)
+        self.search_entry.add_controller(key_controller)
+        
+        self.scroll = scroll = Gtk.ScrolledWindow()
+        scroll.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        scroll.set_min_content_height(200)
+        scroll.set_max_content_height(400)
+        scroll.set_propagate_natural_height(True)
+        box.append(scroll)
+        
+        self.result_list = Gtk.ListBox()
+        self.result_list.set_selection_mode(Gtk.SelectionMode.SINGLE)
+        self.result_list.connect("row-activated", self._on_row_activated)
+        scroll.set_child(self.result_list)
+        
+        self.status_label = Gtk.Label()
+        self.status_label.set_xalign(0)
+        self.status_label.add_css_class("dim-label")
+        self.status_label.add_css_class("caption")
+        box.append(self.status_label)
+        
+        # Commands shown in the list, in order
+        self._results = []
+    
+    def open(self, query=""):
+        """Show the search, starting with the given query"""
+        self.search_entry.set_text(query)
+        self._refresh()
+        self.popup()
+        self.search_entry.grab_focus()
+        self.search_entry.set_position(-1)
+    
+    def _on_search_changed(self, entry):
+        self._refresh()
+    
+    def _refresh(self):
+        """List the matches of the current query"""
+        query = self.search_entry.get_text()
+        start = time.perf_counter()
+        self._results = self.history.search(query, MAX_RESULTS) if query.strip() else []
+        elapsed = (time.perf_counter() - start) * 1000
+        
+        # At most MAX_RESULTS rows, so rebuilding them is cheap
+        while True:
+            row = self.result_list.get_first_child()
+            if row is None:
+                break
+            self.result_list.remove(row)
+        for command in self._results:
+            label = Gtk.Label(label=command)
+            label.set_xalign(0)
+            label.set_ellipsize(Pango.EllipsizeMode.END)
+            label.set_max_width_chars(60)
+            label.set_margin_start(5)
+            label.set_margin_end(5)
+            label.set_margin_top(3)
+            label.set_margin_bottom(3)
+            label.add_css_class("monospace")
+            self.result_list.append(label)
+        if self._results:
+            self.result_list.select_row(self.result_list.get_row_at_index(0))
+        
+        if not query.strip():
+            self.status_label.set_text(f"{len(self.history)} commands in history")
+        else:
+            self.status_label.set_text(f"{len(self._results)} matches ({elapsed:.1f} ms)")
+    
+    def _selected_index(self):
+        """Index of the selected match, or -1"""
+        row = self.result_list.get_selected_row()
+        return row.get_index() if row is not None else -1
+    
+    def _select(self, index):
+        """Select a match by index and scroll it into view"""
+        if not self._results:
+            return
+        index = min(max(index, 0), len(self._results) - 1)
+        row = self.result_list.get_row_at_index(index)
+        self.result_list.select_row(row)
+        
+        # Keep the focus in the search entry while the list follows the selection
+        found, bounds = row.compute_bounds(self.result_list)
+        if found:
+            self.scroll.get_vadjustment().clamp_page(bounds.get_y(), bounds.get_y() + bounds.get_height())
+    
+    def _on_key_pressed(self, controller, keyval, keycode, state):
+        """Move through the matches, or take one"""
+        if keyval == Gdk.KEY_Down or (keyval == Gdk.KEY_r and state & Gdk.ModifierType.CONTROL_MASK):
+            # Ctrl-R again goes to the next (older, less relevant) match, like in bash
+            self._select(self._selected_index() + 1)
+            return True
+        if keyval == Gdk.KEY_Up:
+            self._select(self._selected_index() - 1)
+            return True
+        if keyval == Gdk.KEY_Tab:
+            self._take(self.on_edit)
+            return True
+        return False
+    
+    def _on_activate(self, entry):
+        self._take(self.on_run)
+    
+    def _on_row_activated(self, list_box, row):
+        self._select(row.get_index())
+        self._take(self.on_run)
+    
+    def _take(self, callback):
+        """Close the search and hand the selected command to callback"""
+        index = self._selected_index()
+        if not 0 <= index < len(self._results):
+            return
+        command = self._results[index]
+        self.popdown()
+        callback(command)
@@ -0,0 +1,170 @@
+import gi
+
+gi.require_version('Gtk', '4.0')
+from gi.repository import Gtk, GLib, Pango
+
+from jobs import JOBS, JOB_RUNNING, JOB_STOPPED, JOB_DONE, format_rate
+
+# How often the panel refreshes while it is open (in milliseconds)
+REFRESH_INTERVAL_MS = 1000
+
+class JobRow(Gtk.Box):
+    """One background job in the panel: command, PID, runtime, output rate and controls"""
+    
+    def __init__(self, job):
+        super().__init__(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        self.job = job
+        self.set_margin_top(4)
+        self.set_margin_bottom(4)
+        self.set_margin_start(6)
+        self.set_margin_end(6)
+        
+        labels = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=2)
+        labels.set_hexpand(True)
+        self.append(labels)
+        
+        self.command_label = Gtk.Label(label=f"[{job.id}] {job.command}")
+        self.command_label.set_xalign(0)
+        self.command_label.set_ellipsize(Pango.EllipsizeMode.END)
+        self.command_label.set_tooltip_text(job.command)
+        self.command_label.add_css_class("monospace")
+        labels.append(self.command_label)
+        
+        self.status_label = Gtk.Label()
+        self.status_label.set_xalign(0)
+        self.status_label.add_css_class("dim-label")
+        self.status_label.add_css_class("caption")
+        labels.append(self.status_label)
+        
+        # Suspend and resume share a button
+        self.pause_button = Gtk.Button()
+        self.pause_button.add_css_class("flat")
+        self.pause_button.set_valign(Gtk.Align.CENTER)
+        self.pause_button.connect("clicked", self._on_pause_clicked)
+        self.append(self.pause_button)
+        
+        self.kill_button = Gtk.Button()
+        self.kill_button.set_icon_name("process-stop-symbolic")
+        self.kill_button.set_tooltip_text("Kill")
+        self.kill_button.add_css_class("flat")
+        self.kill_button.set_valign(Gtk.Align.CENTER)
+        self.kill_button.connect("clicked", self._on_kill_clicked)
+        self.append(self.kill_button)
+        
+        self.update()
+    
+    def update(self):
+        """Show the current state of the job"""
+        job = self.job
+        runtime = int(job.runtime)
+        runtime_text = f"{runtime // 3600}:{runtime // 60 % 60:02d}:{runtime % 60:02d}"
+        if job.state == JOB_DONE:
+            self.status_label.set_text(f"{runtime_text} · {job.result.status_line()}")
+        else:
+            state = "Suspended" if job.state == JOB_STOPPED else format_rate(job.output_rate)
+            self.status_label.set_text(f"PID {job.pid} · {runtime_text} · {state}")
+        
+        self.pause_button.set_visible(job.state != JOB_DONE)
+        self.kill_button.set_visible(job.state != JOB_DONE)
+        if job.state == JOB_STOPPED:
+            self.pause_button.set_icon_name("media-playback-start-symbolic")
+            self.pause_button.set_tooltip_text("Resume")
+        else:
+            self.pause_button.set_icon_name("media-playback-pause-symbolic")
+            self.pause_button.set_tooltip_text("Suspend")
+    
+    def _on_pause_clicked(self, button):
+        """Suspend or resume the job"""
+        if self.job.state == JOB_RUNNING:
+            self.job.suspend()
+        else:
+            self.job.resume()
+        self.update()
+    
+    def _on_kill_clicked(self, button):
+        """Kill the job"""
+        self.job.kill()
+        self.update()
+
+class JobPanel(Gtk.Box):
+    """
+    Popover content listing the background jobs.
+    
+    Rows are kept per job and only their labels change on refresh, so the
+    buttons don't flicker; the panel only refreshes while it is shown.
+    """
+    
+    def __init__(self):
+        super().__init__(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        self.set_size_request(380, -1)
+        
+        title = Gtk.Label(label="Background Jobs")
+        title.add_css_class("heading")
+        self.append(title)
+        
+        self.placeholder = Gtk.Label(label="No background jobs.\nEnd a command with & to run it in the background.")
+        self.placeholder.set_justify(Gtk.Justification.CENTER)
+        self.placeholder.add_css_class("dim-label")
+        self.placeholder.set_margin_top(12)
+        self.placeholder.set_margin_bottom(12)
+        self.append(self.placeholder)
+        
+        self.list_box = Gtk.ListBox()
+        self.list_box.set_selection_mode(Gtk.SelectionMode.NONE)
+        self.list_box.add_css_class("boxed-list")
+        self.append(self.list_box)
+        
+        self.clear_button = Gtk.Button(label="Clear Finished")
+        self.clear_button.set_halign(Gtk.Align.END)
+        self.clear_button.add_css_class("flat")
+        self.clear_button.connect("clicked", self._on_clear_clicked)
+        self.append(self.clear_button)
+        
+        # Row widget by job ID
+        self._rows = {}
+        self._refresh_source = None
+    
+    def start_refresh(self, *args):
+        """Refresh now and then periodically, while the panel is shown"""
+        self.refresh()
+        if self._refresh_source is None:
+            self._refresh_source = GLib.timeout_add(REFRESH_INTERVAL_MS, self._on_refresh_timeout)
+    
+    def stop_refresh(self, *args):
+        """Stop the periodic refresh"""
+        if self._refresh_source is not None:
+            GLib.source_remove(self._refresh_source)
+            self._refresh_source = None
+    
+    def _on_refresh_timeout(self):
+        """Periodic refresh"""
+        self.refresh()
+        return True
+    
+    def refresh(self):
+        """Sync the rows with the job table"""
+        jobs = JOBS.list()
+        job_ids = set(job.id for job in jobs)
+        
+        # Remove rows of jobs that were cleared
+        for job_id in list(self._rows):
+            if job_id not in job_ids:
+                self.list_box.remove(self._rows.pop(job_id).get_parent())
+        
+        for job in jobs:
+            row = self._rows.get(job.id)
+            if row is None:
+                row = JobRow(job)
+                self._rows[job.id] = row
+                self.list_box.append(row)
+            else:
+                row.update()
+        
+        self.placeholder.set_visible(not jobs)
+        self.list_box.set_visible(bool(jobs))
+        self.clear_button.set_visible(any(job.state == JOB_DONE for job in jobs))
+    
+    def _on_clear_clicked(self, button):
+        """Forget the finished jobs"""
+        JOBS.clear_finished()
+        self.refresh()
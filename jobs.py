@@ -0,0 +1,285 @@
+import os
+import time
+import signal
+import threading
+import collections
+
+from command_runner import run_streaming, ProcessHandle
+from output_buffer import CaptureBuffer, SPILL_DIR
+from command_result import format_size
+from ansi import AnsiParser
+
+# Job states
+JOB_RUNNING = "running"
+JOB_STOPPED = "stopped"
+JOB_DONE = "done"
+
+# Window (in seconds) over which the output rate is measured
+RATE_WINDOW = 5
+
+# Most output (in characters) handed to the agent per poll; older unread output is dropped
+POLL_LIMIT = 8 * 1024
+
+# Tools that let the agent run commands in the background and check on them
+JOB_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "job_start",
+            "description": "Start a long-running terminal command (a build, an upgrade, a download) "
+                           "in the background and return its job ID right away. "
+                           "Use job_output to check on it.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "command": {
+                        "type": "string",
+                        "description": "The command to run in the background"
+                    }
+                },
+                "required": ["command"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "job_output",
+            "description": "Return the output a background job printed since the last call, "
+                           "and whether it is still running.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "job_id": {
+                        "type": "integer",
+                        "description": "The ID returned by job_start"
+                    }
+                },
+                "required": ["job_id"]
+            }
+        }
+    },
+]
+
+class Job:
+    """
+    A command running in the background in its own process group.
+    
+    Output is captured like a normal command (head and tail in memory, the
+    rest in a spill file) and passed to on_output as it arrives. Output the
+    agent hasn't read yet is kept separately, up to POLL_LIMIT characters.
+    """
+    
+    def __init__(self, job_id, command, cwd=None, on_output=None, on_exit=None):
+        self.id = job_id
+        self.command = command
+        self.cwd = cwd or os.getcwd()
+        self.on_output = on_output
+        self.on_exit = on_exit
+        
+        self.process = None
+        self.handle = ProcessHandle()
+        self.state = JOB_RUNNING
+        self.result = None
+        self.output = CaptureBuffer(spill_dir=SPILL_DIR)
+        self.started = None
+        self.ended = None
+        self._spawned = threading.Event()
+        
+        # Total bytes of output, and (time, total) samples for the output rate
+        self.bytes_read = 0
+        self._rate_samples = collections.deque()
+        
+        # Output not yet read by the agent, without escape sequences
+        self._lock = threading.Lock()
+        self._ansi = AnsiParser()
+        self._unread = collections.deque()
+        self._unread_size = 0
+        self._unread_dropped = 0
+    
+    @property
+    def pid(self):
+        """PID of the job's process (and its process group), once started"""
+        return self.process.pid if self.process else None
+    
+    @property
+    def runtime(self):
+        """Seconds since the job started (until it ended)"""
+        if self.started is None:
+            return 0.0
+        return (self.ended or time.monotonic()) - self.started
+    
+    @property
+    def output_rate(self):
+        """Output bytes per second over the last few seconds"""
+        now = time.monotonic()
+        with self._lock:
+            while self._rate_samples and now - self._rate_samples[0][0] > RATE_WINDOW:
+                self._rate_samples.popleft()
+            if not self._rate_samples:
+                return 0.0
+            first_time, first_total = self._rate_samples[0]
+            return (self.bytes_read - first_total) / max(now - first_time, 1.0)
+    
+    def start(self):
+        """Start the command on a reader thread; returns once the process exists"""
+        self.started = time.monotonic()
+        thread = threading.Thread(target=self._run, name=f"job-{self.id}", daemon=True)
+        thread.start()
+        self._spawned.wait()
+    
+    def _run(self):
+        """Run the command and wait for it (on the reader thread)"""
+        self.result = run_streaming(self.command, on_output=self._on_output, output=self.output,
+                                    cwd=self.cwd, on_spawn=self._on_spawn, handle=self.handle)
+        self.ended = time.monotonic()
+        
+        # The process may not even have started
+        self._spawned.set()
+        self.state = JOB_DONE
+        print(f"DEBUG - Job {self.id} finished: {self.result.status_line()}")
+        if self.on_exit:
+            self.on_exit(self)
+    
+    def _on_spawn(self, process):
+        """Keep the process to signal its group later"""
+        self.process = process
+        self._spawned.set()
+    
+    def _on_output(self, text):
+        """Record new output (on the reader thread)"""
+        with self._lock:
+            self.bytes_read += len(text.encode("utf-8"))
+            self._rate_samples.append((time.monotonic(), self.bytes_read))
+            
+            plain, _ = self._ansi.feed(text)
+            self._unread.append(plain)
+            self._unread_size += len(plain)
+            while self._unread_size > POLL_LIMIT and len(self._unread) > 1:
+                dropped = self._unread.popleft()
+                self._unread_size -= len(dropped)
+                self._unread_dropped += len(dropped)
+        if self.on_output:
+            self.on_output(text)
+    
+    def read_new_output(self):
+        """Return the output since the last call, and how many older characters were dropped"""
+        with self._lock:
+            text = "".join(self._unread)
+            dropped = self._unread_dropped
+            self._unread.clear()
+            self._unread_size = 0
+            self._unread_dropped = 0
+        if len(text) > POLL_LIMIT:
+            dropped += len(text) - POLL_LIMIT
+            text = text[-POLL_LIMIT:]
+        return text, dropped
+    
+    def _signal(self, signum):
+        """Send a signal to the job's process group"""
+        if self.process is None or self.state == JOB_DONE:
+            return False
+        try:
+            os.killpg(self.process.pid, signum)
+            return True
+        except OSError as e:
+            print(f"DEBUG - Could not signal job {self.id}: {e}")
+            return False
+    
+    def suspend(self):
+        """Stop the job until it is resumed"""
+        if self.state == JOB_RUNNING and self._signal(signal.SIGSTOP):
+            self.state = JOB_STOPPED
+    
+    def resume(self):
+        """Continue a suspended job"""
+        if self.state == JOB_STOPPED and self._signal(signal.SIGCONT):
+            self.state = JOB_RUNNING
+    
+    def kill(self):
+        """Stop the job, escalating from SIGINT to SIGTERM to SIGKILL"""
+        # A suspended process only handles the signals once it runs again
+        if self.state == JOB_STOPPED and self._signal(signal.SIGCONT):
+            self.state = JOB_RUNNING
+        self.handle.stop()
+    
+    def status(self):
+        """One line describing the job's state"""
+        if self.state == JOB_DONE:
+            return f"finished after {self.runtime:.1f}s: {self.result.status_line()}"
+        return f"{self.state} for {self.runtime:.1f}s (PID {self.pid})"
+
+class JobManager:
+    """The table of background jobs, numbered from 1 like shell jobs"""
+    
+    def __init__(self):
+        self._jobs = collections.OrderedDict()
+        self._next_id = 1
+        self._lock = threading.Lock()
+    
+    def create(self, command, cwd=None, on_output=None, on_exit=None):
+        """Add a job for a command to the table without starting it"""
+        with self._lock:
+            job = Job(self._next_id, command, cwd=cwd, on_output=on_output, on_exit=on_exit)
+            self._jobs[job.id] = job
+            self._next_id += 1
+        return job
+    
+    def start(self, command, cwd=None, on_output=None, on_exit=None):
+        """Start a command as a new background job and return the Job"""
+        job = self.create(command, cwd=cwd, on_output=on_output, on_exit=on_exit)
+        job.start()
+        print(f"DEBUG - Started job {job.id}: {command}")
+        return job
+    
+    def get(self, job_id):
+        """Return the job with the given ID, or None"""
+        return self._jobs.get(job_id)
+    
+    def list(self):
+        """Return all jobs, oldest first"""
+        with self._lock:
+            return list(self._jobs.values())
+    
+    def running_count(self):
+        """Number of jobs that haven't finished"""
+        return sum(1 for job in self.list() if job.state != JOB_DONE)
+    
+    def clear_finished(self):
+        """Forget the jobs that have finished"""
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.state == JOB_DONE]:
+                del self._jobs[job_id]
+
+# The background jobs of this process
+JOBS = JobManager()
+
+def is_background_command(command):
+    """Check if a command ends with a single "&", i.e. should run as a background job"""
+    stripped = command.rstrip()
+    return stripped.endswith("&") and not stripped.endswith("&&") and len(stripped) > 1
+
+def strip_background(command):
+    """Remove the trailing "&" of a background command"""
+    return command.rstrip()[:-1].rstrip()
+
+def poll_job(job_id):
+    """Answer a job_output tool call: the job's new output and its status"""
+    try:
+        job = JOBS.get(int(job_id))
+    except (TypeError, ValueError):
+        job = None
+    if job is None:
+        return f"Error: no background job with ID {job_id}"
+    
+    text, dropped = job.read_new_output()
+    parts = []
+    if dropped:
+        parts.append(f"[... {dropped} earlier characters omitted]")
+    parts.append(text if text else "(no new output)")
+    parts.append(f"Job {job.id} ({job.command}) is {job.status()}")
+    return "\n".join(parts)
+
+def format_rate(rate):
+    """Format an output rate in bytes per second"""
+    return f"{format_size(rate)}/s"
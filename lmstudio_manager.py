@@ -7,6 +7,10 @@ import os
 import platform
 import datetime
 
+from command_result import CommandResult
+from jobs import JOB_TOOLS
+from command_store import CommandStore
+
 # Load configuration
 def load_config():
     """Load LM Studio API configuration from config file"""
@@ -25,13 +29,35 @@ def load_config():
 LMSTUDIO_AVAILABLE = True
 LMSTUDIO_API_URL = load_config()
 
+# The tool for running a command, which the user confirms first
+TERMINAL_EXECUTE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "terminal_execute",
+        "description": "Execute a terminal command and return the output.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "command": {
+                    "type": "string",
+                    "description": "The command to execute"
+                }
+            },
+            "required": ["command"]
+        }
+    }
+}
+
+# Every tool the agent can use
+AGENT_TOOLS = [TERMINAL_EXECUTE_TOOL] + JOB_TOOLS
+
 class LMStudioManager:
     def __init__(self):
         """Initialize the LM Studio Manager"""
         self.available_models = []
         self.current_model = None
         self.server = None
-        self.pending_tool_calls = {}
+        self.pending_tool_calls = CommandStore("pending tool calls")
         self.current_chat = []
         
         # Try to get available models
@@ -265,7 +291,7 @@ Your role is to help the user with their high level tasks by executing commands
 
 Start the conversation by providing the user a short overview of the task and the commands you will be executing. If the user confirms, you will run the commands. You can go ahead and run the command, if the user confirms in the same message.
 
-DO NOT tell the user what commands to run. You MUST run the commands yourself using tool calls 1 by 1 and report back the output, then run the next command, until the task is complete.
+DO NOT tell the user what commands to run. You MUST run the commands yourself using tool calls and report back the output, then run the next commands, until the task is complete.
 
 If you are executing a command that will require confirmation from the user, like Y/N, run the command with a flag like "-y" to automatically confirm.
 
@@ -463,15 +489,24 @@ Always run only one command at a time, and wait for the tool result to come back
     
     def send_tool_result(self, tool_id, result):
         """Send the result of a tool call back to the AI"""
+        return self.send_tool_results([(tool_id, result)])
+    
+    def send_tool_results(self, results):
+        """Send the results of a batch of tool calls back to the AI in a single request"""
         try:
-            print(f"DEBUG - Starting send_tool_result for ID: {tool_id}")
+            print(f"DEBUG - Starting send_tool_results for IDs: {[tool_id for tool_id, _ in results]}")
             
-            # Validate and update tool info
-            if not self._validate_and_update_tool(tool_id, result):
+            # Check every ID before touching the conversation, so an unknown one
+            # can't leave it with the results of only part of the batch
+            unknown = [tool_id for tool_id, _ in results if tool_id not in self.pending_tool_calls]
+            if unknown:
+                print(f"DEBUG - Error: Tool IDs {unknown} not found in pending tool calls")
                 return False
             
-            # Add tool message to conversation
-            self._add_tool_message_to_conversation(tool_id, result)
+            # Update the tool info, and add one tool message per call
+            for tool_id, result in results:
+                self._validate_and_update_tool(tool_id, result)
+                self._add_tool_message_to_conversation(tool_id, result)
             
             # Create payload and make API request
             payload = self._create_tool_result_payload()
@@ -484,7 +519,7 @@ Always run only one command at a time, and wait for the tool result to come back
             # Make the API request
             return self._make_streaming_api_request(payload)
         except Exception as e:
-            error_msg = f"Error sending tool result: {e}"
+            error_msg = f"Error sending tool results: {e}"
             print(f"DEBUG - {error_msg}")
             traceback.print_exc()
             return False
@@ -500,12 +535,15 @@ Always run only one command at a time, and wait for the tool result to come back
         print(f"DEBUG - Found tool info: {tool_info}")
         
         # Update the tool info with the result
-        tool_info["result"] = result
-        tool_info["status"] = "completed"
+        self.pending_tool_calls.complete(tool_id, result)
         return True
 
     def _add_tool_message_to_conversation(self, tool_id, result):
         """Add tool message to the conversation history"""
+        # Commands hand back a CommandResult, other tools a plain string
+        if isinstance(result, CommandResult):
+            result = result.to_tool_result()
+        
         # Create a new message for the tool result
         tool_message = {
             "role": "tool",
@@ -583,8 +621,8 @@ You can also use markdown to format your responses.
             
             for window in windows:
                 # Check if it's our application window
-                if hasattr(window, 'command_rows'):
-                    print(f"DEBUG - Found window with command_rows")
+                if hasattr(window, 'append_command_row'):
+                    print(f"DEBUG - Found window with append_command_row")
                     # Create a new command row
                     try:
                         from command_row import CommandRow
@@ -596,18 +634,13 @@ You can also use markdown to format your responses.
                         traceback.print_exc()
                         return None
                     
-                    # Check if the window has the correct container attribute
-                    if hasattr(window, 'command_container'):
-                        try:
-                            window.command_container.append(new_row)
-                            window.command_rows.append(new_row)
-                            print(f"DEBUG - Added new row to command_container")
-                        except Exception as e:
-                            print(f"DEBUG - Error adding row to container: {e}")
-                            traceback.print_exc()
-                            return None
-                    else:
-                        print("DEBUG - Error: Window has no command_container attribute")
+                    # Add the row to the conversation
+                    try:
+                        window.append_command_row(new_row)
+                        print(f"DEBUG - Added new row to the conversation")
+                    except Exception as e:
+                        print(f"DEBUG - Error adding row to the conversation: {e}")
+                        traceback.print_exc()
                         return None
                     
                     # Initialize the streaming response UI
@@ -630,15 +663,6 @@ You can also use markdown to format your responses.
                     except Exception as e:
                         print(f"DEBUG - Error queuing window redraw: {e}")
                     
-                    # Scroll to the bottom
-                    if hasattr(window, '_scroll_to_bottom'):
-                        try:
-                            from gi.repository import GLib
-                            GLib.idle_add(window._scroll_to_bottom)
-                            print(f"DEBUG - Added scroll_to_bottom to idle queue")
-                        except Exception as e:
-                            print(f"DEBUG - Error adding scroll_to_bottom to idle queue: {e}")
-                    
                     return new_row
             
             print(f"DEBUG - No suitable window found")
@@ -653,25 +677,7 @@ You can also use markdown to format your responses.
         return {
             "model": self.current_model,
             "messages": self.current_chat,
-            "tools": [
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "terminal_execute",
-                        "description": "Execute a terminal command and return the output.",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "command": {
-                                    "type": "string",
-                                    "description": "The command to execute"
-                                }
-                            },
-                            "required": ["command"]
-                        }
-                    }
-                }
-            ],
+            "tools": AGENT_TOOLS,
             "tool_choice": "auto",
             "stream": True
         }
@@ -913,39 +919,20 @@ You can also use markdown to format your responses.
                 print(f"DEBUG - Processing {len(tool_calls_data)} tool calls")
                 
                 # Get unique commands and their tool IDs
-                unique_commands = {}
-                for tool_call in tool_calls_data:
-                    # Extract the command from the arguments
-                    if "function" in tool_call and "arguments" in tool_call["function"]:
-                        try:
-                            # Parse the arguments JSON
-                            args = json.loads(tool_call["function"]["arguments"])
-                            command = args.get("command", "")
-                            
-                            if command:
-                                # Store the command with its tool ID
-                                unique_commands[command] = tool_call["id"]
-                        except json.JSONDecodeError:
-                            print(f"DEBUG - Error parsing arguments JSON: {tool_call['function']['arguments']}")
-                        except Exception as e:
-                            print(f"DEBUG - Error extracting command: {e}")
+                unique_commands = self._extract_unique_commands(tool_calls_data)
                 
                 # Store only the unique tool calls
-                for command, tool_id in unique_commands.items():
+                for tool_id, function_name, command in unique_commands.values():
                     # Store the pending tool call
                     self.pending_tool_calls[tool_id] = {
                         "command": command,
                         "status": "pending",
                         "id": tool_id,
-                        "function_name": "terminal_execute"
+                        "function_name": function_name
                     }
                 
                 # Create a filtered list of tool calls with only unique commands
-                filtered_tool_calls = []
-                unique_tool_ids = set(unique_commands.values())
-                for tool_call in tool_calls_data:
-                    if tool_call["id"] in unique_tool_ids:
-                        filtered_tool_calls.append(tool_call)
+                filtered_tool_calls = self._filter_tool_calls(tool_calls_data, unique_commands)
                 
                 # Add the assistant message to the conversation with filtered tool calls
                 if hasattr(self, 'current_chat'):
@@ -963,7 +950,7 @@ You can also use markdown to format your responses.
                     
                     # Update the UI with the tool calls
                     from gi.repository import GLib
-                    GLib.idle_add(self._current_command_row._process_response, tool_calls_json)
+                    GLib.idle_add(self._current_command_row.process_tool_calls, tool_calls_json)
             
             return False
         except Exception as e:
@@ -1015,8 +1002,7 @@ You can also use markdown to format your responses.
             result = execute_command(command, require_confirmation=False)
             
             # Update with result
-            tool_info["result"] = result
-            tool_info["status"] = "completed"
+            self.pending_tool_calls.complete(tool_id, result)
             
             return result
         else:
@@ -1152,7 +1138,7 @@ Your role is to help the user with their high level tasks by executing commands
 
 Start the conversation by providing the user a short overview of the task and the commands you will be executing. If the user confirms, you will run the commands. You can go ahead and run the command, if the user confirms in the same message.
 
-DO NOT tell the user what commands to run. You MUST run the commands yourself using tool calls 1 by 1 and report back the output, then run the next command, until the task is complete.
+DO NOT tell the user what commands to run. You MUST run the commands yourself using tool calls and report back the output, then run the next commands, until the task is complete.
 
 If you are executing a command that will require confirmation from the user, like Y/N, run the command with a flag like "-y" to automatically confirm.
 
@@ -1161,7 +1147,9 @@ Always err on the side of caution. For instance, instead of running "mv /etc/apt
 DO NOT run interactive commands like "vim" or "nano".
 ONLY run commands that will output to the terminal and return a response, like "ls", "cat", "git status", etc. 
 
-Always run ONLY 1 tool call at a time, and wait for the tool result to come back before running the next terminal command.
+When several commands don't depend on each other (e.g. checking the OS, the disk space and the git status), request them together as multiple tool calls in one response; their results come back together. When a command needs the output of another, wait for that result before running it.
+
+For long-running commands (builds, upgrades, large downloads), use job_start to run them in the background, then check on them with job_output instead of waiting.
 """
         
         # Create a system message with the system info
@@ -1277,13 +1265,13 @@ Always run ONLY 1 tool call at a time, and wait for the tool result to come back
             unique_commands = self._extract_unique_commands(tool_calls_data)
             
             # Store only the unique tool calls
-            for command, tool_id in unique_commands.items():
+            for tool_id, function_name, command in unique_commands.values():
                 # Store the pending tool call
                 self.pending_tool_calls[tool_id] = {
                     "command": command,
                     "status": "pending",
                     "id": tool_id,
-                    "function_name": "terminal_execute"
+                    "function_name": function_name
                 }
             
             # Create a filtered list of tool calls with only unique commands
@@ -1318,7 +1306,7 @@ Always run ONLY 1 tool call at a time, and wait for the tool result to come back
             return full_response
 
     def _extract_unique_commands(self, tool_calls_data):
-        """Extract unique commands from tool calls data"""
+        """Extract unique tool calls, as {key: (tool ID, function name, command)}"""
         unique_commands = {}
         
         for tool_call in tool_calls_data:
@@ -1326,12 +1314,15 @@ Always run ONLY 1 tool call at a time, and wait for the tool result to come back
             if "function" in tool_call and "arguments" in tool_call["function"]:
                 try:
                     # Parse the arguments JSON
-                    args = json.loads(tool_call["function"]["arguments"])
+                    args = json.loads(tool_call["function"]["arguments"] or "{}")
+                    function_name = tool_call["function"].get("name") or "terminal_execute"
                     command = args.get("command", "")
                     
-                    if command:
+                    # Polling a background job has no command, tell those calls apart by job
+                    key = f"job_output:{args.get('job_id')}" if function_name == "job_output" else command
+                    if key:
                         # Store the command with its tool ID
-                        unique_commands[command] = tool_call["id"]
+                        unique_commands[key] = (tool_call["id"], function_name, command)
                 except json.JSONDecodeError:
                     print(f"DEBUG - Error parsing arguments JSON: {tool_call['function']['arguments']}")
                 except Exception as e:
@@ -1344,7 +1335,7 @@ Always run ONLY 1 tool call at a time, and wait for the tool result to come back
         filtered_tool_calls = []
         
         # Create a set of tool IDs for unique commands
-        unique_tool_ids = set(unique_commands.values())
+        unique_tool_ids = set(tool_id for tool_id, _, _ in unique_commands.values())
         
         # Filter the tool calls to only include those with unique IDs
         for tool_call in tool_calls_data:
@@ -1363,13 +1354,13 @@ Always run ONLY 1 tool call at a time, and wait for the tool result to come back
             unique_commands = self._extract_unique_commands(tool_calls_data)
             
             # Store only the unique tool calls
-            for command, tool_id in unique_commands.items():
+            for tool_id, function_name, command in unique_commands.values():
                 # Store the pending tool call
                 self.pending_tool_calls[tool_id] = {
                     "command": command,
                     "status": "pending",
                     "id": tool_id,
-                    "function_name": "terminal_execute"
+                    "function_name": function_name
                 }
             
             # Create a filtered list of tool calls with only unique commands
@@ -9,6 +9,7 @@ gi.require_version('Adw', '1')
 from gi.repository import Gtk, Adw, Gio, Gdk
 
 from window import LmTermWindow
+import mainloop_monitor
 
 class LmTermApplication(Adw.Application):
     def __init__(self):
@@ -59,6 +60,9 @@ class LmTermApplication(Adw.Application):
             print("Warning: style.css file not found")
 
 def main():
+    # Optional developer instrumentation of the main loop
+    mainloop_monitor.install_from_config()
+    
     app = LmTermApplication()
     return app.run(sys.argv)
 
@@ -0,0 +1,263 @@
+import gi
+import os
+import sys
+import time
+import json
+import queue
+import threading
+import traceback
+
+gi.require_version('Gtk', '4.0')
+from gi.repository import Gtk, GLib
+
+from config import get_config
+from command_store import memory_report
+
+# Callbacks running longer than this (in milliseconds) are reported with a stack
+DEFAULT_THRESHOLD_MS = 50
+
+# Default location of the JSONL trace
+DEFAULT_TRACE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "lmterm", "mainloop-trace.jsonl")
+
+# How often the developer overlay is refreshed (in milliseconds)
+OVERLAY_INTERVAL_MS = 500
+
+# The monitor of this process, if enabled
+_monitor = None
+
+class MainLoopMonitor:
+    """
+    Developer instrumentation for main loop stalls.
+    
+    Wraps GLib.idle_add, GLib.timeout_add and GLib.timeout_add_seconds so
+    every callback is timed on the main thread, keeps count of the idle callbacks waiting to run, and watches
+    the gaps between frames. A watchdog thread grabs the Python stack of the
+    main thread when a callback runs longer than the threshold. Slow callbacks
+    and frame gaps are written to a JSONL trace and summarized in an overlay.
+    """
+    
+    def __init__(self, threshold_ms=DEFAULT_THRESHOLD_MS, trace_path=DEFAULT_TRACE_PATH):
+        self.threshold = threshold_ms / 1000.0
+        self.trace_path = trace_path
+        self.main_thread_id = threading.main_thread().ident
+        
+        # Original GLib functions, used by the monitor itself and to uninstall
+        self._idle_add = GLib.idle_add
+        self._timeout_add = GLib.timeout_add
+        self._timeout_add_seconds = GLib.timeout_add_seconds
+        
+        # Number of idle callbacks queued but not finished
+        self._lock = threading.Lock()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        
+        # The callback running on the main thread: (name, start time, invocation number);
+        # a new tuple per invocation, so the watchdog can tell invocations apart
+        self._current = None
+        self._invocation = 0
+        
+        # Stack captured by the watchdog for the current invocation
+        self._captured = None
+        
+        # Statistics since the last overlay refresh
+        self.slowest_name = None
+        self.slowest_ms = 0.0
+        self.longest_frame_gap_ms = 0.0
+        self.long_callbacks = 0
+        self.last_stack = None
+        self._last_frame_time = None
+        
+        # Trace events are written by the watchdog thread, not the main thread
+        self._events = queue.Queue()
+        self._running = False
+        self._overlay_label = None
+    
+    def install(self):
+        """Start monitoring"""
+        GLib.idle_add = self._wrap_idle_add
+        GLib.timeout_add = self._wrap_timeout_add
+        GLib.timeout_add_seconds = self._wrap_timeout_add_seconds
+        
+        self._running = True
+        watchdog = threading.Thread(target=self._watchdog, name="mainloop-watchdog", daemon=True)
+        watchdog.start()
+        print(f"DEBUG - Main loop monitor enabled (threshold {self.threshold * 1000:.0f} ms, trace {self.trace_path})")
+    
+    def uninstall(self):
+        """Stop monitoring and restore the GLib functions"""
+        GLib.idle_add = self._idle_add
+        GLib.timeout_add = self._timeout_add
+        GLib.timeout_add_seconds = self._timeout_add_seconds
+        self._running = False
+    
+    def _wrap_idle_add(self, function, *args, **kwargs):
+        """GLib.idle_add replacement that counts and times the callback"""
+        with self._lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        
+        def run(*callback_args):
+            result = False
+            try:
+                result = self._run(function, callback_args)
+                return result
+            finally:
+                if not result:
+                    # The source is removed once the callback returns False or raises
+                    with self._lock:
+                        self.queue_depth -= 1
+        return self._idle_add(run, *args, **kwargs)
+    
+    def _wrap_timeout_add(self, interval, function, *args, **kwargs):
+        """GLib.timeout_add replacement that times the callback"""
+        def run(*callback_args):
+            return self._run(function, callback_args)
+        return self._timeout_add(interval, run, *args, **kwargs)
+    
+    def _wrap_timeout_add_seconds(self, interval, function, *args, **kwargs):
+        """GLib.timeout_add_seconds replacement that times the callback"""
+        def run(*callback_args):
+            return self._run(function, callback_args)
+        return self._timeout_add_seconds(interval, run, *args, **kwargs)
+    
+    def _run(self, function, args):
+        """Run one callback on the main thread and record how long it took"""
+        name = getattr(function, "__qualname__", None) or repr(function)
+        self._invocation += 1
+        self._captured = None
+        start = time.monotonic()
+        self._current = (name, start, self._invocation)
+        try:
+            return function(*args)
+        finally:
+            duration = time.monotonic() - start
+            self._current = None
+            self._record_callback(name, duration)
+    
+    def _record_callback(self, name, duration):
+        """Update the statistics and trace a slow callback"""
+        duration_ms = duration * 1000
+        if duration_ms > self.slowest_ms:
+            self.slowest_ms = duration_ms
+            self.slowest_name = name
+        
+        if duration >= self.threshold:
+            self.long_callbacks += 1
+            stack = self._captured
+            if stack:
+                self.last_stack = stack
+            self._events.put({
+                "type": "callback",
+                "ts": time.time(),
+                "name": name,
+                "duration_ms": round(duration_ms, 2),
+                "queue_depth": self.queue_depth,
+                "stack": stack,
+            })
+    
+    def _watchdog(self):
+        """Capture the main thread stack while a callback runs too long"""
+        interval = self.threshold / 2
+        while self._running:
+            time.sleep(interval)
+            
+            current = self._current
+            if current is not None and self._captured is None:
+                start = current[1]
+                if time.monotonic() - start >= self.threshold:
+                    frame = sys._current_frames().get(self.main_thread_id)
+                    stack = traceback.format_stack(frame) if frame else None
+                    # Only keep it if the same invocation is still running
+                    if self._current is current:
+                        self._captured = stack
+            
+            self._write_events()
+        self._write_events()
+    
+    def _write_events(self):
+        """Append the pending trace events to the trace file"""
+        if self._events.empty():
+            return
+        try:
+            os.makedirs(os.path.dirname(self.trace_path), exist_ok=True)
+            with open(self.trace_path, "a") as f:
+                while not self._events.empty():
+                    f.write(json.dumps(self._events.get_nowait()) + "\n")
+        except Exception as e:
+            print(f"DEBUG - Error writing main loop trace: {e}")
+    
+    def attach(self, widget):
+        """Watch the frame clock of the given widget"""
+        widget.add_tick_callback(self._on_tick)
+    
+    def _on_tick(self, widget, frame_clock):
+        """Measure the gap since the previous frame"""
+        # Frame times are in microseconds
+        frame_time = frame_clock.get_frame_time()
+        if self._last_frame_time is not None:
+            gap_ms = (frame_time - self._last_frame_time) / 1000
+            self.longest_frame_gap_ms = max(self.longest_frame_gap_ms, gap_ms)
+            if gap_ms >= self.threshold * 1000:
+                self._events.put({
+                    "type": "frame-gap",
+                    "ts": time.time(),
+                    "duration_ms": round(gap_ms, 2),
+                    "queue_depth": self.queue_depth,
+                })
+        self._last_frame_time = frame_time
+        return GLib.SOURCE_CONTINUE
+    
+    def create_overlay(self):
+        """Create the developer overlay showing the latest statistics"""
+        label = Gtk.Label()
+        label.set_halign(Gtk.Align.END)
+        label.set_valign(Gtk.Align.START)
+        label.set_margin_top(56)
+        label.set_margin_end(12)
+        label.set_xalign(0)
+        label.set_can_target(False)
+        label.add_css_class("monospace")
+        label.add_css_class("mainloop-monitor")
+        self._overlay_label = label
+        
+        # Use the original timeout_add so the overlay doesn't measure itself
+        self._timeout_add(OVERLAY_INTERVAL_MS, self._update_overlay)
+        return label
+    
+    def _update_overlay(self):
+        """Show the statistics of the last period and start a new one"""
+        lines = [
+            f"idle queue: {self.queue_depth} (max {self.max_queue_depth})",
+            f"slowest:    {self.slowest_ms:.1f} ms {self.slowest_name or ''}",
+            f"frame gap:  {self.longest_frame_gap_ms:.1f} ms",
+            f"long calls: {self.long_callbacks}",
+        ]
+        if self.last_stack:
+            # The innermost frame is the most useful one to show
+            lines.append(self.last_stack[-1].strip().splitlines()[0])
+        
+        # Memory held by the stores of pending and completed commands
+        lines.extend(memory_report())
+        self._overlay_label.set_text("\n".join(lines))
+        
+        self.slowest_ms = 0.0
+        self.slowest_name = None
+        self.longest_frame_gap_ms = 0.0
+        self.max_queue_depth = self.queue_depth
+        return True
+
+def install_from_config():
+    """Enable the monitor if LMTERM_MONITOR is set or config.json asks for it"""
+    global _monitor
+    enabled = os.environ.get("LMTERM_MONITOR", "") not in ("", "0") or get_config("mainloop_monitor", False)
+    if enabled and _monitor is None:
+        _monitor = MainLoopMonitor(
+            threshold_ms=get_config("mainloop_monitor_threshold_ms", DEFAULT_THRESHOLD_MS),
+            trace_path=get_config("mainloop_monitor_trace", DEFAULT_TRACE_PATH),
+        )
+        _monitor.install()
+    return _monitor
+
+def get_monitor():
+    """Return the running monitor, or None when monitoring is off"""
+    return _monitor
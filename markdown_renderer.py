@@ -1,11 +1,24 @@
 import gi
 import re
 from html import escape
+from concurrent.futures import ThreadPoolExecutor
+import syntax_highlight
 
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 from gi.repository import Gtk, Pango, GLib, Gdk
 
+# Small pool of worker threads converting markdown to Pango markup off the main thread
+RENDER_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="markdown")
+
+# Fenced code blocks, and a block still being streamed (no closing fence yet)
+CODE_BLOCK_PATTERN = re.compile(r'```([a-zA-Z0-9_+-]*)\n(.*?)```', re.DOTALL)
+OPEN_CODE_BLOCK_PATTERN = re.compile(r'```([a-zA-Z0-9_+-]*)\n(.*)\Z', re.DOTALL)
+
+# Placeholder standing in for a code block while the rest of the text is processed
+CODE_PLACEHOLDER = "\x00{}\x00"
+CODE_PLACEHOLDER_PATTERN = re.compile(r'\x00(\d+)\x00')
+
 class MarkdownRenderer:
     """A class to render Markdown text as Pango markup for GTK widgets"""
     
@@ -14,12 +27,13 @@ class MarkdownRenderer:
         """Convert markdown text to Pango markup"""
         if not text:
             return ""
-            
-        # Escape HTML entities first (but preserve existing markup)
-        text = escape(text, quote=False)
         
-        # Process code blocks with syntax highlighting
-        text = MarkdownRenderer._process_code_blocks(text)
+        # Take the code blocks out first, so they are escaped exactly once and
+        # the inline rules below never touch their contents
+        text, code_blocks = MarkdownRenderer._extract_code_blocks(text)
+        
+        # Escape HTML entities
+        text = escape(text, quote=False)
         
         # Process inline code - use #f0f0f0 instead of rgba()
         # Make sure to process inline code BEFORE other formatting to avoid conflicts
@@ -50,25 +64,39 @@ class MarkdownRenderer:
         # Process links
         text = re.sub(r'\[([^\]]+)\]\(([^)]+)\)', r'<a href="\2">\1</a>', text)
         
+        # Put the highlighted code blocks back
+        text = CODE_PLACEHOLDER_PATTERN.sub(lambda match: code_blocks[int(match.group(1))], text)
+        
         return text
     
     @staticmethod
-    def _process_code_blocks(text):
-        """Process markdown code blocks with language specification"""
-        def replace_code_block(match):
-            code = match.group(2)
+    def _extract_code_blocks(text):
+        """Replace fenced code blocks with placeholders and return their markup"""
+        code_blocks = []
+        
+        def replace_code_block(match, highlight=True):
             lang = match.group(1) or ""
+            code = match.group(2)
             
-            # Escape any Pango markup in the code
-            code = escape(code)
+            # Finished blocks are highlighted (and cached); a block that is still
+            # streaming changes on every update, so it stays plain until it closes
+            if highlight:
+                code = syntax_highlight.highlight(code, lang)
+            else:
+                code = syntax_highlight.plain(code)
             
             # Return formatted code block - use monospace and background color
             # Use span instead of div (div is not supported in Pango markup)
-            return f'<span background="#f0f0f0" font_family="monospace">\n{code}\n</span>'
+            code_blocks.append(f'<span background="#f0f0f0" font_family="monospace">\n{code}\n</span>')
+            return CODE_PLACEHOLDER.format(len(code_blocks) - 1)
         
         # Replace ```language\ncode``` blocks
-        pattern = r'```([a-zA-Z0-9_]*)\n(.*?)```'
-        return re.sub(pattern, replace_code_block, text, flags=re.DOTALL)
+        text = CODE_BLOCK_PATTERN.sub(replace_code_block, text)
+        
+        # A trailing block without its closing fence yet
+        text = OPEN_CODE_BLOCK_PATTERN.sub(lambda match: replace_code_block(match, highlight=False), text)
+        
+        return text, code_blocks
     
     @staticmethod
     def apply_markdown_to_label(label, text):
@@ -88,7 +116,13 @@ class MarkdownRenderer:
         return True  # Return True to prevent default handling
 
 class MarkdownLabel(Gtk.Label):
-    """A GTK Label that renders Markdown text"""
+    """
+    A GTK Label that renders Markdown text.
+    
+    The conversion to Pango markup runs on RENDER_POOL. Every new text gets a
+    sequence number and only the result for the newest one is applied, so
+    renders superseded while streaming never reach GTK.
+    """
     
     def __init__(self):
         super().__init__()
@@ -99,8 +133,53 @@ class MarkdownLabel(Gtk.Label):
         
         # Enable link clicking
         self.connect("activate-link", MarkdownRenderer._on_activate_link)
+        
+        # The newest markdown text and its sequence number
+        self._markdown = None
+        self._render_seq = 0
+        
+        # Whether a render for this label is running on the pool
+        self._rendering = False
     
     def set_markdown(self, text):
         """Set the label's text as markdown"""
-        markup = MarkdownRenderer.markdown_to_pango(text)
-        self.set_markup(markup) 
\ No newline at end of file
+        if text == self._markdown:
+            return
+        self._markdown = text
+        self._render_seq += 1
+        
+        # Only one render per label runs at a time; when it finishes it
+        # picks up the newest text, so intermediate texts are skipped
+        if not self._rendering:
+            self._start_render()
+    
+    def _start_render(self):
+        """Convert the newest text on the render pool"""
+        self._rendering = True
+        seq = self._render_seq
+        future = RENDER_POOL.submit(MarkdownRenderer.markdown_to_pango, self._markdown)
+        future.add_done_callback(lambda future: self._on_render_done(future, seq))
+    
+    def _on_render_done(self, future, seq):
+        """Hand a finished render back to the main thread (runs on the worker)"""
+        if seq != self._render_seq:
+            # Superseded by newer text, drop the markup before it reaches GTK
+            GLib.idle_add(self._apply_markup, None, seq)
+            return
+        
+        try:
+            markup = future.result()
+        except Exception as e:
+            print(f"Error rendering markdown: {e}")
+            markup = escape(self._markdown or "", quote=False)
+        GLib.idle_add(self._apply_markup, markup, seq)
+    
+    def _apply_markup(self, markup, seq):
+        """Apply a finished render on the main thread"""
+        self._rendering = False
+        if seq == self._render_seq:
+            self.set_markup(markup)
+        else:
+            # Newer text arrived while rendering, render that one now
+            self._start_render()
+        return False 
\ No newline at end of file
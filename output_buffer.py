@@ -0,0 +1,276 @@
+import os
+import mmap
+import codecs
+import weakref
+import tempfile
+import threading
+import collections
+
+from config import get_config
+
+# Characters kept in memory from the start and the end of a bounded capture
+DEFAULT_HEAD_SIZE = 64 * 1024
+DEFAULT_TAIL_SIZE = 1024 * 1024
+
+# Bytes of the spill file shown per page
+DEFAULT_PAGE_SIZE = 256 * 1024
+
+# Bytes of the spill file read at a time when it is streamed out whole
+SPILL_READ_SIZE = 1024 * 1024
+
+# Directory for the spill files holding the full output of very large commands
+SPILL_DIR = get_config("output_spill_dir", os.path.join(os.path.expanduser("~"), ".cache", "lmterm", "spill"))
+
+class OutputBuffer:
+    """
+    Accumulates command output as a list of chunks.
+    
+    Appending never copies the text already stored (unlike `str +=`), the chunks
+    are only joined when the full text is asked for.
+    """
+    
+    def __init__(self, text=""):
+        self._chunks = [text] if text else []
+        self._length = len(text)
+    
+    def append(self, text):
+        """Append a chunk of text"""
+        if text:
+            self._chunks.append(text)
+            self._length += len(text)
+    
+    def getvalue(self):
+        """Return the full text"""
+        if len(self._chunks) > 1:
+            # Collapse the chunks so repeated calls stay cheap
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+    
+    def __len__(self):
+        return self._length
+
+class CaptureBuffer:
+    """
+    Bounded capture of command output.
+    
+    Keeps the first head_size and the last tail_size characters in memory and
+    drops the middle, so memory stays bounded whatever the size of the output.
+    With a spill directory, the full byte stream is also written to a spill
+    file that can be read back page by page through mmap. The spill file is
+    created once the output outgrows the memory budget and deleted when the
+    buffer is garbage collected.
+    """
+    
+    def __init__(self, head_size=DEFAULT_HEAD_SIZE, tail_size=DEFAULT_TAIL_SIZE, spill_dir=None):
+        self.head_size = head_size
+        self.tail_size = tail_size
+        self.spill_dir = spill_dir
+        
+        # First characters of the output; holds everything until the budget is exceeded
+        self._head = []
+        self._head_length = 0
+        
+        # Last characters of the output, once the middle is being dropped
+        self._tail = collections.deque()
+        self._tail_length = 0
+        
+        # Total number of characters appended and number dropped from the middle
+        self._length = 0
+        self.omitted = 0
+        self.overflowed = False
+        
+        # Spill file with the full output (as UTF-8)
+        self.spill_path = None
+        self._spill_file = None
+        self._spill_bytes = 0
+        self._lock = threading.Lock()
+    
+    @property
+    def spilled(self):
+        """Whether the full output lives in a spill file"""
+        return self.spill_path is not None
+    
+    def append(self, text):
+        """Append a chunk of text"""
+        if not text:
+            return
+        with self._lock:
+            self._length += len(text)
+            if self._spill_file is not None:
+                self._write_spill(text)
+            
+            if not self.overflowed:
+                self._head.append(text)
+                self._head_length += len(text)
+                if self._head_length > self.head_size + self.tail_size:
+                    self._overflow()
+                return
+            
+            self._tail.append(text)
+            self._tail_length += len(text)
+            self._trim_tail()
+    
+    def _overflow(self):
+        """Switch from keeping everything to keeping the head and tail"""
+        text = "".join(self._head)
+        self.overflowed = True
+        
+        # Everything so far goes to the spill file, later chunks as they arrive
+        if self.spill_dir is not None:
+            self._open_spill()
+            self._write_spill(text)
+        
+        self._head = [text[:self.head_size]]
+        self._head_length = len(self._head[0])
+        self._tail = collections.deque([text[self.head_size:]])
+        self._tail_length = len(text) - self._head_length
+        self._trim_tail()
+    
+    def _trim_tail(self):
+        """Drop the oldest tail chunks beyond tail_size"""
+        excess = self._tail_length - self.tail_size
+        while excess > 0:
+            chunk = self._tail[0]
+            if len(chunk) <= excess:
+                self._tail.popleft()
+                dropped = len(chunk)
+            else:
+                self._tail[0] = chunk[excess:]
+                dropped = excess
+            self._tail_length -= dropped
+            self.omitted += dropped
+            excess -= dropped
+    
+    def _open_spill(self):
+        """Create the spill file"""
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            fd, self.spill_path = tempfile.mkstemp(prefix="output-", suffix=".log", dir=self.spill_dir)
+            self._spill_file = os.fdopen(fd, "wb")
+            
+            # Remove the file once the buffer is gone (or at exit)
+            weakref.finalize(self, _remove_spill, self._spill_file, self.spill_path)
+        except OSError as e:
+            print(f"DEBUG - Could not create spill file: {e}")
+            self.spill_path = None
+            self._spill_file = None
+    
+    def _write_spill(self, text):
+        """Write text to the spill file"""
+        data = text.encode("utf-8", errors="replace")
+        self._spill_file.write(data)
+        self._spill_bytes += len(data)
+    
+    def getvalue(self):
+        """Return the output, with a marker in place of the dropped middle"""
+        with self._lock:
+            if len(self._head) > 1:
+                self._head = ["".join(self._head)]
+            head = self._head[0] if self._head else ""
+            if not self.overflowed:
+                return head
+            
+            if len(self._tail) > 1:
+                self._tail = collections.deque(["".join(self._tail)])
+            tail = self._tail[0] if self._tail else ""
+            if not self.omitted:
+                return head + tail
+            
+            # Start the shown tail at a line start, unless its first line is very long
+            newline = tail.find("\n", 0, 1024)
+            if newline != -1:
+                tail = tail[newline + 1:]
+            
+            where = f"; full output in {self.spill_path}" if self.spilled else ""
+            return f"{head}\n\n[... {self.omitted} characters omitted{where} ...]\n\n{tail}"
+    
+    def __len__(self):
+        return self._length
+    
+    def dump(self):
+        """Return the in-memory state as plain data (for dehydrated rows)"""
+        value = self.getvalue() if not self.overflowed else None
+        if value is not None:
+            return [value, 0, ""]
+        return [self._head[0] if self._head else "", self.omitted, "".join(self._tail)]
+    
+    @classmethod
+    def load(cls, state, **kwargs):
+        """Create a buffer from the output of dump()"""
+        head, omitted, tail = state
+        buffer = cls(**kwargs)
+        buffer.append(head)
+        if omitted or tail:
+            # Restore the head/tail split exactly as it was
+            buffer.overflowed = True
+            buffer._tail = collections.deque([tail])
+            buffer._tail_length = len(tail)
+            buffer.omitted = omitted
+            buffer._length = len(head) + omitted + len(tail)
+        return buffer
+    
+    def page_count(self, page_size=DEFAULT_PAGE_SIZE):
+        """Number of pages of the spill file"""
+        if not self.spilled:
+            return 0
+        return max(1, -(-self._spill_bytes // page_size))
+    
+    def read_page(self, index, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Read one page of the full output from the spill file.
+        
+        Pages are cut at line starts, so a page runs from the first line
+        starting in it to the end of the line where the next page begins.
+        """
+        with self._lock:
+            if not self.spilled:
+                return ""
+            self._spill_file.flush()
+            size = self._spill_bytes
+        
+        if size == 0:
+            return ""
+        with open(self.spill_path, "rb") as f, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            start = min(index * page_size, size)
+            end = min(start + page_size, size)
+            
+            if start > 0:
+                newline = mm.find(b"\n", start - 1, end)
+                start = newline + 1 if newline != -1 else start
+            if end < size:
+                newline = mm.find(b"\n", end - 1)
+                end = newline + 1 if newline != -1 else size
+            return mm[start:end].decode("utf-8", errors="replace")
+    
+    def iter_text(self, chunk_size=SPILL_READ_SIZE):
+        """
+        Yield the full output in chunks: the spill file read chunk_size bytes
+        at a time when there is one, else getvalue(). Only one chunk is held
+        in memory, so even a huge output can be streamed to a file.
+        """
+        with self._lock:
+            size = None
+            if self.spilled:
+                self._spill_file.flush()
+                size = self._spill_bytes
+        if size is None:
+            yield self.getvalue()
+            return
+        
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        with open(self.spill_path, "rb") as f:
+            while size > 0:
+                data = f.read(min(chunk_size, size))
+                if not data:
+                    break
+                size -= len(data)
+                yield decoder.decode(data)
+        yield decoder.decode(b"", final=True)
+
+def _remove_spill(spill_file, path):
+    """Close and delete a spill file"""
+    try:
+        spill_file.close()
+        os.unlink(path)
+    except OSError:
+        pass
@@ -0,0 +1,166 @@
+import gi
+
+gi.require_version('Gtk', '4.0')
+from gi.repository import Gtk, Pango
+
+from ansi import AnsiParser, PALETTE
+from config import get_config
+
+# Default caps for the text kept in the view; older text is trimmed from the top
+DEFAULT_MAX_LINES = 10000
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024
+
+# When a cap is exceeded we trim down to this fraction of it, so trimming
+# happens once per batch of output rather than on every append
+TRIM_RATIO = 0.75
+
+# Most text tags created for ANSI styles; text in further styles is shown plain
+MAX_STYLE_TAGS = 1024
+
+# Color of dim text without a color of its own
+DIM_COLOR = "#888a85"
+
+class OutputView(Gtk.TextView):
+    """
+    An append-only, read-only text view for streaming terminal output.
+    
+    Only the most recent output is kept in the view; the owner of the output
+    keeps the full text (e.g. for copying). ANSI escape sequences in the
+    output are parsed as it streams in: SGR colors and attributes become text
+    tags on the inserted text (one tag per style, shared by all runs), and
+    the other sequences are dropped.
+    """
+    
+    def __init__(self, max_lines=DEFAULT_MAX_LINES, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__()
+        self.set_editable(False)
+        self.set_cursor_visible(False)
+        self.set_monospace(True)
+        self.set_wrap_mode(Gtk.WrapMode.CHAR)
+        
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        
+        # Number of UTF-8 bytes currently held by the text buffer
+        self._visible_bytes = 0
+        
+        # Escape sequence parser, and the text tag of each style seen so far
+        self._ansi = AnsiParser()
+        self._style_tags = {}
+        self.show_colors = get_config("ansi_colors", True)
+    
+    def append(self, text):
+        """Append text at the end of the view without touching existing text"""
+        text, runs = self._ansi.feed(text)
+        if not text:
+            return
+        
+        # Insert only the new text at the end of the buffer, then style its runs
+        buffer = self.get_buffer()
+        offset = buffer.get_char_count()
+        buffer.insert(buffer.get_end_iter(), text)
+        if self.show_colors:
+            for start, end, style in runs:
+                tag = self._tag_for_style(style)
+                if tag is not None:
+                    buffer.apply_tag(tag, buffer.get_iter_at_offset(offset + start),
+                                     buffer.get_iter_at_offset(offset + end))
+        self._visible_bytes += len(text.encode('utf-8', errors='replace'))
+        
+        # Drop old text from the top if we went over a cap
+        self._trim()
+    
+    def set_text(self, text):
+        """Replace the whole output with the given text"""
+        self.clear()
+        
+        # Only the tail that fits in the caps would survive trimming, so skip the rest
+        if self.max_bytes and len(text) > self.max_bytes:
+            text = text[-int(self.max_bytes * TRIM_RATIO):]
+            text = text[text.find("\n") + 1:]
+        self.append(text)
+    
+    def _tag_for_style(self, style):
+        """Return the text tag showing an ANSI style, created on first use"""
+        tag = self._style_tags.get(style)
+        if tag is not None or len(self._style_tags) >= MAX_STYLE_TAGS:
+            return tag
+        
+        foreground, background = style.foreground, style.background
+        if style.inverse:
+            foreground, background = background or PALETTE[0], foreground or PALETTE[7]
+        if style.dim and foreground is None:
+            foreground = DIM_COLOR
+        
+        tag = Gtk.TextTag()
+        if foreground is not None:
+            tag.set_property("foreground", foreground)
+        if background is not None:
+            tag.set_property("background", background)
+        if style.bold:
+            tag.set_property("weight", Pango.Weight.BOLD)
+        if style.italic:
+            tag.set_property("style", Pango.Style.ITALIC)
+        if style.underline:
+            tag.set_property("underline", Pango.Underline.SINGLE)
+        if style.strikethrough:
+            tag.set_property("strikethrough", True)
+        self.get_buffer().get_tag_table().add(tag)
+        self._style_tags[style] = tag
+        return tag
+    
+    def get_terminal_size(self, height=None):
+        """
+        Return the (rows, columns) of monospace text that fit in the view, or
+        None if the view has no size yet. The height defaults to the view's own.
+        """
+        width = self.get_width()
+        if height is None:
+            height = self.get_height()
+        if width <= 0 or height <= 0:
+            return None
+        
+        metrics = self.get_pango_context().get_metrics(None, None)
+        char_width = metrics.get_approximate_char_width() / Pango.SCALE
+        line_height = metrics.get_height() / Pango.SCALE
+        if char_width <= 0 or line_height <= 0:
+            return None
+        
+        width -= self.get_left_margin() + self.get_right_margin()
+        return (max(1, int(height // line_height)), max(1, int(width // char_width)))
+    
+    def clear(self):
+        """Remove all output"""
+        self._visible_bytes = 0
+        self._ansi.reset()
+        self.get_buffer().set_text("")
+    
+    def _trim(self):
+        """Trim text from the top of the buffer when it exceeds a cap"""
+        buffer = self.get_buffer()
+        
+        # Trim by line count
+        line_count = buffer.get_line_count()
+        if self.max_lines and line_count > self.max_lines:
+            drop_lines = line_count - int(self.max_lines * TRIM_RATIO)
+            _, end = buffer.get_iter_at_line(drop_lines)
+            self._delete_head(end)
+        
+        # Trim by size
+        if self.max_bytes and self._visible_bytes > self.max_bytes:
+            drop_bytes = self._visible_bytes - int(self.max_bytes * TRIM_RATIO)
+            
+            # Output is mostly ASCII so a character offset is a good first guess,
+            # then move to the next line start so we never cut a line in half
+            end = buffer.get_iter_at_offset(drop_bytes)
+            if not end.starts_line():
+                end.forward_line()
+            self._delete_head(end)
+    
+    def _delete_head(self, end):
+        """Delete the text between the start of the buffer and the given iter"""
+        buffer = self.get_buffer()
+        start = buffer.get_start_iter()
+        removed = buffer.get_text(start, end, False)
+        buffer.delete(start, end)
+        self._visible_bytes -= len(removed.encode('utf-8', errors='replace'))
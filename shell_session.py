@@ -0,0 +1,467 @@
+import os
+import time
+import atexit
+import uuid
+import codecs
+import functools
+import shlex
+import shutil
+import tempfile
+import signal
+import selectors
+import threading
+import subprocess
+
+from command_result import CommandResult, ResourceUsage
+from command_runner import READ_SIZE, ProcessHandle, resource_limits
+from command_cache import CACHE_ENV_VARS
+
+# Shell kept running for the session
+SHELL = "bash"
+
+# Prefix of the line the shell prints after each command; a random token per
+# command follows it, so command output can never end a command early
+SENTINEL_PREFIX = "__LMTERM_DONE_"
+
+# The session of this process, created on first use
+_session = None
+_session_lock = threading.Lock()
+
+class ShellSession:
+    """
+    One long-lived bash process that runs commands one after the other.
+    
+    Commands are written to the shell's stdin and run with eval, so cd, export,
+    shell functions, aliases and activated virtualenvs carry over to the next
+    command. After each command the shell prints a sentinel line with the exit
+    code, working directory and environment on stdout (and a bare sentinel on
+    stderr); the reader streams everything before the sentinels and stops at them.
+    
+    Only one command runs at a time. run() returns None when the shell is busy
+    or can't be started, and the caller falls back to a one-shot shell.
+    """
+    
+    def __init__(self, cwd=None):
+        self.cwd = cwd or os.getcwd()
+        self.process = None
+        
+        # Values of CACHE_ENV_VARS in the shell after the last command (None if
+        # unset there), or None for a new shell, which has lmTerm's environment
+        self.environment = None
+        self._lock = threading.Lock()
+        
+        # File a command run with resource limits (in a subshell) leaves its
+        # working directory in, for the shell to follow
+        self._cwd_file = None
+    
+    @property
+    def alive(self):
+        """Whether the shell process is running"""
+        return self.process is not None and self.process.poll() is None
+    
+    @property
+    def busy(self):
+        """Whether a command is running in the shell"""
+        return self._lock.locked()
+    
+    def start(self):
+        """Start the shell process; returns False if it can't be started"""
+        if shutil.which(SHELL) is None:
+            return False
+        self.cwd = os.getcwd()
+        self.environment = None
+        try:
+            self.process = subprocess.Popen(
+                [SHELL, "--noprofile", "--norc"],
+                cwd=self.cwd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                bufsize=0,
+                # Own process group, so a runaway command can be killed with the shell
+                start_new_session=True
+            )
+        except OSError as e:
+            print(f"DEBUG - Could not start shell session: {e}")
+            self.process = None
+            return False
+        
+        # Non-interactive bash ignores aliases unless asked. Job control puts every
+        # job a command starts in a process group of its own, which can be signalled
+        # without touching the shell; with it, bash exits when a job dies of SIGINT
+        # unless SIGINT is trapped (a trap, unlike ignoring it, isn't inherited)
+        self._write("shopt -s expand_aliases; set -m; trap : INT\n")
+        fd, self._cwd_file = tempfile.mkstemp(prefix="lmterm-cwd-")
+        os.close(fd)
+        self._write(f"__lmterm_cwd_file={shlex.quote(self._cwd_file)}\n")
+        print(f"DEBUG - Started shell session (pid {self.process.pid}) in {self.cwd}")
+        return True
+    
+    def close(self):
+        """Stop the shell process"""
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self._kill()
+    
+    def _kill(self):
+        """Kill the shell and everything it started"""
+        # The jobs are in process groups of their own
+        groups, _ = _command_processes(self.process.pid, 0)
+        for pgid in [self.process.pid] + groups:
+            try:
+                os.killpg(pgid, signal.SIGKILL)
+            except OSError:
+                pass
+        self.process.wait()
+        for stream in (self.process.stdout, self.process.stderr):
+            stream.close()
+        self.process = None
+        if self._cwd_file is not None:
+            try:
+                os.unlink(self._cwd_file)
+            except OSError:
+                pass
+            self._cwd_file = None
+    
+    def _write(self, text):
+        """Send text to the shell's stdin"""
+        self.process.stdin.write(text.encode("utf-8"))
+    
+    def run(self, command, on_output=None, output=None, timeout=None, handle=None, max_output=None):
+        """
+        Run a command in the shell and return a CommandResult, or None if the
+        shell is busy or not available.
+        
+        Output is passed to on_output and appended to output as it arrives, and
+        the command is stopped on handle.stop(), after timeout seconds or more
+        than max_output bytes, like command_runner.run_streaming. Only the
+        processes of the command are signalled, so the shell keeps its state;
+        a command that exits the shell (or runs in the shell itself when it
+        is stopped) takes the shell down, and the next command starts a new one.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            if not self.alive and not self.start():
+                return None
+            return self._run(command, on_output, output, timeout, handle or ProcessHandle(), max_output)
+        finally:
+            self._lock.release()
+    
+    @staticmethod
+    def _signal_command(shell_pid, since, signum):
+        """Send a signal to the processes the shell started for the current command"""
+        groups, pids = _command_processes(shell_pid, since)
+        if not groups and not pids:
+            # The command runs in the shell itself (e.g. a shell loop), or /proc
+            # can't tell. SIGINT is trapped there; the later signals end the
+            # session, with the jobs left in it, which would keep its pipes open
+            if signum == signal.SIGINT:
+                os.kill(shell_pid, signum)
+                return
+            groups = [shell_pid] + _command_processes(shell_pid, 0)[0]
+        for pgid in groups:
+            try:
+                os.killpg(pgid, signum)
+            except ProcessLookupError:
+                pass
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+    
+    def _run(self, command, on_output, output, timeout, handle, max_output):
+        """Run one command in the running shell"""
+        start = time.monotonic()
+        deadline = start + timeout if timeout else None
+        counters_before = _children_counters(self.process.pid)
+        started = _uptime_ticks()
+        
+        # The command reads from /dev/null, so it can't eat the commands that follow
+        sentinel = SENTINEL_PREFIX + uuid.uuid4().hex
+        script = ""
+        if os.getcwd() != self.cwd:
+            # lmTerm changed directory without the shell (a cd run while the shell was busy)
+            script += f"cd {shlex.quote(os.getcwd())}\n"
+            self.cwd = os.getcwd()
+        
+        # The trailer reports the variables the command cache keys on, each after
+        # a unit separator, prefixed with "=" when it is set and with newlines and
+        # unit separators replaced, so the trailer stays one line
+        env_values = "".join(f' "${{{name}+=}}${{{name}//[$\'\\n\\x1f\']/?}}"' for name in CACHE_ENV_VARS)
+        
+        # Resource limits apply to this command only, in a subshell: each process
+        # the command starts gets the configured CPU time, counted from its start.
+        # The subshell leaves its directory behind for the shell to follow
+        limits = resource_limits()
+        if limits:
+            script += (
+                "( ulimit -S " + " ".join(f"{option} {value}" for option, value in limits) + "\n"
+                "trap 'printf %s \"$PWD\" >\"$__lmterm_cwd_file\"' EXIT\n"
+                f"eval {shlex.quote(command)}\n) </dev/null\n"
+                "__lmterm_status=$?\n"
+                'if [ -s "$__lmterm_cwd_file" ]; then cd -- "$(<"$__lmterm_cwd_file")" 2>/dev/null; : >"$__lmterm_cwd_file"; fi\n'
+            )
+        else:
+            script += f"eval {shlex.quote(command)} </dev/null\n__lmterm_status=$?\n"
+        script += (
+            f"printf '\\n{sentinel}:%d:%s' \"$__lmterm_status\" \"$PWD\"\n"
+            f"printf '\\x1f%s'{env_values}\n"
+            f"printf '\\n'\n"
+            f"printf '\\n{sentinel}\\n' >&2\n"
+        )
+        try:
+            self._write(script)
+        except OSError as e:
+            # The shell went away since the last command
+            self._kill()
+            handle.finish()
+            return CommandResult(command, output=output, error=f"Shell session ended: {e}")
+        handle.attach(functools.partial(self._signal_command, self.process.pid, started))
+        environment = self.environment
+        
+        streams = {
+            self.process.stdout.fileno(): _SentinelReader("\n" + sentinel),
+            self.process.stderr.fileno(): _SentinelReader("\n" + sentinel),
+        }
+        byte_counts = dict.fromkeys(streams, 0)
+        timed_out = False
+        output_limited = False
+        shell_exited = False
+        
+        selector = selectors.DefaultSelector()
+        try:
+            for fd, reader in streams.items():
+                selector.register(fd, selectors.EVENT_READ, reader)
+            
+            # Read until both streams reached their sentinel
+            while selector.get_map():
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        # Stop the command but keep reading until the shell reports back
+                        timed_out = True
+                        deadline = None
+                        remaining = None
+                        handle.stop()
+                
+                for key, _ in selector.select(remaining):
+                    reader = key.data
+                    data = os.read(key.fd, READ_SIZE)
+                    if not data:
+                        # The command exited the shell
+                        shell_exited = True
+                        text = reader.feed(b"", final=True)
+                        selector.unregister(key.fd)
+                    else:
+                        text = reader.feed(data)
+                        if reader.done:
+                            selector.unregister(key.fd)
+                    if text:
+                        byte_counts[key.fd] += len(text.encode("utf-8"))
+                        if max_output is not None and not output_limited and sum(byte_counts.values()) > max_output:
+                            output_limited = True
+                            handle.stop()
+                        if output_limited:
+                            # Drain the rest without keeping it
+                            continue
+                        if output is not None:
+                            output.append(text)
+                        if on_output:
+                            on_output(text)
+        finally:
+            selector.close()
+            handle.finish()
+        
+        stdout_fd = self.process.stdout.fileno()
+        exit_code = None
+        if shell_exited:
+            # Nothing is left to run the next command in; it gets a new shell
+            self._kill()
+        else:
+            exit_code, cwd, self.environment = _parse_trailer(streams[stdout_fd].trailer)
+            self._sync_cwd(cwd)
+        
+        # The command's processes are the shell's children, which the shell has reaped by now
+        usage = None
+        counters_after = _children_counters(self.process.pid) if self.process else None
+        if counters_before is not None and counters_after is not None:
+            usage = ResourceUsage(**{name: counters_after[name] - counters_before[name]
+                                     for name in counters_after})
+        
+        result = CommandResult(
+            command,
+            exit_code=exit_code,
+            stdout_bytes=byte_counts[stdout_fd],
+            stderr_bytes=sum(byte_counts.values()) - byte_counts[stdout_fd],
+            wall_time=time.monotonic() - start,
+            cpu_time=usage.cpu_time if usage else 0.0,
+            usage=usage,
+            output=output,
+            timed_out=timed_out,
+            stopped=handle.stop_requested and not timed_out and not output_limited,
+            output_limited=output_limited,
+            error="The command exited the shell session" if shell_exited and not handle.stop_requested else None,
+        )
+        result.environment = environment
+        return result
+    
+    def _sync_cwd(self, cwd):
+        """Follow the shell's working directory in this process"""
+        if not cwd or cwd == self.cwd:
+            return
+        self.cwd = cwd
+        try:
+            os.chdir(cwd)
+        except OSError as e:
+            print(f"DEBUG - Could not follow shell directory {cwd}: {e}")
+
+class _SentinelReader:
+    """Decodes one stream of the shell and holds back a possible sentinel"""
+    
+    def __init__(self, sentinel):
+        self.sentinel = sentinel
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._pending = ""
+        
+        # Rest of the sentinel line (exit code and directory), once seen
+        self.trailer = None
+        self.done = False
+    
+    def feed(self, data, final=False):
+        """Decode data and return the text that belongs to the command"""
+        text = self._pending + self.decoder.decode(data, final=final)
+        self._pending = ""
+        
+        index = text.find(self.sentinel)
+        if index >= 0:
+            end = text.find("\n", index + len(self.sentinel))
+            if end < 0 and not final:
+                # Wait for the whole sentinel line
+                self._pending = text[index:]
+                return text[:index]
+            self.trailer = text[index + len(self.sentinel):end if end >= 0 else None]
+            self.done = True
+            return text[:index]
+        
+        if final:
+            return text
+        
+        # Keep back a tail that could be the start of the sentinel
+        for length in range(min(len(self.sentinel) - 1, len(text)), 0, -1):
+            if self.sentinel.startswith(text[-length:]):
+                self._pending = text[-length:]
+                return text[:-length]
+        return text
+
+def _parse_trailer(trailer):
+    """
+    Split the ":<exit code>:<directory>" trailer of the sentinel line and the
+    environment values after it into the exit code, directory and a dict of
+    CACHE_ENV_VARS (None if the values are missing or cut short by a newline).
+    """
+    _, _, rest = (trailer or "").partition(":")
+    code, _, rest = rest.partition(":")
+    cwd, *values = rest.rsplit("\x1f", len(CACHE_ENV_VARS))
+    environment = None
+    if len(values) == len(CACHE_ENV_VARS) and all(not value or value.startswith("=") for value in values):
+        environment = {name: value[1:] if value else None for name, value in zip(CACHE_ENV_VARS, values)}
+    try:
+        return int(code), cwd, environment
+    except ValueError:
+        return None, cwd, environment
+
+def _uptime_ticks():
+    """Time since boot in clock ticks, as process start times are given in /proc (0 without /proc)"""
+    try:
+        with open("/proc/uptime") as f:
+            return int(float(f.read().split()[0]) * os.sysconf("SC_CLK_TCK"))
+    except (OSError, IndexError, ValueError):
+        return 0
+
+def _command_processes(shell_pid, since):
+    """
+    The processes below the shell that started at or after since (in clock
+    ticks since boot), from /proc: the process groups of the jobs they belong
+    to, and the PIDs of those in the shell's own group (e.g. command
+    substitutions). Jobs that started earlier (left running in the
+    background by a previous command) are left out. Both are empty without /proc.
+    """
+    children = {}
+    processes = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return [], []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # Fields after the command name: the parent PID, process group and
+                # start time are fields 4, 5 and 22
+                fields = f.read().rsplit(")", 1)[1].split()
+            parent, pgid, start = int(fields[1]), int(fields[2]), int(fields[19])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+        processes[int(entry)] = (pgid, start)
+    
+    # A job started when its first process (the group leader) did
+    group_starts = {}
+    pids = []
+    pending = [shell_pid]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            pending.append(child)
+            pgid, start = processes[child]
+            if pgid == shell_pid:
+                if start >= since:
+                    pids.append(child)
+            elif child == pgid or pgid not in processes:
+                group_starts[pgid] = min(start, group_starts.get(pgid, start))
+            else:
+                group_starts.setdefault(pgid, processes[pgid][1])
+    groups = [pgid for pgid, start in group_starts.items() if start >= since]
+    return groups, pids
+
+def _children_counters(pid):
+    """
+    Usage counters of the finished children of a process, from /proc (None
+    if unavailable): CPU time and, when readable, the bytes read and written.
+    /proc keeps no peak memory or context switches for children.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+        # cutime and cstime are fields 16 and 17, in clock ticks
+        ticks = os.sysconf("SC_CLK_TCK")
+        counters = {"user_time": int(fields[13]) / ticks, "system_time": int(fields[14]) / ticks}
+    except (OSError, IndexError, ValueError):
+        return None
+    
+    # The I/O counters include the children the process has reaped
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            io = dict(line.split(": ") for line in f.read().splitlines())
+        counters["read_bytes"] = int(io["read_bytes"])
+        counters["write_bytes"] = int(io["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        pass
+    return counters
+
+def get_session():
+    """Return the shell session of this process"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = ShellSession()
+            atexit.register(_session.close)
+        return _session
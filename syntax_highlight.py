@@ -0,0 +1,99 @@
+from functools import lru_cache
+from html import escape
+
+# Pygments is optional; without it code blocks are shown as plain monospace text
+try:
+    from pygments.lexers import get_lexer_by_name
+    from pygments.styles import get_style_by_name
+    from pygments.util import ClassNotFound
+    PYGMENTS_AVAILABLE = True
+except ImportError:
+    PYGMENTS_AVAILABLE = False
+
+# Pygments style used for the token colors (light, to match the code block background)
+STYLE_NAME = "default"
+
+# Number of highlighted blocks kept in the cache
+CACHE_SIZE = 256
+
+# Common fence tags that Pygments doesn't know under that name
+LANGUAGE_ALIASES = {
+    "sh": "bash",
+    "shell": "bash",
+    "zsh": "bash",
+    "console": "bash",
+    "py": "python",
+    "py3": "python",
+    "yml": "yaml",
+    "conf": "ini",
+    "cfg": "ini",
+}
+
+def highlight(code, lang):
+    """Return Pango markup for a code block, highlighted for the given language"""
+    # Cache on the exact (language, content) pair so a finished block is only
+    # highlighted once, however often the surrounding message is re-rendered
+    return _highlight_cached((lang or "").lower(), code)
+
+def plain(code):
+    """Return Pango markup for a code block without highlighting"""
+    return escape(code, quote=False)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _highlight_cached(lang, code):
+    """Highlight a code block (cached)"""
+    lexer = _get_lexer(lang)
+    if lexer is None:
+        return plain(code)
+    
+    try:
+        styles = _get_token_styles()
+        parts = []
+        for token_type, value in lexer.get_tokens(code):
+            if not value:
+                continue
+            value = escape(value, quote=False)
+            
+            # Look up the style of the token, falling back to its parent types
+            attrs = None
+            while token_type is not None:
+                attrs = styles.get(token_type)
+                if attrs is not None:
+                    break
+                token_type = token_type.parent
+            
+            # Whitespace needs no color, leave it out of the spans to keep the markup small
+            if attrs and not value.isspace():
+                parts.append(f'<span {attrs}>{value}</span>')
+            else:
+                parts.append(value)
+        return "".join(parts)
+    except Exception as e:
+        print(f"DEBUG - Error highlighting {lang} code block: {e}")
+        return plain(code)
+
+@lru_cache(maxsize=64)
+def _get_lexer(lang):
+    """Find the Pygments lexer for a fence tag, or None"""
+    if not PYGMENTS_AVAILABLE or not lang:
+        return None
+    try:
+        # Keep the code exactly as written, including leading/trailing newlines
+        return get_lexer_by_name(LANGUAGE_ALIASES.get(lang, lang), stripnl=False, ensurenl=False)
+    except ClassNotFound:
+        return None
+
+@lru_cache(maxsize=1)
+def _get_token_styles():
+    """Build the Pango span attributes for every token type of the style"""
+    styles = {}
+    for token_type, style in get_style_by_name(STYLE_NAME):
+        attrs = []
+        if style["color"]:
+            attrs.append(f'foreground="#{style["color"]}"')
+        if style["bold"]:
+            attrs.append('weight="bold"')
+        if style["italic"]:
+            attrs.append('style="italic"')
+        styles[token_type] = " ".join(attrs)
+    return styles
@@ -5,19 +5,44 @@ import gi
 import threading
 import os
 import time
-import select
-import fcntl
+import concurrent.futures
 
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 from gi.repository import Gtk, Adw, GLib
 
+from command_runner import (run_streaming, ProcessHandle, command_timeout, output_limit,
+                            MODE_PIPE, MODE_PTY)
+from command_result import CommandResult
+from output_buffer import CaptureBuffer, SPILL_DIR
+from config import get_config
+from shell_session import get_session
+from jobs import JOBS, is_background_command, strip_background
+from command_store import CommandStore
+from command_cache import CommandCache
+
 # Global flag to control command execution
 REQUIRE_CONFIRMATION = True
-PENDING_COMMANDS = {}
+
+# Commands waiting for confirmation, and recently confirmed or canceled ones
+PENDING_COMMANDS = CommandStore("pending commands")
+
+# Characters that make a cd line more than a plain "cd [directory]"
+CD_UNSAFE_CHARS = set(";&|<>`()\n")
+
+# Directory before the last in-process cd, for "cd -"
+_previous_directory = None
+
+# The command cache, used only when "command_cache" is enabled in the config
+COMMAND_CACHE = CommandCache(ttl=get_config("command_cache_ttl", 60))
 
 def execute_command(command, timeout=None, require_confirmation=None, parent_widget=None):
-    """Execute a terminal command and return the output"""
+    """
+    Execute a terminal command and return a CommandResult.
+    
+    When confirmation is required the command is not run; a COMMAND_PENDING
+    message with the ID of the pending command is returned instead.
+    """
     print(f"DEBUG - execute_command called with: {command}")
     traceback.print_stack()  # This will show us the call stack
     
@@ -39,264 +64,345 @@ def execute_command(command, timeout=None, require_confirmation=None, parent_wid
         # Return a placeholder message
         return f"COMMAND_PENDING:{command_id}:Command '{command}' requires user confirmation."
     
-    # Check if the command is a cd command
-    if command.strip().startswith("cd "):
-        return handle_cd_command(command)
-    
-    # Check if the command needs sudo
-    if command.strip().startswith("sudo "):
-        return execute_sudo_command(command, timeout, parent_widget)
+    # A trailing "&" runs the command as a background job
+    if is_background_command(command):
+        return start_background_job(strip_background(command))
     
     # If confirmation is not required or has been given, execute the command
-    try:
-        # Run the command and capture output
-        result = subprocess.run(
-            command,
-            shell=True,
-            text=True,
-            capture_output=True,
-            timeout=timeout
-        )
-        
-        # Combine stdout and stderr
-        output = result.stdout
-        
-        if result.stderr:
-            if output:
-                output += "\n" + result.stderr
-            else:
-                output = result.stderr
-        
-        # If no output, indicate success
-        if not output:
-            output = f"Command executed successfully (exit code: {result.returncode})"
-        
-        return output
-    except subprocess.TimeoutExpired:
-        return f"Command timed out after {timeout} seconds"
-    except Exception as e:
-        return f"Error executing command: {str(e)}"
+    if timeout is None:
+        timeout = command_timeout()
+    output = CaptureBuffer(spill_dir=SPILL_DIR)
+    
+    # sudo reads the password on stdin, so it runs in a one-shot shell
+    if is_sudo_command(command):
+        return execute_sudo_command(command, parent_widget, output=output, timeout=timeout,
+                                    max_output=output_limit())
+    
+    result = run_in_session(command, output=output, timeout=timeout, max_output=output_limit())
+    if result is None:
+        if is_cd_command(command):
+            # Without the session, cd has to change the directory of lmTerm itself
+            text = handle_cd_command(command)
+            result = CommandResult.from_text(command, text, exit_code=0 if text.startswith("Changed") else 1)
+        else:
+            result = run_streaming(command, output=output, timeout=timeout, max_output=output_limit())
+    refresh_prompt(parent_widget)
+    return result
+
+def refresh_prompt(parent_widget):
+    """
+    Have the window show the working directory after a command, which any
+    command in the shell session may have changed (cd, pushd, a script...)
+    """
+    if parent_widget is not None and hasattr(parent_widget, 'update_prompt'):
+        GLib.idle_add(parent_widget.update_prompt)
+
+def run_in_session(command, on_output=None, output=None, timeout=None, handle=None, max_output=None):
+    """
+    Run a command in the persistent shell session.
+    
+    Returns None when the session is disabled in the config, busy with another
+    command or can't be started; the caller then runs the command in a
+    one-shot shell instead.
+    """
+    if not get_config("shell_session", True):
+        return None
+    return get_session().run(command, on_output=on_output, output=output, timeout=timeout,
+                             handle=handle, max_output=max_output)
 
-def stream_command(command, parent_widget=None, command_row=None):
-    """Execute a command and stream the output to the command_row"""
+def session_environment(mode):
+    """
+    The environment a command would run in, for the command cache: that of the
+    shell session when the command would run there, else None (lmTerm's own).
+    """
+    if mode != MODE_PIPE or not get_config("shell_session", True):
+        return None
+    session = get_session()
+    return None if session.busy else session.environment
+
+def stream_command(command, parent_widget=None, command_row=None, use_cache=True):
+    """
+    Execute a command once, stream its output to the command_row and return a CommandResult.
+    
+    With the command cache enabled, a fresh cached result of a read-only command
+    is returned instead of running it again, unless use_cache is False.
+    """
     print(f"DEBUG - stream_command called with: {command}")
     
+    cache_enabled = get_config("command_cache", False)
+    cwd = os.getcwd()
+    
+    # Run in a pty or on pipes, as chosen for the row or in the config
+    mode = get_config("execution_mode", MODE_PIPE)
+    terminal_size = None
+    if command_row:
+        if command_row.use_pty is not None:
+            mode = MODE_PTY if command_row.use_pty else MODE_PIPE
+        terminal_size = command_row.terminal_size
+    
+    if cache_enabled and use_cache:
+        cached = COMMAND_CACHE.get(command, cwd, session_environment(mode))
+        if cached is not None:
+            print(f"DEBUG - Using cached result for: {command}")
+            if command_row:
+                GLib.idle_add(command_row.show_cached_result, cached)
+            return cached
+    
+    # The paths the command involves as they were before it ran, for the cache entry
+    snapshot = COMMAND_CACHE.snapshot(command, cwd) if cache_enabled else None
+    
+    # A trailing "&" runs the command as a background job that keeps streaming into the row
+    if is_background_command(command):
+        return start_background_job(strip_background(command), command_row)
+    
     # Make sure the command output box is visible immediately
     if command_row:
+        GLib.idle_add(command_row.set_output_cached, None)
+        GLib.idle_add(command_row.set_usage, None)
         GLib.idle_add(command_row.set_command_output, "Running command...\n")
     
-    # Check if the command is a cd command
-    if command.strip().startswith("cd "):
-        result = handle_cd_command(command)
-        if command_row:
-            GLib.idle_add(command_row.set_command_output, result)
-        return result
+    # Send new output to the UI as deltas, coalesced into one update per idle
+    forwarder = OutputForwarder(command_row) if command_row else None
     
-    # Check if the command needs sudo
-    if command.strip().startswith("sudo "):
-        result = execute_sudo_command(command, timeout=None, parent_widget=parent_widget)
+    # Memory keeps only the head and tail of the output, the rest goes to a spill file
+    capture = CaptureBuffer(spill_dir=SPILL_DIR)
+    if command_row:
+        GLib.idle_add(command_row.set_output_spill, capture)
+    
+    # Without the session, cd has to change the directory of lmTerm itself
+    if is_cd_command(command) and (mode != MODE_PIPE or not get_config("shell_session", True) or get_session().busy):
+        text = handle_cd_command(command)
         if command_row:
-            GLib.idle_add(command_row.set_command_output, result)
-        return result
+            GLib.idle_add(command_row.set_command_output, text)
+        refresh_prompt(parent_widget)
+        return CommandResult.from_text(command, text, exit_code=0 if text.startswith("Changed") else 1)
     
-    # Initialize output buffer
-    output_buffer = "Running command...\n"
+    # The row's Stop button stops the command through this handle
+    handle = ProcessHandle()
+    if command_row:
+        GLib.idle_add(command_row.set_process_handle, handle)
     
+    # Stream output while the process is running, in the shell session if it's free;
+    # pty mode always uses a one-shot shell, since the session runs on pipes
+    on_output = forwarder.send if forwarder else None
+    limits = dict(timeout=command_timeout(), handle=handle, max_output=output_limit())
     try:
-        # Start the process
-        process = subprocess.Popen(
-            command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,  # Line buffered
-            universal_newlines=True
-        )
-        
-        # Set stdout and stderr to non-blocking mode
-        for pipe in [process.stdout, process.stderr]:
-            fd = pipe.fileno()
-            fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-            fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-        
-        # Stream output while the process is running
-        last_update_time = time.time()
-        stdout_data = ""
-        stderr_data = ""
-        
-        while process.poll() is None:
-            # Check for output on stdout and stderr
-            ready_to_read, _, _ = select.select([process.stdout, process.stderr], [], [], 0.1)
-            
-            new_output = False
-            for pipe in ready_to_read:
-                try:
-                    if pipe == process.stdout:
-                        chunk = process.stdout.read()
-                        if chunk:
-                            stdout_data += chunk
-                            output_buffer += chunk
-                            new_output = True
-                    elif pipe == process.stderr:
-                        chunk = process.stderr.read()
-                        if chunk:
-                            stderr_data += chunk
-                            output_buffer += chunk
-                            new_output = True
-                except (IOError, OSError):
-                    pass
-            
-            # Update the UI if we have new output or every second
-            current_time = time.time()
-            if new_output or (current_time - last_update_time) >= 1.0:
-                if command_row:
-                    GLib.idle_add(command_row.set_command_output, output_buffer)
-                last_update_time = current_time
-            
-            # Small sleep to prevent CPU hogging
-            time.sleep(0.01)
-        
-        # Read any remaining output
-        remaining_stdout, remaining_stderr = process.communicate()
-        if remaining_stdout:
-            stdout_data += remaining_stdout
-            output_buffer += remaining_stdout
-        if remaining_stderr:
-            stderr_data += remaining_stderr
-            output_buffer += remaining_stderr
-        
-        # If no output beyond the initial message, show the command result
-        if output_buffer == "Running command...\n":
-            # Try to get the command output directly
-            try:
-                result = subprocess.run(
-                    command,
-                    shell=True,
-                    text=True,
-                    capture_output=True,
-                    timeout=5  # Short timeout for direct execution
-                )
-                if result.stdout:
-                    output_buffer += result.stdout
-                if result.stderr:
-                    output_buffer += result.stderr
-                
-                # If still no output, indicate success
-                if output_buffer == "Running command...\n":
-                    output_buffer = f"Command executed successfully (exit code: {process.returncode})"
-            except:
-                output_buffer = f"Command executed successfully (exit code: {process.returncode})"
-        else:
-            # Add exit code information
-            output_buffer += f"\n\nCommand completed with exit code: {process.returncode}"
-        
-        # Final update to the command output
-        if command_row:
-            GLib.idle_add(command_row.set_command_output, output_buffer)
-        
-        return output_buffer
-    except Exception as e:
-        error_message = f"Error executing command: {str(e)}"
+        result = None
+        if is_sudo_command(command):
+            # sudo reads the password on stdin, so it runs in a one-shot shell
+            result = execute_sudo_command(command, parent_widget, on_output=on_output, output=capture,
+                                          mode=mode, terminal_size=terminal_size, **limits)
+        elif mode == MODE_PIPE:
+            result = run_in_session(command, on_output=on_output, output=capture, **limits)
+        if result is None:
+            result = run_streaming(command, on_output=on_output, output=capture,
+                                   mode=mode, terminal_size=terminal_size, **limits)
+    finally:
         if command_row:
-            GLib.idle_add(command_row.set_command_output, error_message)
-        return error_message
+            GLib.idle_add(command_row.set_process_handle, None)
+    
+    # Finish the output with how the command ended
+    if command_row:
+        GLib.idle_add(command_row.set_usage, result.usage_line() if result.usage is not None else None)
+        if result.error is not None:
+            GLib.idle_add(command_row.set_command_output, result.status_line())
+        elif result.get_output():
+            forwarder.send(f"\n\n{result.status_line()}")
+        else:
+            GLib.idle_add(command_row.set_command_output, result.to_tool_result())
+    
+    if cache_enabled:
+        COMMAND_CACHE.put(command, cwd, result, snapshot)
+    
+    refresh_prompt(parent_widget)
+    return result
 
-def execute_sudo_command(command, timeout=30, parent_widget=None):
-    """Execute a sudo command with password prompt"""
-    # Create a dialog to ask for the sudo password
-    password = None
-    password_result = []  # Use a list to store the result across threads
+def start_background_job(command, command_row=None):
+    """
+    Start a command as a background job and return a CommandResult saying so.
     
-    def show_password_dialog():
-        dialog = Adw.MessageDialog.new(parent_widget.get_root() if parent_widget else None,
-                                      "Sudo Password Required",
-                                      f"The command '{command}' requires sudo privileges.")
-        
-        # Add password entry
-        password_entry = Gtk.PasswordEntry()
-        password_entry.set_show_peek_icon(True)
-        password_entry.set_margin_top(10)
-        password_entry.set_margin_bottom(10)
-        password_entry.set_margin_start(10)
-        password_entry.set_margin_end(10)
-        
-        # Add the password entry to the dialog
-        dialog.set_extra_child(password_entry)
-        
-        # Add buttons
-        dialog.add_response("cancel", "Cancel")
-        dialog.add_response("ok", "OK")
-        dialog.set_default_response("ok")
-        dialog.set_response_appearance("ok", Adw.ResponseAppearance.SUGGESTED)
-        
-        # Connect to the response signal
-        def on_response(dialog, response):
-            if response == "ok":
-                password_result.append(password_entry.get_text())
-            dialog.destroy()
-        
-        dialog.connect("response", on_response)
-        
-        # Show the dialog
-        dialog.present()
+    The job's output streams into the command_row until the job ends, while
+    the caller (and the agent) can move on.
+    """
+    forwarder = OutputForwarder(command_row) if command_row else None
     
-    # Show the dialog in the main thread
-    GLib.idle_add(show_password_dialog)
+    def on_exit(job):
+        if forwarder:
+            forwarder.send(f"\n\n[{job.id}] {job.result.status_line()}")
     
-    # Wait for the password to be entered
-    max_wait = 60  # Maximum wait time in seconds
-    wait_interval = 0.1
-    waited = 0
+    job = JOBS.create(command, on_output=forwarder.send if forwarder else None, on_exit=on_exit)
+    if command_row:
+        GLib.idle_add(command_row.set_output_cached, None)
+        GLib.idle_add(command_row.set_output_spill, job.output)
+        GLib.idle_add(command_row.set_command_output, f"[{job.id}] Running in the background: {command}\n\n")
+    job.start()
+    
+    if job.result is not None and job.result.error is not None:
+        return job.result
+    text = (f"Started background job {job.id} (PID {job.pid}): {command}\n"
+            f"Use job_output with job_id {job.id} to read its output.")
+    return CommandResult.from_text(command, text, exit_code=0)
+
+class OutputForwarder:
+    """
+    Forwards streamed output to a command row on the main thread.
     
-    while not password_result and waited < max_wait:
-        time.sleep(wait_interval)
-        waited += wait_interval
+    Text sent from the reader thread is collected until the main loop gets to
+    it, so a fast command causes one append per idle instead of one per read.
+    """
+    
+    def __init__(self, command_row):
+        self.command_row = command_row
+        self._lock = threading.Lock()
+        self._pending = []
+        self._scheduled = False
+    
+    def send(self, text):
+        """Queue text for the row (called from the reader thread)"""
+        with self._lock:
+            self._pending.append(text)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        GLib.idle_add(self._flush)
+    
+    def _flush(self):
+        """Append everything queued so far to the row (main thread)"""
+        with self._lock:
+            text = "".join(self._pending)
+            self._pending = []
+            self._scheduled = False
+        self.command_row.append_command_output(text)
+        return False
+
+def is_sudo_command(command):
+    """Check if a command has to be run with sudo"""
+    return command.strip().startswith("sudo ")
+
+def request_sudo_password(command, parent_widget=None):
+    """
+    Ask for the sudo password in a dialog and wait for the answer.
+    
+    The dialog runs on the main thread and hands the password back through a
+    future, so the calling thread blocks until the user answers; it must not
+    be the main thread, which would then never show the dialog. Returns the
+    password, or None if the dialog was cancelled, closed or left unanswered
+    for "sudo_password_timeout" seconds (default 300).
+    """
+    if threading.current_thread() is threading.main_thread():
+        raise RuntimeError("request_sudo_password() blocks, it can't be called from the main thread")
+    answer = concurrent.futures.Future()
+    
+    # The dialog once shown, to close it when the wait times out
+    shown = []
+    
+    def show_password_dialog():
+        if answer.done():
+            # Timed out before the main loop got here
+            return False
+        try:
+            dialog = Adw.MessageDialog.new(parent_widget.get_root() if parent_widget else None,
+                                          "Sudo Password Required",
+                                          f"The command '{command}' requires sudo privileges.")
+            
+            # Add password entry
+            password_entry = Gtk.PasswordEntry()
+            password_entry.set_show_peek_icon(True)
+            password_entry.set_margin_top(10)
+            password_entry.set_margin_bottom(10)
+            password_entry.set_margin_start(10)
+            password_entry.set_margin_end(10)
+            
+            # Add the password entry to the dialog
+            dialog.set_extra_child(password_entry)
+            
+            # Add buttons
+            dialog.add_response("cancel", "Cancel")
+            dialog.add_response("ok", "OK")
+            dialog.set_default_response("ok")
+            dialog.set_close_response("cancel")
+            dialog.set_response_appearance("ok", Adw.ResponseAppearance.SUGGESTED)
+            
+            # Enter in the entry confirms the dialog
+            password_entry.connect("activate", lambda entry: dialog.response("ok"))
+            
+            # Every way of closing the dialog answers the waiting thread
+            def on_response(dialog, response):
+                if not answer.done():
+                    answer.set_result(password_entry.get_text() if response == "ok" else None)
+                dialog.destroy()
+            
+            dialog.connect("response", on_response)
+            
+            # Show the dialog
+            dialog.present()
+            shown.append(dialog)
+        except Exception as e:
+            print(f"DEBUG - Could not show the sudo password dialog: {e}")
+            if not answer.done():
+                answer.set_result(None)
+        return False
     
-    if not password_result:
-        return "Password entry timed out or was cancelled."
+    def close_password_dialog():
+        for dialog in shown:
+            dialog.close()
+        return False
     
-    password = password_result[0]
+    # Show the dialog in the main thread and wait for its answer
+    GLib.idle_add(show_password_dialog)
+    try:
+        return answer.result(timeout=get_config("sudo_password_timeout", 300))
+    except concurrent.futures.TimeoutError:
+        print("DEBUG - No answer to the sudo password dialog, giving up")
+        answer.cancel()
+        GLib.idle_add(close_password_dialog)
+        return None
+
+def sudo_credentials_cached():
+    """Check if sudo currently runs without a password (cached credentials or NOPASSWD)"""
+    try:
+        check = subprocess.run(["sudo", "-n", "true"], stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return check.returncode == 0
+
+def execute_sudo_command(command, parent_widget=None, **kwargs):
+    """
+    Run a "sudo ..." command through run_streaming and return a CommandResult.
     
-    # Execute the command with the provided password
+    The keyword arguments (on_output, output, timeout, handle, ...) are passed
+    to run_streaming, so sudo commands stream and stop like any other command.
+    With "sudo_use_timestamp" (the default) sudo's cached credentials are
+    used while they are valid and the password is only asked for when sudo
+    needs it; otherwise it is asked for on every call. The password reaches
+    sudo on stdin, never on the command line.
+    """
+    use_timestamp = get_config("sudo_use_timestamp", True)
     try:
-        # Remove 'sudo' from the command as we'll use it with sudo -S
-        cmd = command.replace("sudo ", "", 1)
-        
-        # Use sudo -S to read password from stdin
-        process = subprocess.Popen(
-            ["sudo", "-S"] + shlex.split(cmd),
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        
-        # Send the password to stdin
-        stdout, stderr = process.communicate(input=password + "\n", timeout=timeout)
-        
-        # Combine stdout and stderr
-        output = stdout
-        
-        if stderr:
-            # Filter out the password prompt message
-            filtered_stderr = "\n".join([line for line in stderr.split("\n") 
-                                        if not line.startswith("[sudo] password for")])
-            if filtered_stderr:
-                if output:
-                    output += "\n" + filtered_stderr
-                else:
-                    output = filtered_stderr
-        
-        # If no output, indicate success
-        if not output:
-            output = f"Command executed successfully (exit code: {process.returncode})"
-        
-        return output
-    except subprocess.TimeoutExpired:
-        return f"Command timed out after {timeout} seconds"
-    except Exception as e:
-        return f"Error executing command: {str(e)}"
+        # Like before, the words after sudo are its arguments, not a shell command line
+        arguments = shlex.split(command)[1:]
+    except ValueError as e:
+        return CommandResult(command, error=f"Could not parse the command: {e}")
+    
+    password = None
+    if not (use_timestamp and sudo_credentials_cached()):
+        password = request_sudo_password(command, parent_widget)
+        if password is None:
+            return CommandResult(command, error="Password entry was cancelled")
+    
+    if password is None:
+        flags = ["-n"]
+    else:
+        # No prompt in the output; -k makes sudo ignore (and not rely on) cached credentials
+        flags = ["-S", "-p", ""] + ([] if use_timestamp else ["-k"])
+    
+    # exec makes sudo a direct child of lmTerm, so the credentials it caches
+    # (per parent process when there is no terminal) are found on the next call
+    command_line = "exec " + shlex.join(["sudo"] + flags + arguments)
+    result = run_streaming(command_line, input_text=password + "\n" if password is not None else None, **kwargs)
+    result.command = command
+    return result
 
 def confirm_command(command_id, parent_widget=None, stream=False, command_row=None):
     """Execute a command that was previously deferred"""
@@ -313,9 +419,8 @@ def confirm_command(command_id, parent_widget=None, stream=False, command_row=No
         else:
             result = execute_command(command, timeout=None, require_confirmation=False, parent_widget=parent_widget)
         
-        # Update with result
-        command_info["result"] = result
-        command_info["status"] = "completed"
+        # Update with result (kept by reference, the row holds the output)
+        PENDING_COMMANDS.complete(command_id, result)
         
         return result
     else:
@@ -330,14 +435,36 @@ def cancel_command(command_id):
     else:
         return "Error: Command not found"
 
+def is_cd_command(command):
+    """Check if a command is a plain "cd [directory]" that can be handled in-process"""
+    if CD_UNSAFE_CHARS & set(command):
+        return False
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        return False
+    return len(words) in (1, 2) and words[0] == "cd"
+
 def handle_cd_command(command):
     """Handle the cd command by changing the current working directory"""
-    # Extract the target directory
-    target_dir = command.strip()[3:].strip()
+    global _previous_directory
+    
+    # Extract the target directory; like the shell, no argument means home and "-" the previous one
+    words = shlex.split(command)
+    if len(words) < 2:
+        target_dir = os.path.expanduser("~")
+    elif words[1] == "-":
+        if _previous_directory is None:
+            return "Error changing directory: no previous directory"
+        target_dir = _previous_directory
+    else:
+        target_dir = os.path.expanduser(os.path.expandvars(words[1]))
     
     try:
         # Change the directory
+        current_dir = os.getcwd()
         os.chdir(target_dir)
+        _previous_directory = current_dir
         
         # Return the new working directory
         return f"Changed directory to: {os.getcwd()}"
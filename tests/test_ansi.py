@@ -0,0 +1,47 @@
+from ansi import AnsiParser, DEFAULT_STYLE, PALETTE, strip_ansi
+
+def styled_characters(chunks):
+    """Feed the chunks to a new parser; returns (plain text, style of every character)"""
+    parser = AnsiParser()
+    text = ""
+    styles = []
+    for chunk in chunks:
+        plain, runs = parser.feed(chunk)
+        chunk_styles = [DEFAULT_STYLE] * len(plain)
+        for start, end, style in runs:
+            chunk_styles[start:end] = [style] * (end - start)
+        text += plain
+        styles += chunk_styles
+    return text, styles
+
+def test_colors_and_reset():
+    text, styles = styled_characters(["plain \x1b[1;31mred\x1b[0m done"])
+    assert text == "plain red done"
+    assert styles[0] == DEFAULT_STYLE
+    assert styles[6].foreground == PALETTE[1] and styles[6].bold
+    assert styles[-1] == DEFAULT_STYLE
+
+def test_escapes_split_at_every_position():
+    output = "a\x1b[38;5;208morange\x1b[0m \x1b]0;title\x07b\x1b[2Kc\x1b[4munder\x1b[24m"
+    expected = styled_characters([output])
+    assert expected[0] == "aorange bcunder"
+    for split in range(len(output) + 1):
+        assert styled_characters([output[:split], output[split:]]) == expected, split
+
+def test_escapes_one_character_at_a_time():
+    output = "\x1b[32mgreen\x1b[0m \x1b[1mbold\x1b[22m"
+    assert styled_characters(list(output)) == styled_characters([output])
+
+def test_style_carries_over_chunks():
+    parser = AnsiParser()
+    parser.feed("\x1b[34m")
+    text, runs = parser.feed("blue")
+    assert text == "blue" and runs == [(0, 4, parser.style)]
+    assert parser.style.foreground == PALETTE[4]
+
+def test_private_sequences_are_dropped():
+    assert styled_characters(["\x1b[>4mtext\x1b[?25h"]) == ("text", [DEFAULT_STYLE] * 4)
+
+def test_strip_ansi():
+    assert strip_ansi("\x1b[31mred\x1b[0m \x1b]8;;http://x\x1b\\link\x1b]8;;\x1b\\") == "red link"
+    assert strip_ansi("no escapes") == "no escapes"
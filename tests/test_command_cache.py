@@ -0,0 +1,149 @@
+import os
+
+import pytest
+
+from command_cache import CommandCache
+from command_result import CommandResult
+from output_buffer import OutputBuffer
+
+@pytest.mark.parametrize("command", [
+    "ls -la",
+    "cat README.md | grep cache | sort -u | uniq -c",
+    "sort -rn data.txt",
+    "uniq data.txt",
+    "git log --oneline -5",
+    "git ls-files -s",
+    "grep -in pattern data.txt",
+    "cat *.txt",
+    "git branch",
+    "git branch -a",
+    "git branch --list",
+    "git remote",
+    "git remote -v",
+])
+def test_read_only(command):
+    assert CommandCache.is_read_only(command)
+
+@pytest.mark.parametrize("command", [
+    "",
+    "rm -rf build",
+    "ls > listing.txt",
+    "cat a; rm a",
+    "echo $(rm a)",
+    "git",
+    "git commit -m message",
+    "git branch new-feature",
+    "git branch -D old-feature",
+    "git branch -m old new",
+    "git remote add origin url",
+    "git remote remove origin",
+    "git remote -v add origin url",
+    "git diff --output=changes.patch",
+    "git log --output changes.txt",
+    "git -C elsewhere status",
+    "git status",
+    "git diff HEAD",
+    "git ls-files -m",
+    "git ls-files --others",
+    "grep -r pattern .",
+    "grep -inR pattern src",
+    "grep --recursive pattern",
+    "grep -d recurse pattern .",
+    "ls -lR",
+    "ls --recursive",
+    "du -sh .",
+    "sort -o data.txt data.txt",
+    "sort -uo data.txt data.txt",
+    "sort --output=data.txt data.txt",
+    "cat data.txt | sort -o sorted.txt",
+    "uniq input.txt output.txt",
+    "uniq - output.txt",
+    "cat 'unterminated",
+])
+def test_not_read_only(command):
+    assert not CommandCache.is_read_only(command)
+
+def make_result(command, text="output\n", environment=None):
+    """A successful result with the given output"""
+    result = CommandResult(command, exit_code=0, output=OutputBuffer(text))
+    result.environment = environment
+    return result
+
+def test_hit_and_invalidation(tmp_path):
+    path = tmp_path / "data.txt"
+    path.write_text("one\n")
+    cache = CommandCache()
+    command = "cat data.txt"
+    
+    snapshot = cache.snapshot(command, str(tmp_path))
+    cache.put(command, str(tmp_path), make_result(command), snapshot)
+    cached = cache.get(command, str(tmp_path))
+    assert cached is not None and cached.cache_age is not None
+    
+    path.write_text("two\n")
+    os.utime(path, ns=(0, 0))
+    assert cache.get(command, str(tmp_path)) is None
+
+def test_change_during_run_is_not_missed(tmp_path):
+    path = tmp_path / "data.txt"
+    path.write_text("one\n")
+    cache = CommandCache()
+    command = "cat data.txt"
+    
+    # The file changes after the snapshot but before the result is stored
+    snapshot = cache.snapshot(command, str(tmp_path))
+    os.utime(path, ns=(0, 0))
+    cache.put(command, str(tmp_path), make_result(command), snapshot)
+    assert cache.get(command, str(tmp_path)) is None
+
+def test_keyed_on_session_environment(tmp_path):
+    cache = CommandCache()
+    command = "ls"
+    session = dict(os.environ, LANG="C.session")
+    
+    # Stored for the session's environment, found only with it
+    cache.put(command, str(tmp_path), make_result(command, environment=session),
+              cache.snapshot(command, str(tmp_path)))
+    assert cache.get(command, str(tmp_path)) is None
+    assert cache.get(command, str(tmp_path), session) is not None
+
+def test_not_stored(tmp_path):
+    cache = CommandCache()
+    failed = CommandResult("ls", exit_code=None, error="could not run", output=OutputBuffer(""))
+    cache.put("ls", str(tmp_path), failed, cache.snapshot("ls", str(tmp_path)))
+    cache.put("rm x", str(tmp_path), make_result("rm x"), cache.snapshot("rm x", str(tmp_path)))
+    assert cache.get("ls", str(tmp_path)) is None
+    assert cache.snapshot("rm x", str(tmp_path)) is None
+
+def edit_in_place(path, text):
+    """Rewrite a file without touching its directory, with a distinct mtime"""
+    with open(path, "r+") as f:
+        f.write(text)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+@pytest.mark.parametrize("command", ["cat data.txt", "wc -l *.txt", "ls -l", "ls -l sub"])
+def test_edited_file_is_a_miss(tmp_path, command):
+    (tmp_path / "sub").mkdir()
+    for directory in (tmp_path, tmp_path / "sub"):
+        (directory / "data.txt").write_text("one\n")
+    cache = CommandCache()
+    cache.put(command, str(tmp_path), make_result(command), cache.snapshot(command, str(tmp_path)))
+    assert cache.get(command, str(tmp_path)) is not None
+    
+    edited = tmp_path / "sub" / "data.txt" if command.endswith("sub") else tmp_path / "data.txt"
+    edit_in_place(edited, "two\n")
+    assert cache.get(command, str(tmp_path)) is None
+
+def test_commit_is_a_miss(tmp_path):
+    git_dir = tmp_path / ".git"
+    (git_dir / "refs" / "heads").mkdir(parents=True)
+    (git_dir / "HEAD").write_text("ref: refs/heads/main\n")
+    (git_dir / "refs" / "heads" / "main").write_text("a" * 40 + "\n")
+    cache = CommandCache()
+    command = "git log --oneline"
+    cache.put(command, str(tmp_path), make_result(command), cache.snapshot(command, str(tmp_path)))
+    assert cache.get(command, str(tmp_path)) is not None
+    
+    edit_in_place(git_dir / "refs" / "heads" / "main", "b" * 40)
+    assert cache.get(command, str(tmp_path)) is None
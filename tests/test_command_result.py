@@ -0,0 +1,16 @@
+from command_result import ResourceUsage
+
+def test_summary_of_a_full_measure():
+    usage = ResourceUsage(1.5, 0.25, max_rss=2 * 1024 * 1024, read_bytes=0, write_bytes=4096,
+                          voluntary_switches=10, involuntary_switches=2)
+    summary = usage.summary()
+    assert summary.startswith("CPU 1.75s (1.50 user, 0.25 sys)")
+    assert "max RSS" in summary and "12 context switches" in summary
+    assert "not measured" not in summary
+
+def test_summary_names_what_was_not_measured():
+    # What the shell session can measure
+    summary = ResourceUsage(0.5, 0.0, read_bytes=0, write_bytes=0).summary()
+    assert summary.endswith("max RSS and context switches not measured")
+    assert "0 context switches" not in summary
+    assert "disk I/O" not in summary
@@ -0,0 +1,32 @@
+import time
+
+from command_store import CommandStore
+
+def test_pending_entries_are_never_evicted():
+    store = CommandStore("test", max_entries=3, ttl=60)
+    for key in "abcd":
+        store[key] = {"status": "pending"}
+    assert len(store) == 4 and store.evicted == 0
+    
+    # Only finished entries make room, even a new one
+    store["e"] = {"status": "completed"}
+    assert "e" not in store and store.evicted == 1
+    assert all(key in store for key in "abcd")
+
+def test_lru_eviction_of_finished_entries():
+    store = CommandStore("test", max_entries=2, ttl=60)
+    store["a"] = {"status": "completed"}
+    store["b"] = {"status": "completed"}
+    store.get("a")
+    store["c"] = {"status": "completed"}
+    assert "a" in store and "c" in store and "b" not in store
+    assert store.evicted == 1
+
+def test_finished_entries_expire():
+    store = CommandStore("test", max_entries=10, ttl=0.05)
+    store["done"] = {"status": "pending"}
+    store["waiting"] = {"status": "pending"}
+    store.complete("done", "output")
+    time.sleep(0.1)
+    assert "done" not in store
+    assert store.get("waiting") == {"status": "pending"}
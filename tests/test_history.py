@@ -0,0 +1,265 @@
+import json
+import math
+import random
+import threading
+
+import history
+from history import CWD_BOOST, CommandHistory, HistoryEntry, PrefixIndex, RecencyPositions, TrigramIndex, frecency
+
+def entries(*commands):
+    """History entries for the commands, oldest first, a minute apart"""
+    return [HistoryEntry(command, 1000000 + 60 * i) for i, command in enumerate(commands)]
+
+def open_history(path):
+    """A loaded history on a journal"""
+    commands = CommandHistory(str(path), legacy_path=None)
+    commands.load()
+    assert commands.sync(timeout=5) and commands.loaded.is_set()
+    return commands
+
+def counts(commands):
+    """Command -> number of uses, for comparing instances"""
+    return {command: commands.get(command).count for command in commands.commands()}
+
+def test_recency_positions_match_a_list():
+    rng = random.Random(0)
+    expected = []
+    positions = RecencyPositions()
+    # Enough uses to renumber the slots several times
+    for _ in range(20000):
+        command = f"command {rng.randrange(2000)}"
+        position = expected.index(command) if command in expected else -1
+        if rng.random() < 0.1:
+            assert positions.remove(command) == position
+        else:
+            assert positions.position(command) == position
+            positions.remove(command)
+            positions.append(command)
+            expected.append(command)
+        if position >= 0:
+            del expected[position]
+    assert len(positions) == len(expected)
+    assert [positions.position(command) for command in expected] == list(range(len(expected)))
+
+def test_recency_positions_rebuild():
+    positions = RecencyPositions(["a", "b", "c"])
+    assert positions.remove("b") == 1
+    assert positions.position("c") == 1
+    positions.append("b")
+    assert positions.position("b") == 2
+    assert positions.remove("missing") == -1
+
+def test_journal_is_read_back(tmp_path):
+    path = tmp_path / "history.jsonl"
+    first = open_history(path)
+    first.add("ls", "/a")
+    first.add("pwd", "/b")
+    first.add("ls", "/c")
+    first.close()
+    
+    # A line cut short by a crash is skipped
+    with open(path, "a") as f:
+        f.write('{"command": "cut sh')
+    second = open_history(path)
+    assert second.commands() == ["pwd", "ls"]
+    assert second.get("ls").count == 2 and second.get("ls").cwd == "/c"
+    second.add("echo")
+    second.close()
+    assert open_history(path).commands() == ["pwd", "ls", "echo"]
+
+def test_recent_commands_are_there_while_loading(tmp_path, monkeypatch):
+    path = tmp_path / "history.jsonl"
+    with open(path, "w") as f:
+        for i in range(200):
+            f.write(json.dumps({"command": f"old {i}", "ts": i}) + "\n")
+        f.write(json.dumps({"command": "recent", "ts": 1000}) + "\n")
+    monkeypatch.setattr(history, "RECENT_TAIL_SIZE", 100)
+    
+    # Hold the reader thread until the history was used
+    release = threading.Event()
+    read_journal = CommandHistory._read_journal
+    def held_read_journal(self):
+        release.wait(5)
+        read_journal(self)
+    monkeypatch.setattr(CommandHistory, "_read_journal", held_read_journal)
+    
+    commands = CommandHistory(str(path), legacy_path=None)
+    commands.load()
+    assert not commands.loaded.is_set()
+    assert commands.commands()[-1] == "recent" and len(commands) < 10
+    commands.add("during load")
+    commands.add("recent")
+    
+    release.set()
+    assert commands.sync(timeout=5) and commands.loaded.is_set()
+    assert len(commands) == 202 and commands.commands()[-2:] == ["during load", "recent"]
+    assert commands.get("recent").count == 2
+    assert commands.search("during") == ["during load"]
+    assert commands.suggest("old 19") == "old 199"
+    commands.close()
+    assert counts(open_history(path)) == counts(commands)
+
+class RecordingIndex:
+    """An index that records the commands it is told about"""
+    
+    def __init__(self):
+        self.calls = []
+    
+    def rebuild(self, entries):
+        self.calls.append(("rebuild", [entry.command for entry in entries]))
+    
+    def add(self, entry):
+        self.calls.append(("add", entry.command))
+    
+    def discard(self, command):
+        self.calls.append(("discard", command))
+
+def test_indexes_are_told_through_dispatch(tmp_path):
+    dispatched = []
+    commands = CommandHistory(str(tmp_path / "history.jsonl"), max_entries=2, legacy_path=None,
+                              dispatch=lambda function, *args: dispatched.append((function, args)))
+    commands.load()
+    commands.sync(timeout=5)
+    index = RecordingIndex()
+    commands.add_index(index)
+    for command in ("a", "b", "a", "c"):
+        commands.add(command)
+    
+    # Nothing reaches the index until the dispatched calls run, then in order
+    assert index.calls == [("rebuild", [])]
+    for function, args in dispatched:
+        function(*args)
+    assert index.calls[1:] == [("add", "a"), ("add", "b"), ("add", "a"), ("add", "c"), ("discard", "b")]
+    commands.close()
+
+def test_refresh_takes_in_other_instances_only(tmp_path):
+    path = tmp_path / "history.jsonl"
+    first = open_history(path)
+    second = open_history(path)
+    first.add("make")
+    first.close()
+    second.add("make test")
+    second.close()
+    
+    # Each one skips the lines it appended itself
+    first.refresh()
+    second.refresh()
+    first.sync()
+    second.sync()
+    assert counts(first) == counts(second) == {"make": 1, "make test": 1}
+    first.refresh()
+    first.sync()
+    assert first.get("make").count == 1
+    assert first.search("test") == ["make test"]
+    assert first.suggest("make ") == "make test"
+
+def test_refresh_runs_on_the_reader_thread(tmp_path, monkeypatch):
+    path = tmp_path / "history.jsonl"
+    reader = open_history(path)
+    writer = open_history(path)
+    writer.add("ls")
+    writer.close()
+    
+    threads = []
+    read_tail = CommandHistory._read_tail
+    def recording_read_tail(self):
+        threads.append(threading.current_thread().name)
+        read_tail(self)
+    monkeypatch.setattr(CommandHistory, "_read_tail", recording_read_tail)
+    
+    # Calls made while one is queued are merged into it
+    for _ in range(3):
+        reader.refresh()
+    reader.sync()
+    assert threads == ["history-reader"]
+    assert reader.commands() == ["ls"]
+
+def test_compaction_is_followed_by_other_instances(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "MIN_COMPACT_LINES", 10)
+    path = tmp_path / "history.jsonl"
+    compacting = open_history(path)
+    other = open_history(path)
+    other.add("from other")
+    other.close()
+    
+    # The journal is only compacted once the other instance's line is read
+    compacting.refresh()
+    compacting.sync()
+    for i in range(30):
+        compacting.add(f"command {i % 3}")
+    compacting._queue.put(None)
+    compacting.close()
+    with open(path) as f:
+        lines = f.readlines()
+    header = json.loads(lines[0])
+    assert "compacted" in header and len(lines) < 31
+    
+    other.refresh()
+    other.sync()
+    expected = {"from other": 1, "command 0": 10, "command 1": 10, "command 2": 10}
+    assert counts(compacting) == counts(other) == expected
+    assert counts(open_history(path)) == expected
+
+def test_trigram_search_order():
+    index = TrigramIndex()
+    index.rebuild(entries("git status", "ls -la", "echo git", "git stash", "grep -i test"))
+    # Commands starting with the query, then the other matches, then fuzzy ones
+    assert index.search("git") == ["git stash", "git status", "echo git", "grep -i test"]
+    assert index.search("STATUS git") == ["git status"]
+    assert index.search("gst") == ["grep -i test", "git stash", "git status"]
+    assert index.search("sta") == ["git stash", "git status"]
+    assert index.search("zz") == []
+    
+    index.add(HistoryEntry("git status", 2000000))
+    assert index.search("git")[:2] == ["git status", "git stash"]
+    index.discard("git status")
+    assert index.search("status") == []
+
+def test_fuzzy_matches_only_among_recent_commands(monkeypatch):
+    monkeypatch.setattr(history, "FUZZY_SCAN_SIZE", 40)
+    index = TrigramIndex()
+    index.rebuild(entries("git status", *(f"echo {i:03d}" for i in range(10))))
+    assert index.search("gst") == []
+    index.add(HistoryEntry("git stash", 2000000))
+    assert index.search("gst") == ["git stash"]
+
+def test_trigram_search_short_words():
+    index = TrigramIndex()
+    index.rebuild(entries("ls", "cd /tmp", "ls -l"))
+    assert index.search("ls") == ["ls -l", "ls"]
+    assert index.search("l -") == ["ls -l"]
+
+def test_prefix_suggestion_by_frecency_and_directory():
+    index = PrefixIndex()
+    status, stash = HistoryEntry("git status", 1000000, "/a", 5), HistoryEntry("git stash", 1000000, "/b")
+    index.rebuild([status, stash])
+    assert index.suggest("git st") == "git status"
+    assert index.suggest("git sta", "/b") == ("git stash" if math.log(CWD_BOOST) > math.log(5) else "git status")
+    assert index.suggest("git status") is None
+    assert index.suggest("") is None
+    assert index.suggest("x") is None
+
+def test_prefix_suggestions_match_a_scan():
+    rng = random.Random(1)
+    known = {}
+    index = PrefixIndex()
+    index.rebuild([])
+    # Enough commands sharing prefixes to split buckets
+    for step in range(3000):
+        command = "".join(rng.choice("ab ") for _ in range(rng.randrange(1, 8)))
+        if rng.random() < 0.05 and command in known:
+            del known[command]
+            index.discard(command)
+            continue
+        entry = known.get(command)
+        if entry is None:
+            entry = known[command] = HistoryEntry(command, step * 100.0)
+        else:
+            entry.count += 1
+            entry.timestamp = step * 100.0
+        index.add(entry)
+    
+    for prefix in ["a", "b", "ab", "a b", "ba", "aa", " ", "bbb", "ab a"]:
+        matches = [entry for entry in known.values() if entry.command.startswith(prefix) and entry.command != prefix]
+        expected = max(matches, key=frecency).command if matches else None
+        assert index.suggest(prefix) == expected, prefix
@@ -0,0 +1,79 @@
+from output_buffer import CaptureBuffer, OutputBuffer
+
+def test_iter_text_streams_the_whole_spilled_output(tmp_path):
+    buffer = CaptureBuffer(head_size=10, tail_size=10, spill_dir=str(tmp_path))
+    text = "".join(f"line {i} é\n" for i in range(1000))
+    for start in range(0, len(text), 7):
+        buffer.append(text[start:start + 7])
+    assert buffer.spilled
+    assert "omitted" in buffer.getvalue()
+    
+    # Chunks cut through multi-byte characters are decoded whole
+    chunks = list(buffer.iter_text(chunk_size=5))
+    assert max(len(chunk) for chunk in chunks) <= 5
+    assert "".join(chunks) == text
+
+def test_iter_text_without_spill():
+    buffer = CaptureBuffer(head_size=10, tail_size=10)
+    buffer.append("short")
+    assert "".join(buffer.iter_text()) == "short"
+
+def test_output_buffer_joins_chunks():
+    buffer = OutputBuffer("a")
+    buffer.append("b")
+    buffer.append("")
+    buffer.append("c")
+    assert buffer.getvalue() == "abc" and len(buffer) == 3
+
+def test_capture_keeps_everything_within_budget():
+    buffer = CaptureBuffer(head_size=10, tail_size=10)
+    buffer.append("x" * 20)
+    assert buffer.getvalue() == "x" * 20
+    assert not buffer.overflowed and buffer.omitted == 0
+
+def test_capture_keeps_head_and_tail():
+    buffer = CaptureBuffer(head_size=10, tail_size=20)
+    text = "".join(f"{i:04d}\n" for i in range(100))
+    for start in range(0, len(text), 3):
+        buffer.append(text[start:start + 3])
+    value = buffer.getvalue()
+    assert len(buffer) == len(text)
+    assert buffer.omitted == len(text) - 30
+    assert value.startswith(text[:10])
+    assert f"[... {buffer.omitted} characters omitted ...]" in value
+    # The tail starts at a line start
+    assert value.endswith("0097\n0098\n0099\n")
+    assert not buffer.spilled
+
+def test_dump_and_load_keep_the_split():
+    buffer = CaptureBuffer(head_size=10, tail_size=10)
+    buffer.append("h" * 10 + "m" * 50 + "t" * 10)
+    restored = CaptureBuffer.load(buffer.dump(), head_size=10, tail_size=10)
+    assert restored.getvalue() == buffer.getvalue()
+    assert len(restored) == len(buffer)
+
+def test_spill_pages_cut_at_line_starts(tmp_path):
+    buffer = CaptureBuffer(head_size=10, tail_size=10, spill_dir=str(tmp_path))
+    lines = [f"line {i}\n" for i in range(500)]
+    text = "".join(lines)
+    buffer.append(text)
+    assert buffer.spilled and "full output in" in buffer.getvalue()
+    
+    page_size = 100
+    pages = [buffer.read_page(index, page_size) for index in range(buffer.page_count(page_size))]
+    assert buffer.page_count(page_size) == -(-len(text) // page_size)
+    assert all(page.endswith("\n") for page in pages)
+    assert all(page.startswith("line ") for page in pages if page)
+    # Together, the pages hold every line exactly once
+    assert "".join(pages) == text
+    assert buffer.read_page(len(pages) + 5, page_size) == ""
+
+def test_spill_file_is_removed(tmp_path):
+    import gc
+    buffer = CaptureBuffer(head_size=10, tail_size=10, spill_dir=str(tmp_path))
+    buffer.append("x" * 100)
+    path = buffer.spill_path
+    assert path is not None
+    del buffer
+    gc.collect()
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,92 @@
+import shutil
+
+import pytest
+
+import shell_session
+from command_cache import CACHE_ENV_VARS
+from shell_session import SHELL, ShellSession, _SentinelReader, _parse_trailer
+
+SENTINEL = "\n__LMTERM_DONE_0123456789abcdef"
+
+def read_chunks(chunks):
+    """Feed the chunks to a new reader; returns (command text, reader)"""
+    reader = _SentinelReader(SENTINEL)
+    text = ""
+    for chunk in chunks:
+        text += reader.feed(chunk)
+        if reader.done:
+            break
+    return text, reader
+
+def test_sentinel_split_at_every_position():
+    data = ("output é\nlast line" + SENTINEL + ":3:/tmp\n").encode("utf-8")
+    for split in range(len(data) + 1):
+        text, reader = read_chunks([data[:split], data[split:]])
+        assert text == "output é\nlast line", split
+        assert reader.done and reader.trailer == ":3:/tmp"
+
+def test_sentinel_one_byte_at_a_time():
+    data = ("abc" + SENTINEL + ":0:/\n").encode("utf-8")
+    text, reader = read_chunks([data[i:i + 1] for i in range(len(data))])
+    assert text == "abc" and reader.trailer == ":0:/"
+
+def test_partial_sentinel_in_output_is_released():
+    reader = _SentinelReader(SENTINEL)
+    assert reader.feed(b"x\n__LMTERM") == "x"
+    # The new line could start the sentinel, so it waits for the next data
+    assert reader.feed(b" not it\n") == "\n__LMTERM not it"
+    assert reader.feed(b"done") == "\ndone"
+    assert not reader.done
+
+def test_end_of_stream_without_sentinel():
+    reader = _SentinelReader(SENTINEL)
+    assert reader.feed(b"partial\n__LMT") == "partial"
+    assert reader.feed(b"", final=True) == "\n__LMT"
+    assert not reader.done
+
+def test_parse_trailer_with_environment():
+    values = ["=/usr/bin", "", "=me"] + ["=x:y"] * (len(CACHE_ENV_VARS) - 3)
+    code, cwd, environment = _parse_trailer(":1:/home/me/a:b" + "\x1f" + "\x1f".join(values))
+    assert (code, cwd) == (1, "/home/me/a:b")
+    assert environment["PATH"] == "/usr/bin" and environment["HOME"] is None and environment["USER"] == "me"
+    assert environment[CACHE_ENV_VARS[-1]] == "x:y"
+
+def test_parse_trailer_without_environment():
+    assert _parse_trailer(":0:/tmp") == (0, "/tmp", None)
+    assert _parse_trailer(":bad:/tmp") == (None, "/tmp", None)
+    assert _parse_trailer(None) == (None, "", None)
+
+@pytest.mark.skipif(shutil.which(SHELL) is None, reason="needs bash")
+def test_session_keeps_state(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "sub").mkdir()
+    session = ShellSession()
+    try:
+        result = session.run("cd sub && export TZ=Europe/Paris && echo hi", output=[])
+        assert result.exit_code == 0 and "".join(result.output) == "hi\n"
+        assert session.cwd == str(tmp_path / "sub")
+        assert session.environment["TZ"] == "Europe/Paris"
+        
+        result = session.run("echo $TZ; pwd; false", output=[])
+        assert result.exit_code == 1
+        assert "".join(result.output) == f"Europe/Paris\n{tmp_path / 'sub'}\n"
+    finally:
+        session.close()
+
+@pytest.mark.skipif(shutil.which(SHELL) is None, reason="needs bash")
+def test_limits_apply_in_a_subshell(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "sub").mkdir()
+    monkeypatch.setattr(shell_session, "resource_limits", lambda: [("-t", 7)])
+    session = ShellSession()
+    try:
+        result = session.run("ulimit -S -t; cd sub; export TZ=UTC; exit 3", output=[])
+        assert result.exit_code == 3 and "".join(result.output) == "7\n"
+        assert session.cwd == str(tmp_path / "sub")
+        
+        # The configured limit each time, not one that grows with the session
+        monkeypatch.setattr(shell_session, "resource_limits", lambda: [])
+        result = session.run("ulimit -S -t; pwd; echo ${TZ-unset}", output=[])
+        assert "".join(result.output) == f"unlimited\n{tmp_path / 'sub'}\nunset\n"
+    finally:
+        session.close()
@@ -7,58 +7,20 @@ import os
 
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
-from gi.repository import Gtk, Adw, GLib, Pango, Gdk, Gio
+from gi.repository import Gtk, Adw, GLib, Gdk, Gio
 
-from command_row import CommandRow
+from command_row import CommandRow, CommandRowView
 from terminal import execute_command, stream_command
-from lmstudio_manager import LMStudioManager
-
-class ScrollableRow(Gtk.ListBoxRow):
-    """
-    A ListBoxRow that can scroll itself into view within its parent ListBox.
-    """
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self._scroll_handler_id_value = None
-
-    def scroll_to_bottom(self):
-        """Scroll this row to the bottom of the visible area"""
-        list_box = self.get_parent()
-        if not list_box:
-            return False
-            
-        # Get the parent of the list box - could be a Viewport or ScrolledWindow
-        parent = list_box.get_parent()
-        
-        # Find the ScrolledWindow - it might be the parent of the Viewport
-        scrolled_parent = None
-        if isinstance(parent, Gtk.ScrolledWindow):
-            scrolled_parent = parent
-        elif isinstance(parent, Gtk.Viewport):
-            viewport_parent = parent.get_parent()
-            if isinstance(viewport_parent, Gtk.ScrolledWindow):
-                scrolled_parent = viewport_parent
-        
-        if not scrolled_parent:
-            return False
-            
-        # Get the adjustment
-        vadj = scrolled_parent.get_vadjustment()
-        if not vadj:
-            return False
-            
-        # Print adjustment values for debugging
-        print(f"DEBUG: vadj values - value: {vadj.get_value()}, upper: {vadj.get_upper()}, page_size: {vadj.get_page_size()}")
-            
-        # Schedule the scroll to happen after the UI has updated
-        def do_scroll():
-            new_value = vadj.get_upper() - vadj.get_page_size()
-            print(f"DEBUG: Setting vadj value to {new_value}")
-            vadj.set_value(new_value)
-            return False  # Don't call again
-            
-        GLib.idle_add(do_scroll)
-        return True
+from lmstudio_manager import LMStudioManager, AGENT_TOOLS
+from autoscroll import AutoScroller
+import mainloop_monitor
+from job_panel import JobPanel
+from jobs import JOBS
+from history import CommandHistory
+from history_popover import HistoryPopover
+from history_search import HistorySearchPopover
+from autosuggest import AutoSuggestion
+from config import get_config
 
 class LmTermWindow(Adw.ApplicationWindow):
     def __init__(self, **kwargs):
@@ -67,25 +29,22 @@ class LmTermWindow(Adw.ApplicationWindow):
         self.set_title("LM Term")
         
         # Initialize command history
-        self.command_history = []
-        self.history_index = -1
-        self.history_file = os.path.join(os.path.expanduser("~"), ".config", "lmterm", "history.json")
+        # The history is loaded and refreshed on a thread of its own; the
+        # widgets that follow it are updated from the main loop
+        self.history = CommandHistory(max_entries=get_config("history_size"), dispatch=GLib.idle_add)
         self.load_command_history()
         
         # Initialize LM Studio and available models
         self.lm_manager = LMStudioManager()
         self.available_models = self.lm_manager.available_models
         
-        # Keep track of command rows
-        self.command_rows = []
-        
         # Main layout
         self.main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
         
         # Create menu for the header bar
         menu = Gio.Menu.new()
         menu.append("About", "app.about")
-
+        
         
         # Create menu button
         menu_button = Gtk.MenuButton()
@@ -104,6 +63,25 @@ class LmTermWindow(Adw.ApplicationWindow):
         headerbar.pack_start(new_conversation_button)
         
         headerbar.pack_end(menu_button)
+        
+        # Background jobs button, with the job table in its popover
+        self.job_panel = JobPanel()
+        self.job_panel.set_margin_top(6)
+        self.job_panel.set_margin_bottom(6)
+        self.job_panel.set_margin_start(6)
+        self.job_panel.set_margin_end(6)
+        jobs_popover = Gtk.Popover()
+        jobs_popover.set_child(self.job_panel)
+        jobs_popover.connect("show", self.job_panel.start_refresh)
+        jobs_popover.connect("closed", self.job_panel.stop_refresh)
+        
+        self.jobs_button = Gtk.MenuButton()
+        self.jobs_button.set_icon_name("system-run-symbolic")
+        self.jobs_button.set_tooltip_text("Background Jobs")
+        self.jobs_button.set_popover(jobs_popover)
+        headerbar.pack_end(self.jobs_button)
+        GLib.timeout_add_seconds(1, self._update_jobs_button)
+        
         self.main_box.append(headerbar)
         
         # --- Content Area Setup ---
@@ -113,36 +91,48 @@ class LmTermWindow(Adw.ApplicationWindow):
         self.content_stack.set_vexpand(True)
         self.main_box.append(self.content_stack)
         self.content_stack.add_css_class("content_stack")
-
+        
         # 1. Welcome Screen
         welcome_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=12)
         welcome_box.set_halign(Gtk.Align.CENTER)
         welcome_box.set_valign(Gtk.Align.CENTER)
         welcome_box.set_hexpand(True)
         welcome_box.set_vexpand(True)
-
+        
         welcome_icon = Gtk.Image.new_from_file("lmTerm.png") # Load the icon
         welcome_icon.set_opacity(0.1) # Set opacity to 70%
         welcome_icon.set_pixel_size(256) # Optional: Set a size for the icon
         welcome_icon.add_css_class("welcome-icon")
-
+        
         welcome_box.append(welcome_icon)
         # You could add a label here too if desired
         # welcome_label = Gtk.Label(label="Enter a command or AI prompt below")
         # welcome_box.append(welcome_label)
-
+        
         self.content_stack.add_named(welcome_box, "welcome")
-
+        
         # 2. Command History Area
         scrolled = Gtk.ScrolledWindow()
         # scrolled.set_vexpand(True) # Vexpand is now on the stack
-
-        # Command history container (vertical box for accordion items)
-        self.command_container = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
-        scrolled.set_child(self.command_container)
-
+        
+        # Conversation rows live in a list store; the list view only creates
+        # widgets for the rows on screen and recycles them while scrolling
+        self.command_store = Gio.ListStore(item_type=CommandRow)
+        
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self._on_row_setup)
+        factory.connect("bind", self._on_row_bind)
+        factory.connect("unbind", self._on_row_unbind)
+        
+        self.command_list = Gtk.ListView(model=Gtk.NoSelection(model=self.command_store), factory=factory)
+        self.command_list.add_css_class("conversation")
+        scrolled.set_child(self.command_list)
+        
+        # Single controller for all scrolling of the conversation
+        self.autoscroll = AutoScroller(scrolled)
+        
         self.content_stack.add_named(scrolled, "history")
-
+        
         # Start by showing the welcome screen
         self.content_stack.set_visible_child_name("welcome")
         # --- End Content Area Setup ---
@@ -253,27 +243,23 @@ class LmTermWindow(Adw.ApplicationWindow):
         entry_overlay.set_child(self.command_entry)
         entry_overlay.add_overlay(self.prompt_frame)
         
+        # Inline suggestion from the history after the typed text
+        self.autosuggestion = None
+        if get_config("autosuggest", True):
+            self.autosuggestion = AutoSuggestion(self.command_entry, entry_overlay, self.history)
+        
         # Add the overlay to the entry container
         self.entry_container.append(entry_overlay)
         
-        # Create history popover
-        self.history_popover = Gtk.Popover()
-        self.history_popover.set_position(Gtk.PositionType.TOP)
+        # Up-arrow history popover, kept up to date by the history itself
+        self.history_popover = HistoryPopover(self.history, self._preview_history_command,
+                                              self._run_history_command, self._leave_history)
         self.history_popover.set_parent(self.command_entry)
         
-        # Create a scrolled window for the history list
-        history_scroll = Gtk.ScrolledWindow()
-        history_scroll.set_min_content_height(200)
-        history_scroll.set_max_content_height(400)
-        history_scroll.set_min_content_width(400)
-        
-        # Create a list box for history items
-        self.history_list = Gtk.ListBox()
-        self.history_list.set_selection_mode(Gtk.SelectionMode.SINGLE)
-        self.history_list.connect("row-activated", self.on_history_item_activated)
-        history_scroll.set_child(self.history_list)
-        
-        self.history_popover.set_child(history_scroll)
+        # Reverse search (Ctrl-R) over the whole history
+        self.history_search = HistorySearchPopover(self.history, self._run_history_command,
+                                                   self._edit_history_command)
+        self.history_search.set_parent(self.command_entry)
         
         input_box.append(self.entry_container)
         
@@ -285,9 +271,19 @@ class LmTermWindow(Adw.ApplicationWindow):
         input_area.append(input_box)
         
         # Set the main content
-        self.set_content(self.main_box)
+        monitor = mainloop_monitor.get_monitor()
+        if monitor:
+            # Show the main loop statistics on top of the window
+            overlay = Gtk.Overlay()
+            overlay.set_child(self.main_box)
+            overlay.add_overlay(monitor.create_overlay())
+            monitor.attach(self)
+            self.set_content(overlay)
+        else:
+            self.set_content(self.main_box)
         
         # Update the prompt with colors
+        self._prompt_directory = None
         self.update_prompt()
         
         # Connect to the map event to set focus on the command entry when window is shown
@@ -301,114 +297,74 @@ class LmTermWindow(Adw.ApplicationWindow):
         # Use a longer timeout for the initial update to ensure widgets are fully allocated
         GLib.timeout_add(300, self.update_entry_padding)
     
+    @property
+    def command_history(self):
+        """The history commands, oldest first"""
+        return self.history.commands()
+    
     def load_command_history(self):
-        """Load command history from file"""
-        try:
-            # Create directory if it doesn't exist
-            os.makedirs(os.path.dirname(self.history_file), exist_ok=True)
-            
-            if os.path.exists(self.history_file):
-                with open(self.history_file, 'r') as f:
-                    self.command_history = json.load(f)
-                    # Limit history size to 100 items
-                    if len(self.command_history) > 100:
-                        self.command_history = self.command_history[-100:]
-        except Exception as e:
-            self.command_history = []
+        """Load command history from the journal (importing the old history.json once)"""
+        self.history.load()
+        
+        # Take in the commands other lmTerm windows and processes append to the journal
+        journal = Gio.File.new_for_path(self.history.path)
+        self.history_monitor = journal.monitor_file(Gio.FileMonitorFlags.WATCH_MOVES, None)
+        self.history_monitor.connect("changed", self.on_history_file_changed)
     
-    def save_command_history(self):
-        """Save command history to file"""
-        try:
-            # Create directory if it doesn't exist
-            os.makedirs(os.path.dirname(self.history_file), exist_ok=True)
-            
-            with open(self.history_file, 'w') as f:
-                json.dump(self.command_history, f)
-        except Exception as e:
-            print(f"Error saving command history: {e}")
+    def on_history_file_changed(self, monitor, file, other_file, event_type):
+        """Read what was appended to the history journal, or follow it when it was compacted"""
+        self.history.refresh()
     
     def add_to_history(self, command):
-        """Add a command to history, avoiding duplicates"""
-        # Remove the command if it already exists to avoid duplicates
-        if command in self.command_history:
-            self.command_history.remove(command)
-        
-        # Add the command to the end of the list
-        self.command_history.append(command)
-        
-        # Limit history size to 100 items
-        if len(self.command_history) > 100:
-            self.command_history = self.command_history[-100:]
-        
-        # Save the updated history
-        self.save_command_history()
+        """Add a command to history; the history moves it to the end if it is already there"""
+        self.history.add(command, cwd=os.getcwd())
     
-    def populate_history_list(self):
-        """Populate the history list with items"""
-        # Clear existing items
-        while True:
-            row = self.history_list.get_first_child()
-            if row is None:
-                break
-            self.history_list.remove(row)
-        
-        # Add history items in order (oldest first)
-        # This will make the most recent items appear at the bottom
-        for cmd in self.command_history:
-            label = Gtk.Label(label=cmd)
-            label.set_halign(Gtk.Align.START)
-            label.set_ellipsize(Pango.EllipsizeMode.END)
-            label.set_max_width_chars(60)
-            label.set_margin_start(5)
-            label.set_margin_end(5)
-            label.set_margin_top(5)
-            label.set_margin_bottom(5)
-            
-            row = ScrollableRow()
-            row.set_child(label)
-            self.history_list.append(row)
-        
-        # Add key controller to the history list
-        key_controller = Gtk.EventControllerKey.new()
-        key_controller.connect("key-pressed", self.on_history_key_pressed)
-        self.history_list.add_controller(key_controller)
+    def _run_history_command(self, command):
+        """Run a command picked in the reverse search"""
+        self.command_entry.set_text(command)
+        self.on_command_submitted(None)
+    
+    def _edit_history_command(self, command):
+        """Put a command picked in the reverse search in the entry for editing"""
+        self.command_entry.set_text(command)
+        self.command_entry.grab_focus()
+        self.command_entry.set_position(-1)
+    
+    def _preview_history_command(self, command):
+        """Show the command selected in the history popover in the entry"""
+        self.command_entry.set_text(command)
+        if self.autosuggestion is not None:
+            self.autosuggestion.clear()
+    
+    def _leave_history(self):
+        """Clear the entry after moving down past the most recent command"""
+        self.command_entry.set_text("")
+        self.command_entry.grab_focus()
     
     def on_key_pressed(self, controller, keyval, keycode, state):
         """Handle key press events for command entry navigation"""
+        # Ctrl-R starts a reverse search with what was typed so far
+        if keyval == Gdk.KEY_r and state & Gdk.ModifierType.CONTROL_MASK:
+            self.history_popover.popdown()
+            self.history_search.set_size_request(self.command_entry.get_allocated_width(), -1)
+            self.history_search.open(self.command_entry.get_text())
+            return True
+        
+        # Right or End at the end of the text takes the inline suggestion
+        if keyval in (Gdk.KEY_Right, Gdk.KEY_End) and self.autosuggestion is not None:
+            if self.autosuggestion.accept():
+                return True
+        
         # Check for Up arrow key
         if keyval == Gdk.KEY_Up:
-            # If popover is not visible, show it and populate
+            # Show the popover with the most recent command, or move up in it
             if not self.history_popover.get_visible():
-                self.populate_history_list()
-                
                 # Set the popover width to match the entry width
                 entry_width = self.command_entry.get_allocated_width()
                 self.history_popover.set_size_request(entry_width, -1)
-                
-                self.history_popover.popup()
-                
-                # Select the last (most recent) item in the history list
-                if len(self.command_history) > 0:
-                    last_index = len(self.command_history) - 1
-                    self.history_index = last_index
-                    row = self.history_list.get_row_at_index(last_index)
-                    if row:
-                        self.history_list.select_row(row)
-                        row.grab_focus()
-                        # Scroll to the bottom to show the most recent item
-                        row.scroll_to_bottom()
-                        self.command_entry.set_text(self.command_history[-1])
-            
-            # Select the previous item in the history list (moving up)
-            elif self.history_index > 0:
-                self.history_index -= 1
-                row = self.history_list.get_row_at_index(self.history_index)
-                if row:
-                    self.history_list.select_row(row)
-                    # Scroll to the selected row
-                    row.grab_focus()
-                    # Set the text in the entry
-                    self.command_entry.set_text(self.command_history[self.history_index])
+                self.history_popover.open()
+            else:
+                self.history_popover.select_previous()
             
             return True  # Stop event propagation
         
@@ -416,23 +372,7 @@ class LmTermWindow(Adw.ApplicationWindow):
         elif keyval == Gdk.KEY_Down:
             # If we're navigating history
             if self.history_popover.get_visible():
-                if self.history_index < len(self.command_history) - 1:
-                    self.history_index += 1
-                    row = self.history_list.get_row_at_index(self.history_index)
-                    if row:
-                        self.history_list.select_row(row)
-                        # Scroll to the selected row
-                        row.grab_focus()
-                        # Set the text in the entry
-                        self.command_entry.set_text(self.command_history[self.history_index])
-                else:
-                    # We're at the bottom item, clear the entry and close the popover
-                    self.command_entry.set_text("")
-                    self.history_popover.popdown()
-                    self.history_index = -1
-                    # Set focus back to the command entry
-                    self.command_entry.grab_focus()
-                
+                self.history_popover.select_next()
                 return True  # Stop event propagation
         
         # Check for Escape key to close the popover
@@ -455,70 +395,6 @@ class LmTermWindow(Adw.ApplicationWindow):
         
         return False  # Continue event propagation
     
-    def on_history_key_pressed(self, controller, keyval, keycode, state):
-        """Handle key press events for history list navigation"""
-        # Check for Down arrow key
-        if keyval == Gdk.KEY_Down:
-            if self.history_index < len(self.command_history) - 1:
-                self.history_index += 1
-                row = self.history_list.get_row_at_index(self.history_index)
-                if row:
-                    self.history_list.select_row(row)
-                    row.grab_focus()
-                    self.command_entry.set_text(self.command_history[self.history_index])
-            else:
-                # We're at the bottom item, clear the entry and close the popover
-                self.command_entry.set_text("")
-                self.history_popover.popdown()
-                self.history_index = -1
-                self.command_entry.grab_focus()
-            
-            return True  # Stop event propagation
-        
-        # Check for Up arrow key
-        elif keyval == Gdk.KEY_Up:
-            if self.history_index > 0:
-                self.history_index -= 1
-                row = self.history_list.get_row_at_index(self.history_index)
-                if row:
-                    self.history_list.select_row(row)
-                    row.grab_focus()
-                    self.command_entry.set_text(self.command_history[self.history_index])
-            
-            return True  # Stop event propagation
-        
-        # Check for Enter key to execute the selected command immediately
-        elif keyval == Gdk.KEY_Return or keyval == Gdk.KEY_KP_Enter:
-            # Get the current text from the entry
-            command = self.command_entry.get_text()
-            if command:
-                # Close the popover
-                self.history_popover.popdown()
-                # Execute the command
-                self.on_command_submitted(None)
-            
-            return True  # Stop event propagation
-        
-        # Check for Escape key to close the popover
-        elif keyval == Gdk.KEY_Escape:
-            self.history_popover.popdown()
-            return True  # Stop event propagation
-        
-        return False  # Continue event propagation
-    
-    def on_history_item_activated(self, list_box, row):
-        """Handle history item selection"""
-        index = row.get_index()
-        if 0 <= index < len(self.command_history):
-            # Set the text in the entry
-            self.command_entry.set_text(self.command_history[index])
-            # Close the popover
-            self.history_popover.popdown()
-            # Move cursor to the end of the text
-            self.command_entry.set_position(-1)
-            # Execute the command immediately
-            self.on_command_submitted(None)
-    
     def populate_model_dropdown(self):
         """Populate the model dropdown with available models"""
         # Clear existing items
@@ -564,25 +440,21 @@ class LmTermWindow(Adw.ApplicationWindow):
         text = self.command_entry.get_text()
         if not text:
             return
-            
+        
         # Switch to history view if it's the first command
-        if not self.command_rows:
+        if self.command_store.get_n_items() == 0:
              self.content_stack.set_visible_child_name("history")
-
+        
         # Add to history
         self.add_to_history(text)
-        self.history_index = -1
-            
+        
         # Clear the entry
         self.command_entry.set_text("")
         
-        # Create a new command row
+        # Create a new command row and follow the conversation again
         command_row = CommandRow()
-        self.command_container.append(command_row)
-        
-        # Add to command_rows list
-        self.command_rows.append(command_row)
-        print(f"Added new command row to command_rows list. Total rows: {len(self.command_rows)}")
+        self.append_command_row(command_row, follow=True)
+        print(f"Added new command row. Total rows: {self.command_store.get_n_items()}")
         
         # Process based on mode
         is_ai_mode = self.mode_switch.get_active()
@@ -598,9 +470,6 @@ class LmTermWindow(Adw.ApplicationWindow):
             command_row.set_command(text)
             threading.Thread(target=self._execute_command, 
                             args=(command_row, text)).start()
-        
-        # Ensure scrolling happens after the UI has updated with the new content
-        GLib.idle_add(self._scroll_to_bottom)
     
     def _process_ai_prompt(self, command_row, prompt, is_agent_mode):
         """Process an AI prompt using LM Studio"""
@@ -609,7 +478,7 @@ class LmTermWindow(Adw.ApplicationWindow):
                 GLib.idle_add(command_row.set_ai_response, 
                              "Error: No model loaded. Please select a model.")
                 return
-                
+            
             # Initialize the AI response with a spinner
             GLib.idle_add(command_row.start_ai_response)
             
@@ -619,23 +488,7 @@ class LmTermWindow(Adw.ApplicationWindow):
                     """Execute a terminal command and return the output."""
                     return f"Command execution requires user confirmation: {command}"
                 
-                tools = [{
-                    "type": "function",
-                    "function": {
-                        "name": "terminal_execute",
-                        "description": "Execute a terminal command and return the output.",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "command": {
-                                    "type": "string",
-                                    "description": "The command to execute"
-                                }
-                            },
-                            "required": ["command"]
-                        }
-                    }
-                }]
+                tools = AGENT_TOOLS
                 
                 # Define callbacks for streaming
                 def on_chunk(chunk):
@@ -700,7 +553,7 @@ class LmTermWindow(Adw.ApplicationWindow):
                     on_chunk=on_chunk,
                     on_complete=on_complete
                 )
-            
+        
         except Exception as e:
             GLib.idle_add(command_row.set_ai_response, f"Error: {str(e)}")
     
@@ -708,27 +561,28 @@ class LmTermWindow(Adw.ApplicationWindow):
         """Execute a command and add it to the terminal output"""
         try:
             # Use stream_command instead of execute_command
+            # The prompt follows the working directory through parent_widget
             result = stream_command(command, parent_widget=self, command_row=command_row)
-            
-            # Update the prompt if the command was a cd command
-            if command.strip().startswith("cd "):
-                GLib.idle_add(self.update_prompt)
         except Exception as e:
             import traceback
             traceback.print_exc()
             GLib.idle_add(command_row.set_command_output, f"Error: {str(e)}")
     
+    def _update_jobs_button(self):
+        """Highlight the jobs button while background jobs are running"""
+        running = JOBS.running_count()
+        if running:
+            self.jobs_button.add_css_class("jobs-running")
+            self.jobs_button.set_tooltip_text(f"Background Jobs ({running} running)")
+        else:
+            self.jobs_button.remove_css_class("jobs-running")
+            self.jobs_button.set_tooltip_text("Background Jobs")
+        return True
+    
     def on_new_conversation(self, button):
         """Handle new conversation button click"""
-        # Clear all command rows from the container
-        while True:
-            child = self.command_container.get_first_child()
-            if child is None:
-                break
-            self.command_container.remove(child)
-        
-        # Clear the command_rows list
-        self.command_rows = []
+        # Clear all command rows
+        self.command_store.remove_all()
         
         # Switch back to the welcome screen
         self.content_stack.set_visible_child_name("welcome")
@@ -738,54 +592,52 @@ class LmTermWindow(Adw.ApplicationWindow):
         
         # Focus the command entry
         self.command_entry.grab_focus()
-
+    
     def add_command_row(self, prompt, is_agent_mode=False):
         """Add a new command row to the chat"""
         command_row = CommandRow()
+        self.append_command_row(command_row)
         command_row.set_user_prompt(prompt)
-        self.command_history.append(command_row)
-        
-        # Keep track of this command row
-        self.command_rows.append(command_row)
         
         # Process the prompt
         threading.Thread(target=self._process_ai_prompt, 
                         args=(command_row, prompt, is_agent_mode)).start()
         
         return command_row 
-
-    def _scroll_to_bottom(self):
-        """Scroll to the bottom of the conversation view"""
-        # Find the ScrolledWindow within the stack's visible child
-        visible_child = self.content_stack.get_visible_child()
-        scrolled = None
-        if isinstance(visible_child, Gtk.ScrolledWindow):
-             scrolled = visible_child
-        # If the visible child is the welcome screen, we don't need to scroll
-        elif self.content_stack.get_visible_child_name() == "history":
-             # It might take a moment for the stack to switch, find it by name
-             child = self.content_stack.get_child_by_name("history")
-             if isinstance(child, Gtk.ScrolledWindow):
-                 scrolled = child
-
-        if scrolled:
-            # Get the adjustment and scroll to the bottom
-            vadj = scrolled.get_vadjustment()
-            if vadj:
-                # Schedule the scroll to happen after the UI has updated
-                def do_scroll():
-                    # Make sure we get the latest values
-                    vadj = scrolled.get_vadjustment()
-                    if vadj:
-                        new_value = vadj.get_upper() - vadj.get_page_size()
-                        vadj.set_value(new_value)
-                    return False  # Don't call again
-                    
-                GLib.idle_add(do_scroll)
-
+    
+    def append_command_row(self, command_row, follow=False):
+        """Add a command row to the end of the conversation"""
+        command_row.window = self
+        self.command_store.append(command_row)
+        
+        # Rows started by the user bring the view back to the bottom,
+        # other rows only scroll it if we are still following
+        if follow:
+            self.autoscroll.scroll_to_bottom()
+        else:
+            self.autoscroll.request()
+    
+    def _on_row_setup(self, factory, list_item):
+        """Create a recyclable view for conversation rows"""
+        list_item.set_activatable(False)
+        list_item.set_selectable(False)
+        list_item.set_child(CommandRowView())
+    
+    def _on_row_bind(self, factory, list_item):
+        """Show a conversation row in a view"""
+        list_item.get_child().bind(list_item.get_item())
+    
+    def _on_row_unbind(self, factory, list_item):
+        """Detach a view from the row it was showing"""
+        list_item.get_child().unbind()
+    
     def update_prompt(self):
         """Update the shell prompt with the current directory"""
-        current_dir = os.path.basename(os.getcwd())
+        # Called after every command, so only a changed directory is redrawn
+        if os.getcwd() == self._prompt_directory:
+            return
+        self._prompt_directory = os.getcwd()
+        current_dir = os.path.basename(self._prompt_directory)
         
         # Use markup with colored spans
         user_host = f"<span foreground='#4CAF50'>{os.getenv('USER')}@{os.getenv('HOSTNAME', 'localhost')}</span>"
@@ -810,7 +662,7 @@ class LmTermWindow(Adw.ApplicationWindow):
         
         # Also schedule an update after a short delay as a fallback
         GLib.timeout_add(100, self.update_entry_padding)
-
+    
     def update_entry_padding(self):
         """Update the command entry padding to match the prompt width"""
         # Get the width of the prompt frame